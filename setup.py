@@ -9,14 +9,12 @@ setup(
     install_requires=[
         "numpy",
         "scipy",
-        "scikit-learn",
         "matplotlib",
         "pandas",
         "scikit-build",
         "pyyaml",
         "biopython",
         "pdbecif",
-        "memory_profiler",
         "tqdm",
         "icecream",
         "mrcfile",
@@ -30,6 +28,9 @@ setup(
             "pyrallex2.validate=PyralleX2.main:validate_config",
             "pyrallex2.simulate=PyralleX2.main:simulate",
             "pyrallex2.visualise=PyralleX2.main:viewslice",
+            "pyrallex2.cache=PyralleX2.main:cache",
+            "pyrallex2.sweep=PyralleX2.main:sweep",
+            "pyrallex2.bench=PyralleX2.main:bench",
         ]
     }
 )
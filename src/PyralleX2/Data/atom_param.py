@@ -1,13 +1,67 @@
 """
 atom_param.py
-Version: 0.1
+Version: 0.2
 
 AUTHOR: Neville Yee
 Date: 08-Feb-2021
 """
 
+import csv
 import pathlib
-import pandas as pd
+
+import numpy as np
 
 CURR_PATH = str(pathlib.Path(__file__).parent.absolute()) + '/'
-atom_params = pd.read_csv(CURR_PATH+'Atoms.csv')
+
+
+def _read_element_index(filename):
+    """
+    Read the element parameter table into a dict keyed by element name
+
+    ARGS:
+    filename (str): path to the csv table (Name, Charge, Width)
+
+    RETURNS:
+    dict of (charge, width)
+    """
+
+    with open(filename, 'r', newline='') as f:
+        return {row['Name']: (int(row['Charge']), float(row['Width'])) for row in csv.DictReader(f)}
+
+
+element_index = _read_element_index(CURR_PATH+'Atoms.csv')
+
+
+def lookup(elements):
+    """
+    Look up the parameters of an array of elements
+
+    Each distinct element is looked up once; atoms are mapped to them by index.
+
+    ARGS:
+    elements (ndarray): element name of each atom
+
+    RETURNS:
+    tuple (distinct elements, index of each atom into them, charges, widths of the distinct elements)
+    """
+
+    symbols, inverse = np.unique(np.asarray(elements, dtype=str), return_inverse=True)
+
+    unknown = [str(symbol) for symbol in symbols if symbol not in element_index]
+    if len(unknown) > 0:
+        raise ValueError("Error in atom_param.lookup: no parameters for element(s) {} in {}.".format(
+            ', '.join(unknown), CURR_PATH+'Atoms.csv'))
+
+    charges = np.array([element_index[symbol][0] for symbol in symbols], dtype=np.float64)
+    widths = np.array([element_index[symbol][1] for symbol in symbols], dtype=np.float64)
+
+    return symbols, inverse.ravel(), charges, widths
+
+
+def __getattr__(name):
+    # The pandas table is only built (and pandas imported) on first use
+    if name == 'atom_params':
+        import pandas as pd
+        globals()['atom_params'] = pd.read_csv(CURR_PATH+'Atoms.csv')
+        return globals()['atom_params']
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
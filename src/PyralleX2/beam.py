@@ -7,7 +7,6 @@ Date: 4-Feb-2021
 """
 
 import numpy as np
-from sklearn.preprocessing import normalize
 
 class Beam:
     """
@@ -29,7 +28,10 @@ class Beam:
         """
 
         self.wavelength = wavelength
-        self.beam_vec = normalize(np.array(beam_vec, dtype=np.float32).reshape(1, -1))[0]
+        self.beam_vec = np.array(beam_vec, dtype=np.float32)
+        beam_norm = np.linalg.norm(self.beam_vec)
+        if beam_norm > 0:
+            self.beam_vec /= beam_norm
 
 
 def create_beam(
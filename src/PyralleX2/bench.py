@@ -0,0 +1,645 @@
+"""
+pyrallex2.bench.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from . import screen as Screen
+
+
+# Import-time budget (in ms) of each console script, and the modules each
+# task imports (PyralleX2.main plus the task's lazy imports)
+IMPORT_BUDGETS = {
+    'pyrallex2.clear': (100, []),
+    'pyrallex2.validate': (250, ['PyralleX2.params']),
+    'pyrallex2.cache': (400, ['PyralleX2.cache']),
+    'pyrallex2.simulate': (800, ['PyralleX2.params',
+                                 'PyralleX2.checkpoint',
+                                 'PyralleX2.simulation',
+                                 'PyralleX2.sample',
+                                 'PyralleX2.beam',
+                                 'PyralleX2.screen',
+                                 'PyralleX2.structure_factor',
+                                 'PyralleX2.cache']),
+    'pyrallex2.sweep': (800, ['PyralleX2.params', 'PyralleX2.sweep']),
+    'pyrallex2.bench': (800, ['PyralleX2.bench']),
+    'pyrallex2.visualise': (2500, ['PyralleX2.params', 'PyralleX2.visualise']),
+    'pyrallex2.new': (4000, ['PyralleX2.params', 'PyralleX2.magicgui']),
+}
+
+
+def time_screen_construction(
+        npix_list=(128, 256, 512, 1024, 2048, 4096),
+        screen_shape='Flat',
+        dims=10.,
+        max_twotheta=60.,
+        beam_axis=(0.3, 0.2, 1.),
+        repeats=3,
+):
+    """
+    Time the construction of Screen objects against number of pixels
+
+    ARGS:
+    npix_list (list): numbers of pixels along each screen axis
+    screen_shape (str): shape of detector screen ('Flat' / 'Cylindrical')
+    dims (float): real dimensions of screen (in cm)
+    max_twotheta (float): maximum two-theta angle on horizontal/vertical axis
+    beam_axis (list): axis of xray beam (off the default axis, so the rotation is timed)
+    repeats (int): number of repeats, of which the fastest is reported
+
+    RETURNS:
+    list of dict
+    """
+
+    results = []
+    for npix in npix_list:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            Screen.create_screen(npix=npix,
+                                 dims=dims,
+                                 screen_shape=screen_shape,
+                                 max_twotheta=max_twotheta,
+                                 beam_axis=list(beam_axis),
+            )
+            timings.append(time.perf_counter() - start)
+        results.append({'npix': npix, 'screen_shape': screen_shape, 'seconds': min(timings)})
+
+    return results
+
+
+# Reference samples of the precision report: (name, number of atoms, cell length, supercell dims)
+PRECISION_CASES = [
+    ('small cell', 64, 10., [3, 3, 3]),
+    ('large cell', 2000, 30., [3, 3, 3]),
+    ('large supercell', 64, 10., [40, 40, 40]),
+]
+
+
+# Elements of synthetic samples, of which the first K are drawn for K elements
+SYNTHETIC_ELEMENTS = ('C', 'N', 'O', 'S', 'P', 'H', 'Fe', 'Ca', 'Zn', 'Cu', 'Mg', 'Na', 'K', 'Cl')
+
+
+def synthetic_atoms(num_atoms, elements=('C', 'N', 'O', 'S'), seed=0):
+    """
+    Draw the elements and fractional positions of randomly placed atoms
+
+    ARGS:
+    num_atoms (int): number of atoms in the unit cell
+    elements (list): elements drawn for the atoms
+    seed (int): seed of the random positions
+
+    RETURNS:
+    tuple (element of each atom, fractional positions (N x 3))
+    """
+
+    rng = np.random.default_rng(seed)
+    atom_elements = rng.choice(elements, num_atoms)
+    frac_positions = rng.uniform(0., 1., (num_atoms, 3))
+
+    return atom_elements, frac_positions
+
+
+def synthetic_sample(num_atoms, cell_length, supercell_dims, elements=('C', 'N', 'O', 'S'), seed=0):
+    """
+    Create a sample of randomly placed atoms in a cubic unit cell
+
+    ARGS:
+    num_atoms (int): number of atoms in the unit cell
+    cell_length (float): length of the cubic cell (in Angstroms)
+    supercell_dims (list): dimensions of the supercell
+    elements (list): elements drawn for the atoms
+    seed (int): seed of the random positions
+
+    RETURNS:
+    Sample object
+    """
+
+    from . import sample as Sample
+    from .Data import atom_param as Atom_param
+
+    atom_elements, frac_positions = synthetic_atoms(num_atoms, elements, seed)
+    symbols, element_index, charges, widths = Atom_param.lookup(atom_elements)
+    cell_vec = cell_length * np.eye(3)
+
+    sample = Sample.Sample(cell_vec=cell_vec,
+                           supercell_dims=list(supercell_dims),
+                           elements=symbols,
+                           charges=charges,
+                           widths=widths,
+                           element_index=element_index,
+                           positions=frac_positions @ cell_vec,
+                           frac_positions=frac_positions,
+    )
+    sample.centre()
+
+    return sample
+
+
+def precision_report(cases=PRECISION_CASES, npix=256, num_images=3, angle_step=10):
+    """
+    Compare single against double precision simulations of reference samples,
+    and the grouped engine at each precision against the per-atom reference
+    engine (see structure_factor.REFERENCE_TOLERANCE)
+
+    ARGS:
+    cases (list): reference samples, as (name, number of atoms, cell length, supercell dims)
+    npix (int): number of pixels along each screen axis
+    num_images (int): number of frames of each tomogram
+    angle_step (float): rotation between frames (in degrees)
+
+    RETURNS:
+    list of dict
+    """
+
+    from . import beam as Beam
+    from . import simulation as Simulation
+    from . import structure_factor as SF
+
+    beam = Beam.create_beam(wavelength=1., beam_vec=[1, 0, 0])
+    screen = Screen.create_screen(npix=npix, dims=10., screen_shape='Flat', max_twotheta=60., beam_axis=[1, 0, 0])
+    geometry = Simulation.screen_geometry(screen, beam)
+
+    def simulate(num_atoms, cell_length, supercell_dims, precision, sf_engine):
+        sim = Simulation.create_simulation(synthetic_sample(num_atoms, cell_length, supercell_dims),
+                                           screen,
+                                           beam,
+                                           mct=True,
+                                           mct_rot_axis=[0, 0, 1],
+                                           mct_angle_step=angle_step,
+                                           mct_max_angle=angle_step*(num_images-1),
+                                           bs_coverage=2.,
+                                           geometry=geometry,
+                                           precision=precision,
+                                           sf_engine=sf_engine,
+        )
+        start = time.perf_counter()
+        sim.full_scan()
+        return sim.all_intensities, time.perf_counter() - start
+
+    results = []
+    for name, num_atoms, cell_length, supercell_dims in cases:
+        stacks = {}
+        seconds = {}
+        reference_errors = {}
+        for precision in ['double', 'single']:
+            stacks[precision], seconds[precision] = simulate(num_atoms, cell_length, supercell_dims, precision, 'grouped')
+            reference, _ = simulate(num_atoms, cell_length, supercell_dims, precision, 'reference')
+            reference_errors[precision] = float(np.max(np.abs(stacks[precision] - reference)))
+
+        error = stacks['single'] - stacks['double']
+        results.append({
+            'case': name,
+            'max_abs_error': float(np.max(np.abs(error))),
+            'rel_l2_error': float(np.linalg.norm(error) / np.linalg.norm(stacks['double'])),
+            'double_seconds': seconds['double'],
+            'single_seconds': seconds['single'],
+            'double_mb': stacks['double'].nbytes / 1024**2,
+            'single_mb': stacks['single'].nbytes / 1024**2,
+            'double_reference_error': reference_errors['double'],
+            'single_reference_error': reference_errors['single'],
+            'within_tolerance': all(reference_errors[precision] <= SF.REFERENCE_TOLERANCE[precision]
+                                    for precision in reference_errors),
+        })
+
+    return results
+
+
+def write_synthetic_xyz(filename, num_atoms, cell_length, num_elements=4, seed=0):
+    """
+    Write the atoms of a synthetic sample (see synthetic_atoms) in a cubic
+    unit cell to an xyz file, so that reading the sample can be timed
+
+    ARGS:
+    filename (str): name of the xyz file
+    num_atoms (int): number of atoms in the unit cell
+    cell_length (float): length of the cubic cell (in Angstroms)
+    num_elements (int): number of distinct elements (at most len(SYNTHETIC_ELEMENTS))
+    seed (int): seed of the random positions
+    """
+
+    assert (0 < num_elements <= len(SYNTHETIC_ELEMENTS)), \
+        "Error in bench.write_synthetic_xyz: num_elements must be between 1 and {}.".format(len(SYNTHETIC_ELEMENTS))
+
+    atom_elements, frac_positions = synthetic_atoms(num_atoms, SYNTHETIC_ELEMENTS[:num_elements], seed)
+    # Truncated rather than rounded, so no atom is written onto the far cell faces
+    positions = np.floor(frac_positions * cell_length * 1.e6) / 1.e6
+
+    with open(filename, 'w') as f:
+        f.write("{}\nsynthetic sample (seed {})\n".format(num_atoms, seed))
+        for element, position in zip(atom_elements, positions):
+            f.write("{} {:.6f} {:.6f} {:.6f}\n".format(element, *position))
+
+
+def measure(func, *args, trace_memory=True, **kwargs):
+    """
+    Time a call, and trace the peak of memory allocated during it
+
+    Memory is traced with tracemalloc, which also records numpy arrays; the
+    tracing slows down pure Python code, so runs to be compared should use
+    the same setting.
+
+    ARGS:
+    func (function): function to be called with args and kwargs
+    trace_memory (bool): trace the peak allocation
+
+    RETURNS:
+    tuple (result of the call, dict of seconds and peak_mb (None if not traced))
+    """
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2 if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return result, {'seconds': seconds, 'peak_mb': peak_mb}
+
+
+# Stages timed in each case of the scaling benchmark
+STAGES = ['create_sample', 'create_screen', 'full_scan', 'export_mrc', 'export_spectra']
+
+# Parameters of the scaling benchmark; lists are swept over (see scaling_benchmark)
+DEFAULT_SCALING = {
+    'num_atoms': [64, 256, 1024],
+    'num_elements': 4,
+    'cell_length': 20.,
+    'supercell_dims': [3, 3, 3],
+    'npix': [128, 256],
+    'num_images': 3,
+    'angle_step': 10,
+    'sf_engine': 'grouped',
+    'precision': 'double',
+    'trace_memory': True,
+    'seed': 0,
+    'output': 'pyrallex2_bench',
+}
+
+
+def benchmark_case(
+        workdir,
+        num_atoms,
+        npix,
+        num_elements=4,
+        cell_length=20.,
+        supercell_dims=(3, 3, 3),
+        num_images=3,
+        angle_step=10,
+        sf_engine='grouped',
+        precision='double',
+        trace_memory=True,
+        seed=0,
+):
+    """
+    Time (and trace the memory of) each stage of a simulation of a synthetic sample
+
+    ARGS:
+    workdir (str): folder for the coordinates file and exported stacks
+    num_atoms (int): number of atoms in the unit cell
+    npix (int): number of pixels along each screen axis
+    num_elements (int): number of distinct elements
+    cell_length (float): length of the cubic cell (in Angstroms)
+    supercell_dims (list): dimensions of the supercell
+    num_images (int): number of frames of the tomogram
+    angle_step (float): rotation between frames (in degrees)
+    sf_engine (str): structure-factor engine of the simulation
+    precision (str): floating point precision of the simulation
+    trace_memory (bool): trace the peak allocation of each stage
+    seed (int): seed of the random positions
+
+    RETURNS:
+    dict (parameters of the case, then seconds and peak_mb of each stage)
+    """
+
+    from . import beam as Beam
+    from . import sample as Sample
+    from . import simulation as Simulation
+
+    coords_file = os.path.join(workdir, 'synthetic.xyz')
+    write_synthetic_xyz(coords_file, num_atoms, cell_length, num_elements=num_elements, seed=seed)
+
+    stages = {}
+    sample, stages['create_sample'] = measure(Sample.create_sample,
+                                              coords_file,
+                                              'Full',
+                                              list((cell_length * np.eye(3)).ravel()),
+                                              list(supercell_dims),
+                                              trace_memory=trace_memory,
+    )
+    screen, stages['create_screen'] = measure(Screen.create_screen,
+                                              npix=npix,
+                                              dims=10.,
+                                              screen_shape='Flat',
+                                              max_twotheta=60.,
+                                              beam_axis=[1, 0, 0],
+                                              trace_memory=trace_memory,
+    )
+
+    beam = Beam.create_beam(wavelength=1., beam_vec=[1, 0, 0])
+    sim = Simulation.create_simulation(sample,
+                                       screen,
+                                       beam,
+                                       mct=True,
+                                       mct_rot_axis=[0, 0, 1],
+                                       mct_angle_step=angle_step,
+                                       mct_max_angle=angle_step*(num_images-1),
+                                       bs_coverage=2.,
+                                       sf_engine=sf_engine,
+                                       precision=precision,
+    )
+    _, stages['full_scan'] = measure(sim.full_scan, trace_memory=trace_memory)
+    _, stages['export_mrc'] = measure(Simulation.export_mrc, os.path.join(workdir, 'bench.mrc'), sim,
+                                      trace_memory=trace_memory)
+    _, stages['export_spectra'] = measure(Simulation.export_spectra, os.path.join(workdir, 'bench_spectra.mrc'), sim,
+                                          trace_memory=trace_memory)
+
+    result = {
+        'num_atoms': num_atoms,
+        'num_elements': num_elements,
+        'cell_length': cell_length,
+        'supercell_dims': 'x'.join(str(dim) for dim in supercell_dims),
+        'npix': npix,
+        'num_images': sim.num_images,
+        'sf_engine': sf_engine,
+        'precision': precision,
+    }
+    for stage in STAGES:
+        result[stage+'_seconds'] = stages[stage]['seconds']
+        result[stage+'_peak_mb'] = stages[stage]['peak_mb']
+    result['full_scan_seconds_per_frame'] = stages['full_scan']['seconds'] / sim.num_images
+
+    return result
+
+
+def benchmark_metadata(settings):
+    """
+    Environment of a benchmark run, stored with its results so that runs
+    of different versions can be compared
+
+    ARGS:
+    settings (dict): parameters of the run
+
+    RETURNS:
+    dict
+    """
+
+    from . import kernels as Kernels
+
+    try:
+        from importlib.metadata import version
+        package_version = version('PyralleX2')
+    except Exception:
+        package_version = None
+
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'package_version': package_version,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': Kernels.numba_available(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': settings,
+    }
+
+
+def scaling_benchmark(settings=None):
+    """
+    Run benchmark_case over every combination of the swept number of atoms and
+    screen pixels, and write the scaling curves to <output>.json and <output>.csv
+
+    ARGS:
+    settings (dict): parameters overriding DEFAULT_SCALING
+
+    RETURNS:
+    list of dict (results of the cases)
+    """
+
+    settings = dict(DEFAULT_SCALING, **(settings or {}))
+    atom_list = settings['num_atoms'] if isinstance(settings['num_atoms'], list) else [settings['num_atoms']]
+    npix_list = settings['npix'] if isinstance(settings['npix'], list) else [settings['npix']]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pyrallex2_bench_') as workdir:
+        for num_atoms in atom_list:
+            for npix in npix_list:
+                result = benchmark_case(workdir,
+                                        num_atoms,
+                                        npix,
+                                        num_elements=settings['num_elements'],
+                                        cell_length=settings['cell_length'],
+                                        supercell_dims=settings['supercell_dims'],
+                                        num_images=settings['num_images'],
+                                        angle_step=settings['angle_step'],
+                                        sf_engine=settings['sf_engine'],
+                                        precision=settings['precision'],
+                                        trace_memory=settings['trace_memory'],
+                                        seed=settings['seed'],
+                )
+                print("num_atoms = {num_atoms:6d}, npix = {npix:5d}: "
+                      "full_scan {full_scan_seconds:8.3f} s ({full_scan_seconds_per_frame:.3f} s/frame)".format(**result))
+                results.append(result)
+
+    write_results(settings['output'], results, benchmark_metadata(settings))
+
+    return results
+
+
+def write_results(stem, results, metadata):
+    """
+    Write benchmark results to <stem>.json (with metadata) and <stem>.csv
+
+    ARGS:
+    stem (str): name of the output files without extension
+    results (list): results of the cases (dicts with the same keys)
+    metadata (dict): environment of the run (see benchmark_metadata)
+    """
+
+    with open(stem+'.json', 'w') as f:
+        json.dump({'metadata': metadata, 'results': results}, f, indent=4)
+
+    with open(stem+'.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else [])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def compare_results(baseline_file, current_file):
+    """
+    Compare the stage timings of two benchmark runs (JSON files of
+    scaling_benchmark), case by case
+
+    ARGS:
+    baseline_file (str): results of the baseline run
+    current_file (str): results of the run compared against it
+
+    RETURNS:
+    list of dict (case, stage, seconds of both runs and their ratio)
+    """
+
+    case_keys = ['num_atoms', 'num_elements', 'cell_length', 'supercell_dims', 'npix', 'num_images',
+                 'sf_engine', 'precision']
+
+    runs = []
+    for filename in [baseline_file, current_file]:
+        with open(filename, 'r') as f:
+            runs.append({tuple(result[key] for key in case_keys): result for result in json.load(f)['results']})
+    baseline, current = runs
+
+    comparison = []
+    for case in baseline:
+        if case not in current:
+            continue
+        for stage in STAGES:
+            before, after = baseline[case][stage+'_seconds'], current[case][stage+'_seconds']
+            comparison.append({
+                'case': dict(zip(case_keys, case)),
+                'stage': stage,
+                'baseline_seconds': before,
+                'current_seconds': after,
+                'ratio': after / before if before > 0 else None,
+            })
+
+    return comparison
+
+
+def time_imports(script, repeats=3):
+    """
+    Time the imports of a console script in a fresh interpreter
+
+    ARGS:
+    script (str): name of the console script (key of IMPORT_BUDGETS)
+    repeats (int): number of repeats, of which the fastest is reported
+
+    RETURNS:
+    tuple (import time (in ms), or None if the imports fail; name of the
+    module which is not installed (or not in the tree), or None)
+    """
+
+    _, modules = IMPORT_BUDGETS[script]
+    statement = ("import time; start = time.perf_counter()\n"
+                 "try:\n"
+                 "    import {}\n"
+                 "except ModuleNotFoundError as error:\n"
+                 "    print('missing', error.name)\n"
+                 "else:\n"
+                 "    print((time.perf_counter()-start)*1000)").format(', '.join(['PyralleX2.main'] + modules))
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         env.get('PYTHONPATH', '')])
+
+    timings = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', statement], env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, None
+        output = result.stdout.split()
+        if output[-2:-1] == ['missing']:
+            return None, output[-1]
+        timings.append(float(output[-1]))
+
+    return min(timings), None
+
+
+def check_import_budgets():
+    """
+    Time the imports of every console script against its budget; scripts
+    importing a module which is not installed are skipped rather than over budget
+
+    RETURNS:
+    list of dict (within_budget is None for skipped scripts)
+    """
+
+    results = []
+    for script, (budget_ms, _) in IMPORT_BUDGETS.items():
+        import_ms, missing = time_imports(script)
+        results.append({
+            'script': script,
+            'import_ms': import_ms,
+            'budget_ms': budget_ms,
+            'missing': missing,
+            'within_budget': None if missing else (import_ms is not None and import_ms <= budget_ms),
+        })
+
+    return results
+
+
+def run(task='scaling', args=()):
+    """
+    Run a benchmark task and print its results
+
+    ARGS:
+    task (str): 'scaling', 'compare', 'screen', 'precision' or 'imports'
+    args (list): arguments of the task (scaling: optional settings yaml file;
+                 compare: baseline and current JSON results)
+    """
+
+    if task == 'scaling':
+        settings = None
+        if len(args) > 0:
+            import yaml
+            with open(args[0], 'r') as f:
+                settings = yaml.safe_load(f)
+        scaling_benchmark(settings)
+
+    elif task == 'compare':
+        assert (len(args) == 2), \
+            "Error in bench.run: baseline and current results must be provided for task = 'compare'."
+        for result in compare_results(*args):
+            case = ', '.join('{}={}'.format(key, value) for key, value in result['case'].items())
+            ratio = 'n/a' if result['ratio'] is None else '{:.2f}x'.format(result['ratio'])
+            print("{:16s} {:9.4f} s -> {:9.4f} s ({:>7s})  [{}]".format(
+                result['stage'], result['baseline_seconds'], result['current_seconds'], ratio, case))
+
+    elif task == 'screen':
+        for shape in ['Flat', 'Cylindrical']:
+            for result in time_screen_construction(screen_shape=shape):
+                print("{screen_shape:12s} npix = {npix:5d}: {seconds:8.4f} s".format(**result))
+
+    elif task == 'precision':
+        results = precision_report()
+        for result in results:
+            print("{case:16s} max abs error {max_abs_error:9.2e}  rel L2 error {rel_l2_error:9.2e}  "
+                  "double {double_seconds:7.3f} s / {double_mb:6.1f} MB  "
+                  "single {single_seconds:7.3f} s / {single_mb:6.1f} MB  "
+                  "vs reference {double_reference_error:9.2e} / {single_reference_error:9.2e} {}".format(
+                      'OK' if result['within_tolerance'] else 'OVER', **result))
+        assert (all(result['within_tolerance'] for result in results)), \
+            "Error in bench.run: grouped engine deviates from the reference engine beyond structure_factor.REFERENCE_TOLERANCE."
+
+    elif task == 'imports':
+        for result in check_import_budgets():
+            if result['missing']:
+                print("{:22s} {:>10s} (budget {} ms) skipped, no module {}".format(
+                    result['script'], '-', result['budget_ms'], result['missing']))
+                continue
+            import_ms = 'failed' if result['import_ms'] is None else '{:.0f} ms'.format(result['import_ms'])
+            print("{:22s} {:>10s} (budget {} ms) {}".format(
+                result['script'], import_ms, result['budget_ms'], 'OK' if result['within_budget'] else 'OVER'))
+
+    else:
+        raise ValueError("Error in bench.run: task must be one of 'scaling', 'compare', 'screen', 'precision' or 'imports'.")
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'scaling', sys.argv[2:])
@@ -0,0 +1,197 @@
+"""
+pyrallex2.bragg.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import lattice as Lattice
+from . import structure_factor as SF
+
+
+# Columns of the reflection table (one row per reflection per frame)
+REFLECTION_COLUMNS = ['frame', 'h', 'k', 'l', 'row', 'col', 'two_theta', 'f_squared', 'intensity']
+
+
+class BraggScreen:
+    """
+    Class encapsulating the lookup of detector pixels from scattering directions
+    """
+
+    def __init__(
+            self,
+            coords=None,
+            screen_s=None,
+    ):
+        """
+        Initialise a BraggScreen object
+
+        ARGS:
+            coords (ndarray): normalised coordinates of pixels on screen
+            screen_s (ndarray): scattering vectors at each pixel
+        """
+
+        self.npix = coords.shape[0]
+        self.screen_s = screen_s
+        self.tree = cKDTree(np.asarray(coords, dtype=np.float64).reshape(-1, 3))
+
+        # Largest spacing of neighbouring pixels, as angle and in s
+        self.pixel_angle = max(np.max(np.linalg.norm(np.diff(coords, axis=axis), axis=-1)) for axis in range(2))
+        self.pixel_s = max(np.max(np.linalg.norm(np.diff(screen_s, axis=axis), axis=-1)) for axis in range(2))
+        self.s_max = np.max(np.linalg.norm(screen_s, axis=-1))
+
+    def locate(self, directions):
+        """
+        Method to find the pixels hit by scattered rays
+
+        ARGS:
+        directions (ndarray): unit vectors of the scattered rays (M x 3)
+
+        RETURNS:
+        tuple (rows, cols, mask of the rays hitting the screen)
+        """
+
+        distances, pixels = self.tree.query(directions)
+        rows, cols = np.unravel_index(pixels, (self.npix, self.npix))
+
+        return rows, cols, distances <= self.pixel_angle
+
+
+def enumerate_reflections(cell_vec, s_max):
+    """
+    Enumerate the reciprocal lattice points of a unit cell within a sphere
+
+    ARGS:
+    cell_vec (ndarray): cell vectors (rows)
+    s_max (float): radius of the sphere in s
+
+    RETURNS:
+    tuple (Miller indices (M x 3), scattering vectors (M x 3))
+    """
+
+    # hkl = cell_vec @ s, so |h_i| <= s_max * |a_i|
+    bounds = np.ceil(s_max * np.linalg.norm(cell_vec, axis=1)).astype(int)
+    to_s = np.linalg.inv(cell_vec).T
+
+    hkl_list = []
+    k_grid, l_grid = np.meshgrid(np.arange(-bounds[1], bounds[1]+1),
+                                 np.arange(-bounds[2], bounds[2]+1),
+                                 indexing='ij')
+    # One slab of constant h at a time, to bound memory for large cells
+    for h in range(-bounds[0], bounds[0]+1):
+        slab = np.stack([np.full(k_grid.size, h), k_grid.ravel(), l_grid.ravel()], axis=-1)
+        slab_s = slab @ to_s
+        hkl_list.append(slab[np.linalg.norm(slab_s, axis=-1) <= s_max])
+
+    hkl = np.concatenate(hkl_list)
+
+    return hkl, hkl @ to_s
+
+
+def ewald_reflections(reflection_s, beam_vec, wavelength, tolerance):
+    """
+    Reflections near the Ewald sphere, i.e. |s + s0/lambda| = 1/lambda
+
+    ARGS:
+    reflection_s (ndarray): scattering vectors of the reflections (M x 3)
+    beam_vec (ndarray): normalised beam vector
+    wavelength (float): wavelength of beam (in ANGSTROMS)
+    tolerance (float): maximum distance from the sphere (in s)
+
+    RETURNS:
+    tuple (mask of the reflections, unit vectors of their scattered rays)
+    """
+
+    scattered = wavelength * reflection_s + beam_vec
+    scattered_norm = np.linalg.norm(scattered, axis=-1)
+    mask = np.abs(scattered_norm - 1) <= wavelength * tolerance
+
+    return mask, scattered / np.maximum(scattered_norm, 1.e-12)[:, np.newaxis]
+
+
+def bragg_scan(
+        out,
+        bragg_screen,
+        two_theta,
+        groups,
+        cell_vec,
+        supercell_dims,
+        beam_vec,
+        wavelength,
+        bs_coverage,
+        peak_fringes=Lattice.DEFAULT_PEAK_FRINGES,
+):
+    """
+    Normalised intensities of a single scan from the list of Bragg reflections
+    on the detector, splatted onto the screen with the Laue line-shape
+
+    The structure factor of each reflection is evaluated once at its exact
+    reciprocal lattice point, and spread over the pixels within peak_fringes
+    fringes of that point (as lattice.peak_mask) by the square of the lattice term.
+    Each pixel belongs to the peak of its nearest lattice point. The windows
+    grow as 1/N, so the mode is intended for large supercells.
+
+    ARGS:
+    out (ndarray): output image (pixels x pixels), overwritten
+    bragg_screen (BraggScreen): pixel lookup of the screen
+    two_theta (ndarray): 2theta at each pixel
+    groups (ElementGroups): atoms of the sample grouped by element
+    cell_vec (ndarray): cell vectors at the orientation of the scan
+    supercell_dims (list): dimensions of the supercell
+    beam_vec (ndarray): normalised beam vector
+    wavelength (float): wavelength of beam (in ANGSTROMS)
+    bs_coverage (float): angular coverage of the backstop
+    peak_fringes (int): half-width of the splatted peaks, in fringes
+
+    RETURNS:
+    ndarray (reflection table without the frame column, see REFLECTION_COLUMNS)
+    """
+
+    npix = bragg_screen.npix
+    cell_vec = np.array(cell_vec, dtype=np.float64)
+    half_widths = peak_fringes / (2*np.array(supercell_dims, dtype=np.float64))
+
+    # Reflections on the Ewald sphere, to within the peak width plus a pixel
+    peak_s = np.max(half_widths) * np.linalg.norm(np.linalg.inv(cell_vec), ord=2)
+    hkl, reflection_s = enumerate_reflections(cell_vec, bragg_screen.s_max)
+    on_sphere, directions = ewald_reflections(reflection_s, beam_vec, wavelength,
+                                              peak_s + bragg_screen.pixel_s)
+    rows, cols, on_screen = bragg_screen.locate(directions[on_sphere])
+    keep = np.flatnonzero(on_sphere)[on_screen]
+    hkl, reflection_s = hkl[keep], reflection_s[keep]
+    rows, cols = rows[on_screen], cols[on_screen]
+
+    # Structure factors of the reflections only
+    fs0_table = SF.FormFactorTable(-np.pi**2 * np.sum(reflection_s**2, axis=-1))
+    f_squared = np.abs(SF.grouped_form_factor(hkl.astype(np.float64), fs0_table.planes(groups), groups))**2
+
+    # Window of pixels around each reflection, large enough to hold its peak
+    radius = int(np.clip(np.ceil(peak_s / max(bragg_screen.pixel_s, 1.e-12)) + 1, 1, npix))
+    offsets = np.arange(-radius, radius+1)
+    window_rows = (rows[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis]).repeat(len(offsets), axis=2)
+    window_cols = (cols[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :]).repeat(len(offsets), axis=1)
+    in_screen = (window_rows >= 0) & (window_rows < npix) & (window_cols >= 0) & (window_cols < npix)
+
+    spot, window_rows, window_cols = np.nonzero(in_screen)[0], window_rows[in_screen], window_cols[in_screen]
+    pixel_hkl = bragg_screen.screen_s[window_rows, window_cols] @ cell_vec.T
+    # Pixels nearest to another lattice point belong to that reflection's peak
+    in_peak = np.all(np.abs(pixel_hkl - hkl[spot]) <= half_widths, axis=-1) & \
+        np.all(np.rint(pixel_hkl) == hkl[spot], axis=-1)
+    spot, window_rows, window_cols = spot[in_peak], window_rows[in_peak], window_cols[in_peak]
+
+    intensities = f_squared[spot] * Lattice.lattice_term(pixel_hkl[in_peak], supercell_dims)**2
+
+    out[...] = 0
+    out[window_rows, window_cols] = intensities
+
+    # Blot out centre and normalise
+    out[two_theta < bs_coverage] = 0
+    max_intensity = np.max(out)
+    if max_intensity > 0:
+        out /= max_intensity
+
+    return np.column_stack([hkl, rows, cols, two_theta[rows, cols], f_squared, out[rows, cols]])
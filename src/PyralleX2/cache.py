@@ -0,0 +1,288 @@
+"""
+pyrallex2.cache.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+
+# Bump when the cached arrays or their computation change, so stale entries miss
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pyrallex2')
+DEFAULT_MAX_SIZE_MB = 4096
+
+# Name of the metadata file of an entry; its mtime records the last use
+META_FILE = 'meta.json'
+
+
+def geometry_key(screen_shape, npix, dims, max_twotheta, beam_vec, wavelength):
+    """
+    Content address of the screen geometry arrays
+
+    ARGS:
+    screen_shape (str): shape of detector screen
+    npix (int): number of pixels along horizontal/vertical axis
+    dims (float): real dimensions of screen (in cm)
+    max_twotheta (float): maximum two-theta angle on horizontal/vertical axis
+    beam_vec (list): beam vector
+    wavelength (float): wavelength of beam (in ANGSTROMS)
+
+    RETURNS:
+    str
+    """
+
+    description = {
+        'version': CACHE_VERSION,
+        'screen_shape': screen_shape,
+        'npix': int(npix),
+        'dims': float(dims),
+        'max_twotheta': float(max_twotheta),
+        'beam_vec': [float(x) for x in beam_vec],
+        'wavelength': float(wavelength),
+    }
+
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class CacheEntry:
+    """
+    Class encapsulating a single entry of the geometry cache, to which further
+    arrays derived from the same geometry can be added
+    """
+
+    def __init__(
+            self,
+            entry_dir=None,
+            on_store=None,
+    ):
+        """
+        Initialise a CacheEntry object
+
+        ARGS:
+            entry_dir (str): folder of the entry
+            on_store (callable): called after an array is added (e.g. to evict other entries of the cache)
+        """
+
+        self.entry_dir = entry_dir
+        self.on_store = on_store
+
+    def load_array(self, name):
+        """
+        Method to get an array of the entry, memory-mapped read-only
+
+        ARGS:
+        name (str): name of the array
+
+        RETURNS:
+        ndarray (None if the array is not cached)
+        """
+
+        path = os.path.join(self.entry_dir, name + '.npy')
+        if not os.path.isfile(path):
+            return None
+
+        return np.load(path, mmap_mode='r')
+
+    def store_array(self, name, array):
+        """
+        Method to add an array to the entry (ignored if the entry has been evicted)
+
+        ARGS:
+        name (str): name of the array
+        array (ndarray): array to be cached
+        """
+
+        if not os.path.isdir(self.entry_dir):
+            return
+
+        path = os.path.join(self.entry_dir, name + '.npy')
+        tmp_path = path + '.tmp{}.npy'.format(os.getpid())
+        np.save(tmp_path, np.asarray(array))
+        os.replace(tmp_path, path)
+
+        if self.on_store is not None:
+            self.on_store()
+
+
+class GeometryCache:
+    """
+    Class encapsulating an on-disk, size-bounded LRU cache of screen geometry arrays
+    """
+
+    def __init__(
+            self,
+            cache_dir=DEFAULT_CACHE_DIR,
+            max_size_mb=DEFAULT_MAX_SIZE_MB,
+    ):
+        """
+        Initialise a GeometryCache object
+
+        ARGS:
+            cache_dir (str): root folder of the cache
+            max_size_mb (float): maximum total size of cached arrays (in MB)
+        """
+
+        self.cache_dir = os.path.join(cache_dir, 'geometry')
+        self.max_size_mb = max_size_mb
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Method to get the cached arrays of an entry, memory-mapped read-only
+
+        ARGS:
+        key (str): content address of the entry
+
+        RETURNS:
+        dict of ndarray (None if the entry is not cached)
+        """
+
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, META_FILE)
+        if not os.path.isfile(meta_path):
+            return None
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+                  for name in meta['arrays']}
+
+        # Mark as recently used
+        os.utime(meta_path)
+
+        return arrays
+
+    def entry(self, key):
+        """
+        Method to get an entry of the cache, for adding derived arrays (which
+        count towards the size limit of the cache)
+
+        ARGS:
+        key (str): content address of the entry
+
+        RETURNS:
+        CacheEntry object
+        """
+        return CacheEntry(self._entry_dir(key), on_store=lambda: self.evict(keep=key))
+
+    def store(self, key, arrays, description=None):
+        """
+        Method to add an entry to the cache, evicting least recently used
+        entries if the cache grows beyond its size limit
+
+        ARGS:
+        key (str): content address of the entry
+        arrays (dict): arrays to be cached
+        description (dict): human-readable parameters of the entry
+        """
+
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+
+        # Write into a temporary folder first, so that concurrent runs never
+        # see a partially written entry
+        tmp_entry = entry + '.tmp{}'.format(os.getpid())
+        os.makedirs(tmp_entry, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_entry, name + '.npy'), np.asarray(array))
+        with open(os.path.join(tmp_entry, META_FILE), 'w') as f:
+            json.dump({'arrays': sorted(arrays), 'description': description or {}}, f, indent=4)
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another run stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Method to list the entries of the cache, least recently used first
+
+        RETURNS:
+        list of dict
+        """
+
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            # Entries being written by another run are not entries yet
+            if '.tmp' in key:
+                continue
+            meta_path = os.path.join(self._entry_dir(key), META_FILE)
+            # Entries may be evicted by another run while they are listed
+            try:
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                size = sum(os.path.getsize(os.path.join(self._entry_dir(key), name))
+                           for name in os.listdir(self._entry_dir(key)))
+                last_used = os.path.getmtime(meta_path)
+            except FileNotFoundError:
+                continue
+            entries.append({
+                'key': key,
+                'size_mb': size / 1024**2,
+                'last_used': last_used,
+                'description': meta['description'],
+            })
+
+        return sorted(entries, key=lambda entry: entry['last_used'])
+
+    def evict(self, keep=None):
+        """
+        Method to remove least recently used entries until the cache fits its size limit
+
+        ARGS:
+        keep (str): key of an entry which is never evicted (e.g. the one just stored)
+        """
+
+        all_entries = self.entries()
+        entries = [entry for entry in all_entries if entry['key'] != keep]
+        total_size = sum(entry['size_mb'] for entry in all_entries)
+        while entries and total_size > self.max_size_mb:
+            oldest = entries.pop(0)
+            shutil.rmtree(self._entry_dir(oldest['key']), ignore_errors=True)
+            total_size -= oldest['size_mb']
+
+    def clear(self):
+        """
+        Method to remove all entries of the cache
+        """
+
+        for key in os.listdir(self.cache_dir):
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def info(self, default_limit=False):
+        """
+        Method to print a summary of the cache
+
+        ARGS:
+        default_limit (bool): whether the size limit is the default rather than the configured one
+        """
+
+        entries = self.entries()
+        print("Geometry cache: {}".format(self.cache_dir))
+        print("{} entries, {:.1f} MB ({}limit {:.1f} MB)".format(
+            len(entries), sum(entry['size_mb'] for entry in entries),
+            'default ' if default_limit else '', self.max_size_mb))
+        for entry in reversed(entries):
+            print("  {}  {:9.1f} MB  last used {}  {}".format(
+                entry['key'][:12],
+                entry['size_mb'],
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used'])),
+                entry['description'],
+            ))
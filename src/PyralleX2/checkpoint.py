@@ -0,0 +1,225 @@
+"""
+pyrallex2.checkpoint.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+
+# Parameters which do not change the computed frames (or the format of the
+# file they are written to), and so may differ between a run and its resumption
+VOLATILE_PARAMS = {
+    'simulation': ['num_workers', 'max_memory_mb', 'atom_chunk'],
+    'output': ['stream', 'checkpoint', 'output_file', 'spectra_file', 'spectra_weighting', 'spectra_bins',
+               'report_file', 'trace_file'],
+    'cache': ['geometry_dir', 'max_size_mb'],
+}
+
+
+def config_hash(params_in):
+    """
+    Hash of the parameters which determine the simulated frames
+
+    ARGS:
+    params_in (dict): dictionary containing parameters
+
+    RETURNS:
+    str
+    """
+
+    frame_params = {}
+    for group, values in params_in.items():
+        if group == 'display':
+            continue
+        frame_params[group] = {key: val for key, val in values.items()
+                               if key not in VOLATILE_PARAMS.get(group, [])}
+
+    return hashlib.sha256(json.dumps(frame_params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_hash(filename):
+    """
+    Hash of the contents of a file
+
+    ARGS:
+    filename (str): path to the file
+
+    RETURNS:
+    str
+    """
+
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    Class encapsulating the sidecar file recording completed frames of a stack
+    """
+
+    def __init__(
+            self,
+            filename=None,
+            config_hash=None,
+            sample_hash=None,
+            num_images=None,
+            completed=None,
+    ):
+        """
+        Initialise a Checkpoint object
+
+        ARGS:
+            filename (str): name of the output stack the checkpoint belongs to
+            config_hash (str): hash of the frame parameters (see config_hash)
+            sample_hash (str): hash of the sample file
+            num_images (int): number of images in the stack
+            completed (list): indices of completed frames
+        """
+
+        self.filename = filename
+        self.config_hash = config_hash
+        self.sample_hash = sample_hash
+        self.num_images = num_images
+        self.completed = set(completed or [])
+
+    @property
+    def sidecar(self):
+        """
+        Path of the sidecar file
+        """
+        return self.filename + '.ckpt'
+
+    @property
+    def reflections_sidecar(self):
+        """
+        Path of the file of reflections of completed frames (Bragg engine)
+        """
+        return self.filename + '.ckpt.refl'
+
+    def save_reflections(self, reflections):
+        """
+        Method to append the reflections of a frame, before it is marked done
+
+        ARGS:
+        reflections (ndarray): reflection table of the frame (rows x columns, frame index first)
+        """
+
+        with open(self.reflections_sidecar, 'ab') as f:
+            f.write(np.ascontiguousarray(reflections, dtype='<f8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load_reflections(self, num_columns):
+        """
+        Method to read the reflections of completed frames, dropping those of
+        a frame interrupted before it was marked done (and rewriting the file
+        without them)
+
+        ARGS:
+        num_columns (int): number of columns of the reflection table
+
+        RETURNS:
+        ndarray (rows x columns)
+        """
+
+        if not os.path.isfile(self.reflections_sidecar):
+            return np.zeros((0, num_columns))
+
+        data = np.fromfile(self.reflections_sidecar, dtype='<f8')
+        reflections = data[:len(data) - len(data) % num_columns].reshape(-1, num_columns)
+        reflections = reflections[np.isin(reflections[:, 0], sorted(self.completed))]
+
+        with open(self.reflections_sidecar + '.tmp', 'wb') as f:
+            f.write(reflections.astype('<f8').tobytes())
+        os.replace(self.reflections_sidecar + '.tmp', self.reflections_sidecar)
+
+        return reflections
+
+    def mark_done(self, index_in):
+        """
+        Method to record a completed frame
+
+        ARGS:
+        index_in (int): index of image in tomogram
+        """
+
+        self.completed.add(int(index_in))
+        self.save()
+
+    def save(self):
+        """
+        Method to write the sidecar file (atomically)
+        """
+
+        record = {
+            'output_file': os.path.basename(self.filename),
+            'config_hash': self.config_hash,
+            'sample_hash': self.sample_hash,
+            'num_images': self.num_images,
+            'completed': sorted(self.completed),
+        }
+        with open(self.sidecar + '.tmp', 'w') as f:
+            json.dump(record, f, indent=4)
+        os.replace(self.sidecar + '.tmp', self.sidecar)
+
+    def remove(self):
+        """
+        Method to delete the sidecar file once the stack is complete
+        """
+
+        for sidecar in [self.sidecar, self.reflections_sidecar]:
+            if os.path.isfile(sidecar):
+                os.remove(sidecar)
+
+
+def create_checkpoint(params_in, resume=False):
+    """
+    Create a new checkpoint, or load the checkpoint of an interrupted run
+
+    ARGS:
+    params_in (dict): dictionary containing parameters
+    resume (bool): whether to resume from an existing checkpoint
+
+    RETURNS:
+    Checkpoint object
+    """
+
+    output_file = params_in['output']['output_file']
+    my_checkpoint = Checkpoint(filename=output_file,
+                               config_hash=config_hash(params_in),
+                               sample_hash=file_hash(params_in['sample']['sample_file']),
+    )
+
+    if not resume:
+        # Reflections of an earlier run are not carried over
+        if os.path.isfile(my_checkpoint.reflections_sidecar):
+            os.remove(my_checkpoint.reflections_sidecar)
+        my_checkpoint.save()
+        return my_checkpoint
+
+    if not (os.path.isfile(my_checkpoint.sidecar) and os.path.isfile(output_file)):
+        raise ValueError("Error in checkpoint.create_checkpoint: no checkpoint found for {}.".format(output_file))
+
+    with open(my_checkpoint.sidecar, 'r') as f:
+        record = json.load(f)
+
+    if record['config_hash'] != my_checkpoint.config_hash:
+        raise ValueError("Error in checkpoint.create_checkpoint: config has changed since the checkpoint was written.")
+    if record['sample_hash'] != my_checkpoint.sample_hash:
+        raise ValueError("Error in checkpoint.create_checkpoint: sample file has changed since the checkpoint was written.")
+
+    my_checkpoint.num_images = record['num_images']
+    my_checkpoint.completed = set(record['completed'])
+
+    return my_checkpoint
@@ -0,0 +1,312 @@
+"""
+pyrallex2.instrument.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+
+
+# Environment variables enabling the run report and Chrome trace (file names),
+# taking precedence over output.report_file / output.trace_file in the config
+REPORT_ENV = 'PYRALLEX2_REPORT'
+TRACE_ENV = 'PYRALLEX2_TRACE'
+
+# Interval (in s) between samples of the resident set size
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Recorder of the current run, None when instrumentation is off
+_recorder = None
+
+# Context of stages when instrumentation is off
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def current_rss_mb():
+    """
+    Resident set size of this process (in MB)
+
+    RETURNS:
+    float
+    """
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError):
+        # Peak rather than current size where /proc is not available
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 1024**2 if sys.platform == 'darwin' else max_rss / 1024
+
+
+class Recorder:
+    """
+    Class encapsulating the timings and peak resident set size of the
+    stages of a run, with the resident set size sampled by a background thread
+    """
+
+    def __init__(
+            self,
+            report_file=None,
+            trace_file=None,
+            metadata=None,
+            sample_interval=DEFAULT_SAMPLE_INTERVAL,
+    ):
+        """
+        Initialise a Recorder object and start sampling
+
+        ARGS:
+            report_file (str): JSON file of the run report (None for no report)
+            trace_file (str): Chrome trace file (None for no trace)
+            metadata (dict): description of the run, added to the report
+            sample_interval (float): interval (in s) between samples of the resident set size
+        """
+
+        self.report_file = report_file
+        self.trace_file = trace_file
+        self.metadata = metadata or {}
+        self.sample_interval = sample_interval
+
+        self.events = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._started = time.time()
+        self.peak_rss_mb = current_rss_mb()
+
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        """
+        Method run by the sampling thread, raising the peak of the open stages
+        """
+        while not self._stop.wait(self.sample_interval):
+            self._update_peaks(current_rss_mb())
+
+    def _update_peaks(self, rss_mb):
+        """
+        Method to raise the peaks of the run and of the open stages to a sample
+        """
+        with self._lock:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+            for event in self._open:
+                event['peak_rss_mb'] = max(event['peak_rss_mb'], rss_mb)
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        """
+        Method to time a stage and sample its peak resident set size
+
+        ARGS:
+        name (str): name of the stage
+        args: details of the stage, added to its trace event
+        """
+
+        rss_mb = current_rss_mb()
+        event = {
+            'name': name,
+            'start': time.perf_counter() - self._start,
+            'tid': threading.get_ident(),
+            'peak_rss_mb': rss_mb,
+            'args': args,
+        }
+        with self._lock:
+            self._open.append(event)
+        try:
+            yield
+        finally:
+            event['seconds'] = time.perf_counter() - self._start - event['start']
+            self._update_peaks(current_rss_mb())
+            with self._lock:
+                self._open.remove(event)
+                self.events.append(event)
+
+    def summary(self):
+        """
+        Method to aggregate the events of each stage
+
+        RETURNS:
+        dict (count, total/mean/max time (in s) and peak resident set size (in MB) of each stage)
+        """
+
+        stages = {}
+        for event in self.events:
+            stage = stages.setdefault(event['name'], {'count': 0, 'total_seconds': 0., 'max_seconds': 0., 'peak_rss_mb': 0.})
+            stage['count'] += 1
+            stage['total_seconds'] += event['seconds']
+            stage['max_seconds'] = max(stage['max_seconds'], event['seconds'])
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'], event['peak_rss_mb'])
+        for stage in stages.values():
+            stage['mean_seconds'] = stage['total_seconds'] / stage['count']
+
+        return stages
+
+    def report(self):
+        """
+        Method to get the run report
+
+        RETURNS:
+        dict
+        """
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._started)),
+            'wall_seconds': time.perf_counter() - self._start,
+            'peak_rss_mb': self.peak_rss_mb,
+            'pid': os.getpid(),
+            'argv': sys.argv,
+            'metadata': self.metadata,
+            'stages': self.summary(),
+        }
+
+    def trace(self):
+        """
+        Method to get the events in Chrome trace format (chrome://tracing, Perfetto)
+
+        RETURNS:
+        dict
+        """
+
+        pid = os.getpid()
+        events = [{
+            'name': event['name'],
+            'ph': 'X',
+            'ts': event['start'] * 1e6,
+            'dur': event['seconds'] * 1e6,
+            'pid': pid,
+            'tid': event['tid'],
+            'args': {'peak_rss_mb': event['peak_rss_mb'], **event['args']},
+        } for event in sorted(self.events, key=lambda event: event['start'])]
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def close(self):
+        """
+        Method to stop sampling and write out the report and trace
+        """
+
+        self._stop.set()
+        self._sampler.join()
+
+        if self.report_file:
+            with open(self.report_file, 'w') as f:
+                json.dump(self.report(), f, indent=4, default=str)
+        if self.trace_file:
+            with open(self.trace_file, 'w') as f:
+                json.dump(self.trace(), f, default=str)
+
+
+def _forget_in_child():
+    """
+    Drop the recorder of the parent in forked worker processes, whose stages
+    are not recorded (and whose copy of the recorder has no sampling thread)
+    """
+
+    global _recorder
+    _recorder = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_in_child)
+
+
+def enable(report_file=None, trace_file=None, metadata=None):
+    """
+    Start recording the stages of a run, unless neither output is requested
+    (either may be given by the environment, see REPORT_ENV and TRACE_ENV)
+
+    ARGS:
+    report_file (str): JSON file of the run report
+    trace_file (str): Chrome trace file
+    metadata (dict): description of the run, added to the report
+
+    RETURNS:
+    bool (whether recording)
+    """
+
+    global _recorder
+
+    report_file = os.environ.get(REPORT_ENV) or report_file
+    trace_file = os.environ.get(TRACE_ENV) or trace_file
+    if not (report_file or trace_file):
+        return False
+
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = Recorder(report_file=report_file, trace_file=trace_file, metadata=metadata)
+
+    return True
+
+
+def finish():
+    """
+    Stop recording and write out the run report and trace (if recording)
+    """
+
+    global _recorder
+
+    if _recorder is not None:
+        recorder, _recorder = _recorder, None
+        recorder.close()
+
+
+def enabled():
+    """
+    Whether the stages of the run are being recorded
+
+    RETURNS:
+    bool
+    """
+    return _recorder is not None
+
+
+def stage(name, **args):
+    """
+    Context of a stage of the run, timed when recording (and otherwise a
+    shared no-op context)
+
+    ARGS:
+    name (str): name of the stage
+    args: details of the stage, added to its trace event
+
+    RETURNS:
+    context manager
+    """
+
+    if _recorder is None:
+        return _NULL_STAGE
+
+    return _recorder.stage(name, **args)
+
+
+def timed(name):
+    """
+    Decorator recording each call of a function as a stage of the run
+
+    ARGS:
+    name (str): name of the stage
+
+    RETURNS:
+    function
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with _recorder.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -5,7 +5,7 @@ AUTHOR: Neville B.-y. Yee
 Date: 05-May-2021
 """
 
-from icecream import ic
+import numpy as np
 
 
 def read_xyz(file_path):
@@ -99,3 +99,194 @@ def read_cif(file_path):
         atom_list.append([[elements[i], np.array([float(x_pos[i]), float(y_pos[i]), float(z_pos[i])])] for i in range(len(elements))])
 
     return list([item for sublist in atom_list for item in sublist])
+
+
+def _fix_element_case(elements):
+    """
+    Fix element symbol casing issues (e.g. 'FE' -> 'Fe') of an array of symbols
+    """
+    symbols, inverse = np.unique(elements, return_inverse=True)
+    fixed = np.array([symbol[:1].upper() + symbol[1:].lower() for symbol in symbols])
+
+    return fixed[inverse.ravel()]
+
+
+def encode_elements(elements):
+    """
+    Encode element symbols as small integer codes
+
+    ARGS:
+    elements (ndarray): element symbol of each atom
+
+    RETURNS:
+    tuple (distinct element symbols, code of each atom)
+    """
+
+    symbols, codes = np.unique(elements, return_inverse=True)
+
+    return symbols, codes.ravel().astype(np.int16)
+
+
+def columns_from_atom_list(atom_list):
+    """
+    Convert the output of read_xyz/read_pdb/read_cif to columnar form
+
+    ARGS:
+    atom_list (list): list of [element, position] pairs
+
+    RETURNS:
+    tuple (element symbols, element codes (N,), positions (N x 3))
+    """
+
+    elements = np.array([atom[0] for atom in atom_list], dtype=str)
+    positions = np.array([atom[1] for atom in atom_list], dtype=np.float64).reshape(-1, 3)
+    symbols, codes = encode_elements(elements)
+
+    return symbols, codes, positions
+
+
+def read_xyz_columns(file_path):
+    """
+    Function to read in xyz file straight into columnar arrays, in a single pass
+
+    ARGS:
+    file_path (str): path to xyz file
+
+    RETURNS:
+    tuple (element symbols, element codes (N,), positions (N x 3))
+    """
+
+    records = np.loadtxt(file_path, skiprows=2, usecols=(0, 1, 2, 3), dtype=str, ndmin=2)
+    positions = records[:, 1:].astype(np.float64)
+    symbols, codes = encode_elements(records[:, 0])
+
+    return symbols, codes, positions
+
+
+def read_pdb_columns(file_path):
+    """
+    Function to read the fixed columns of ATOM/HETATM records of a pdb file
+    straight into columnar arrays
+
+    Of atoms with alternate locations, only the first location in the file is
+    kept. Raises ValueError if the element column is missing, in which case
+    read_pdb (which infers elements from atom names) should be used instead.
+
+    ARGS:
+    file_path (str): path to pdb file
+
+    RETURNS:
+    tuple (element symbols, element codes (N,), positions (N x 3))
+    """
+
+    with open(file_path, 'rb') as f:
+        records = [line.rstrip(b'\r\n')[:80].ljust(80) for line in f
+                   if line.startswith(b'ATOM  ') or line.startswith(b'HETATM')]
+    if len(records) == 0:
+        raise ValueError("Error in io.read_pdb_columns: no ATOM/HETATM records found.")
+
+    table = np.frombuffer(b''.join(records), dtype='S1').reshape(len(records), 80)
+
+    def column(start, end):
+        return np.ascontiguousarray(table[:, start:end]).view('S{}'.format(end-start)).ravel()
+
+    # Keep blank and first alternate locations only
+    altloc = column(16, 17)
+    alt_labels = altloc[altloc != b' ']
+    if len(alt_labels) > 0:
+        keep = (altloc == b' ') | (altloc == alt_labels[0])
+        table = table[keep]
+
+    elements = np.char.strip(column(76, 78)).astype(str)
+    if np.any(elements == ''):
+        raise ValueError("Error in io.read_pdb_columns: element column missing.")
+
+    positions = np.stack([column(30, 38), column(38, 46), column(46, 54)], axis=1).astype(np.float64)
+    symbols, codes = encode_elements(_fix_element_case(elements))
+
+    return symbols, codes, positions
+
+
+def read_cif_columns(file_path):
+    """
+    Function to read the _atom_site loops of an mmCIF file straight into columnar arrays
+
+    Raises ValueError for rows which cannot be split into one token per
+    column (e.g. values continued over several lines), in which case read_cif
+    should be used instead.
+
+    ARGS:
+    file_path (str): path to cif file
+
+    RETURNS:
+    tuple (element symbols, element codes (N,), positions (N x 3))
+    """
+
+    with open(file_path, 'r') as f:
+        lines = f.read().splitlines()
+
+    all_elements = []
+    all_positions = []
+    line_index = 0
+    while line_index < len(lines):
+        if not (lines[line_index].strip() == 'loop_' and
+                line_index+1 < len(lines) and lines[line_index+1].startswith('_atom_site.')):
+            line_index += 1
+            continue
+
+        # Column headers of the loop
+        line_index += 1
+        headers = []
+        while line_index < len(lines) and lines[line_index].startswith('_atom_site.'):
+            headers.append(lines[line_index].split()[0][len('_atom_site.'):])
+            line_index += 1
+
+        # Data rows, up to the next loop, item, comment or data block
+        row_start = line_index
+        while line_index < len(lines) and \
+              not lines[line_index].startswith(('loop_', '_', '#', 'data_')):
+            line_index += 1
+        rows = [line for line in lines[row_start:line_index] if line.strip()]
+        if len(rows) == 0:
+            continue
+
+        usecols = [headers.index(key) for key in ['type_symbol', 'Cartn_x', 'Cartn_y', 'Cartn_z']]
+        records = np.loadtxt(rows, dtype=str, usecols=usecols, quotechar='"', ndmin=2)
+
+        all_elements.append(_fix_element_case(records[:, 0]))
+        all_positions.append(records[:, 1:].astype(np.float64))
+
+    if len(all_elements) == 0:
+        raise ValueError("Error in io.read_cif_columns: no _atom_site loop found.")
+
+    symbols, codes = encode_elements(np.concatenate(all_elements))
+
+    return symbols, codes, np.concatenate(all_positions)
+
+
+def read_columns(file_path):
+    """
+    Function to read in a coordinates file as columnar arrays, falling back to
+    the object-based readers for files the columnar parsers cannot handle
+
+    ARGS:
+    file_path (str): path to xyz, pdb or cif file
+
+    RETURNS:
+    tuple (element symbols, element codes (N,), positions (N x 3))
+    """
+
+    if file_path.endswith(".xyz"):
+        readers = (read_xyz_columns, read_xyz)
+    elif file_path.endswith(".pdb"):
+        readers = (read_pdb_columns, read_pdb)
+    elif file_path.endswith(".cif"):
+        readers = (read_cif_columns, read_cif)
+    else:
+        raise ValueError("Error in io.read_columns: coordinates file must be .xyz, .pdb or .cif.")
+
+    columnar_reader, fallback_reader = readers
+    try:
+        return columnar_reader(file_path)
+    except (ValueError, IndexError):
+        return columns_from_atom_list(fallback_reader(file_path))
@@ -0,0 +1,156 @@
+"""
+pyrallex2.kernels.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import warnings
+
+import numpy as np
+
+
+# Structure-factor backends: batched numpy products, or a fused compiled
+# kernel (requires numba, otherwise falls back to numpy)
+BACKENDS = ['numpy', 'numba']
+
+# Compiled kernel, built on first use
+_numba_kernel = None
+
+
+def numba_available():
+    """
+    Whether numba can be imported
+
+    RETURNS:
+    bool
+    """
+
+    try:
+        import numba
+    except ImportError:
+        return False
+
+    return True
+
+
+def resolve_backend(backend):
+    """
+    Backend actually used for a requested backend, falling back to numpy
+    when the compiler is not installed
+
+    ARGS:
+    backend (str): requested backend (see BACKENDS)
+
+    RETURNS:
+    str
+    """
+
+    assert (backend in BACKENDS), \
+        "Error in kernels.resolve_backend: backend must be either 'numpy' or 'numba'."
+
+    if backend == 'numba' and not numba_available():
+        warnings.warn("numba is not installed; using the numpy structure-factor backend instead.")
+        return 'numpy'
+
+    return backend
+
+
+def pool_context(backend):
+    """
+    Multiprocessing context for worker pools running a backend
+
+    The threads of a compiled kernel are not fork-safe, so once the kernel
+    has run in this process (or the workers will run it) pools spawn fresh
+    interpreters instead of forking.
+
+    ARGS:
+    backend (str): backend used in the workers (see BACKENDS)
+
+    RETURNS:
+    multiprocessing context, or None for the default
+    """
+
+    if backend == 'numba' or _numba_kernel is not None:
+        import multiprocessing
+        return multiprocessing.get_context('spawn')
+
+    return None
+
+
+def _compile_numba_kernel():
+    """
+    Compile the fused structure-factor kernel with numba
+
+    RETURNS:
+    function
+    """
+
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def fused_kernel(hkl, positions, offsets, fs0, out_real, out_imag):
+        # One pass over pixels (in parallel); the atoms of each element are
+        # looped inside, so the accumulators of a pixel stay in registers
+        for pix in numba.prange(hkl.shape[0]):
+            h = hkl[pix, 0]
+            k = hkl[pix, 1]
+            l = hkl[pix, 2]
+            real = h * 0
+            imag = h * 0
+            for elem in range(offsets.shape[0] - 1):
+                cos_sum = h * 0
+                sin_sum = h * 0
+                for atom in range(offsets[elem], offsets[elem+1]):
+                    phase = h*positions[atom, 0] + k*positions[atom, 1] + l*positions[atom, 2]
+                    cos_sum += np.cos(phase)
+                    sin_sum += np.sin(phase)
+                real += fs0[pix, elem] * cos_sum
+                imag += fs0[pix, elem] * sin_sum
+            out_real[pix] = real
+            out_imag[pix] = imag
+
+    return fused_kernel
+
+
+def fused_form_factor(screen_hkl, fs0_planes, groups, progress=None):
+    """
+    Structure factor summed over all atoms (as structure_factor.grouped_form_factor),
+    with phase, form factor multiply and accumulation fused into a single
+    multithreaded pass over pixels (numba backend)
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel (... x 3)
+    fs0_planes (ndarray): form factor of each element at each pixel (... x elements)
+    groups (ElementGroups): atoms of the sample grouped by element
+    progress (tqdm): progress bar updated with the number of atoms processed
+
+    RETURNS:
+    ndarray (complex, same shape as the pixel axes of screen_hkl)
+    """
+
+    global _numba_kernel
+    if _numba_kernel is None:
+        _numba_kernel = _compile_numba_kernel()
+
+    pix_shape = screen_hkl.shape[:-1]
+    dtype = screen_hkl.dtype
+    hkl_flat = np.ascontiguousarray(screen_hkl.reshape(-1, 3))
+    fs0_flat = np.ascontiguousarray(fs0_planes.reshape(-1, groups.num_elements), dtype=dtype)
+
+    # Atoms sorted by element, with the offset of each element's first atom
+    order = np.argsort(groups.element_index, kind='stable')
+    positions = np.ascontiguousarray(2 * np.pi * groups.frac_positions[order], dtype=dtype)
+    offsets = np.searchsorted(groups.element_index[order], np.arange(groups.num_elements+1)).astype(np.int64)
+
+    out_real = np.empty(hkl_flat.shape[0], dtype=dtype)
+    out_imag = np.empty(hkl_flat.shape[0], dtype=dtype)
+    _numba_kernel(hkl_flat, positions, offsets, fs0_flat, out_real, out_imag)
+
+    if progress is not None:
+        progress.update(len(order))
+
+    form_factor = out_real + 1j*out_imag
+
+    return form_factor.astype(np.result_type(dtype, np.complex64), copy=False).reshape(pix_shape)
@@ -0,0 +1,187 @@
+"""
+pyrallex2.lattice.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import numpy as np
+
+from . import instrument as Instrument
+
+
+# Supercell interference evaluated at every pixel ('full') or only within
+# windows around reciprocal lattice points ('narrow'), which requires the
+# screen to sample the windows (see undersampled_axes)
+LATTICE_MODES = ['full', 'narrow']
+
+# Half-width of the window around each reciprocal lattice point evaluated in
+# narrow-peak mode, in fringes of the Laue function (1 / (2N) each)
+DEFAULT_PEAK_FRINGES = 4
+
+
+def reduce_hkl(screen_hkl, dtype=np.float64):
+    """
+    Split Miller indices into their nearest integers and the offsets from them
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel
+    dtype (type): floating point type of the offsets
+
+    RETURNS:
+    tuple (nearest integers, offsets in [-0.5, 0.5])
+    """
+
+    nearest = np.rint(screen_hkl)
+    offsets = (screen_hkl - nearest).astype(dtype, copy=False)
+
+    return nearest, offsets
+
+
+def laue_kernel(nearest, offsets, num_cells):
+    """
+    Interference kernel of a row of num_cells unit cells along one axis,
+        1 + sin(2 pi N h) / sin(pi h),
+    evaluated on the offsets from the nearest integer h, with the limit
+    1 + 2N(-1)^h at integer h taken analytically
+
+    ARGS:
+    nearest (ndarray): nearest integers of the Miller indices
+    offsets (ndarray): offsets of the Miller indices from them
+    num_cells (int): number of unit cells along the axis
+
+    RETURNS:
+    ndarray (same type as offsets)
+    """
+
+    dtype = offsets.dtype.type
+    at_peak = offsets == 0
+    denominator = np.sin(dtype(np.pi) * offsets)
+    denominator[at_peak] = 1
+
+    ratio = np.sin(dtype(2*np.pi*num_cells) * offsets) / denominator
+    ratio[at_peak] = 2*num_cells
+
+    # sin(pi h) changes sign with the parity of the nearest integer
+    odd = np.fmod(nearest, 2) != 0
+    ratio[odd] = -ratio[odd]
+
+    return 1 + ratio
+
+
+@Instrument.timed('lattice_term')
+def lattice_term(screen_hkl, supercell_dims, dtype=np.float64):
+    """
+    Interference term of the supercell at each pixel
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel (... x 3)
+    supercell_dims (list): dimensions of the supercell
+    dtype (type): floating point type of the term (np.float32 / np.float64)
+
+    RETURNS:
+    ndarray
+    """
+
+    nearest, offsets = reduce_hkl(screen_hkl, dtype=dtype)
+
+    term = laue_kernel(nearest[..., 0], offsets[..., 0], supercell_dims[0])
+    for axis in range(1, 3):
+        term *= laue_kernel(nearest[..., axis], offsets[..., axis], supercell_dims[axis])
+
+    return term
+
+
+def peak_mask(screen_hkl, supercell_dims, peak_fringes=DEFAULT_PEAK_FRINGES):
+    """
+    Pixels near a reciprocal lattice point of the supercell, i.e. within
+    peak_fringes fringes of an integer Miller index along every axis
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel (... x 3)
+    supercell_dims (list): dimensions of the supercell
+    peak_fringes (int): half-width of the window, in fringes
+
+    RETURNS:
+    ndarray (bool)
+    """
+
+    half_widths = peak_fringes / (2*np.array(supercell_dims, dtype=np.float64))
+    offsets = np.abs(screen_hkl - np.rint(screen_hkl))
+
+    return np.all(offsets <= half_widths, axis=-1)
+
+
+def pixel_hkl_steps(screen_s, cell_vec):
+    """
+    Largest change of each Miller index between neighbouring pixels of the
+    screen, over all orientations of the sample
+
+    ARGS:
+    screen_s (ndarray): scattering vectors of the screen pixels (pixels x pixels x 3)
+    cell_vec (ndarray): cell vectors of the unit cell
+
+    RETURNS:
+    ndarray (one step per axis)
+    """
+
+    s_step = max(np.linalg.norm(np.diff(screen_s, axis=axis), axis=-1).max() for axis in range(2))
+
+    return s_step * np.linalg.norm(np.asarray(cell_vec, dtype=np.float64), axis=1)
+
+
+def undersampled_axes(screen_s, cell_vec, supercell_dims, peak_fringes=DEFAULT_PEAK_FRINGES):
+    """
+    Axes along which screen pixels may step over the windows evaluated in
+    narrow-peak mode, i.e. the change of the Miller index between
+    neighbouring pixels exceeds the window half-width peak_fringes / (2N)
+
+    ARGS:
+    screen_s (ndarray): scattering vectors of the screen pixels (pixels x pixels x 3)
+    cell_vec (ndarray): cell vectors of the unit cell
+    supercell_dims (list): dimensions of the supercell
+    peak_fringes (int): half-width of the window, in fringes
+
+    RETURNS:
+    tuple (indices of the undersampled axes, smallest peak_fringes sampling every axis)
+    """
+
+    steps = pixel_hkl_steps(screen_s, cell_vec)
+    dims = np.array(supercell_dims, dtype=np.float64)
+
+    axes = np.flatnonzero(steps > peak_fringes / (2*dims))
+    min_fringes = int(np.ceil(np.max(2*dims*steps)))
+
+    return axes, min_fringes
+
+
+@Instrument.timed('narrow_lattice_term')
+def narrow_lattice_term(screen_hkl, supercell_dims, peak_fringes=DEFAULT_PEAK_FRINGES, dtype=np.float64):
+    """
+    Interference term of the supercell evaluated only near reciprocal lattice
+    points, and set to zero elsewhere
+
+    Away from the peaks the term is at most (1 + 1/sin(pi w)) per axis for a
+    window half-width w, against 1 + 2N at the peak, so for large supercells
+    the neglected intensity is small relative to the Bragg peaks. This only
+    holds if the screen samples the windows: where neighbouring pixels are
+    further apart in hkl than the window half-width (see undersampled_axes),
+    pixels fall between windows and peaks are missed.
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel (... x 3)
+    supercell_dims (list): dimensions of the supercell
+    peak_fringes (int): half-width of the window, in fringes
+    dtype (type): floating point type of the term (np.float32 / np.float64)
+
+    RETURNS:
+    tuple (term, mask of the evaluated pixels)
+    """
+
+    mask = peak_mask(screen_hkl, supercell_dims, peak_fringes)
+
+    term = np.zeros(screen_hkl.shape[:-1], dtype=dtype)
+    term[mask] = lattice_term(screen_hkl[mask], supercell_dims, dtype=dtype)
+
+    return term, mask
@@ -9,17 +9,9 @@ Version: 0.4
 
 import sys
 import os
-import time
 
-from icecream import ic
-
-from . import sample as Sample
-from . import beam as Beam
-from . import screen as Screen
-from . import simulation as Simulation
-from . import params as Params
-from . import visualise as Visualise
-from . import magicgui as MagicGUI
+# NB: Task modules (numpy, mrcfile, matplotlib, magicgui/Qt...) are imported
+# inside the task functions, so each console script only pays for what it uses
 
 
 def get_task():
@@ -41,17 +33,27 @@ def get_task():
     return task
 
 
-def get_simulation_objs(params_in):
+def get_simulation_objs(params_in, checkpoint=None):
     """
     Prepare environment for simulation
 
     Arg:
     params_in (dict): dictionary containing parameters
+    checkpoint (Checkpoint): record of completed frames (checkpointed runs only)
 
     Returns:
     tuple
     """
 
+    from . import sample as Sample
+    from . import beam as Beam
+    from . import screen as Screen
+    from . import simulation as Simulation
+    from . import structure_factor as SF
+    from . import lattice as Lattice
+    from . import cache as Cache
+    from . import sparse as Sparse
+
     # Create sample for simulation
     my_sample = Sample.create_sample(coords_file=params_in['sample']['sample_file'],
                                      cell_type=params_in['sample']['cell_type'],
@@ -65,6 +67,25 @@ def get_simulation_objs(params_in):
         beam_vec=params_in['beam']['vector'],
     )
 
+    # Look up screen geometry (and per-element form factors) from previous
+    # runs with the same detector
+    geometry = None
+    fs0_store = None
+    cache_dir = params_in.get('cache', {}).get('geometry_dir', '')
+    if cache_dir:
+        geometry_cache = Cache.GeometryCache(cache_dir,
+                                             max_size_mb=params_in['cache'].get('max_size_mb', Cache.DEFAULT_MAX_SIZE_MB))
+        geometry_desc = {
+            'screen_shape': params_in['screen']['shape'],
+            'npix': params_in['screen']['pixels'],
+            'dims': params_in['screen']['dimensions'],
+            'max_twotheta': params_in['screen']['max_2_theta'],
+            'beam_vec': params_in['beam']['vector'],
+            'wavelength': params_in['beam']['wavelength'],
+        }
+        geometry_key = Cache.geometry_key(**geometry_desc)
+        geometry = geometry_cache.load(geometry_key)
+
     # Prepare screen
     my_screen = Screen.create_screen(
         npix=params_in['screen']['pixels'],
@@ -72,8 +93,20 @@ def get_simulation_objs(params_in):
         screen_shape=params_in['screen']['shape'],
         max_twotheta=params_in['screen']['max_2_theta'],
         beam_axis=params_in['beam']['vector'],
+        arrays=geometry,
     )
 
+    if cache_dir and geometry is None:
+        geometry = {
+            'coords': my_screen.coords,
+            'two_theta': my_screen.two_theta,
+            'solid_angle': my_screen.solid_angle,
+            **Simulation.screen_geometry(my_screen, my_beam),
+        }
+        geometry_cache.store(geometry_key, geometry, description=geometry_desc)
+    if cache_dir:
+        fs0_store = geometry_cache.entry(geometry_key)
+
     # Create object for storing simulation data
     my_image = Simulation.create_simulation(
         my_sample,
@@ -84,6 +117,26 @@ def get_simulation_objs(params_in):
         mct_angle_step=params_in['simulation']['angle_step'],
         mct_max_angle=params_in['simulation']['max_angle'],
         bs_coverage=params_in['output']['backstop_coverage'],
+        sf_engine=params_in['simulation'].get('sf_engine', 'grouped'),
+        atom_chunk=params_in['simulation'].get('atom_chunk', SF.DEFAULT_ATOM_CHUNK),
+        max_memory_mb=params_in['simulation'].get('max_memory_mb', 0),
+        num_workers=params_in['simulation'].get('num_workers', 1),
+        stream_file=params_in['output']['output_file'] \
+            if (params_in['output'].get('stream', False) or checkpoint is not None) else None,
+        checkpoint=checkpoint,
+        geometry=geometry,
+        fs0_store=fs0_store,
+        lattice_mode=params_in['simulation'].get('lattice_mode', 'full'),
+        peak_fringes=params_in['simulation'].get('peak_fringes', Lattice.DEFAULT_PEAK_FRINGES),
+        precision=params_in['simulation'].get('precision', 'double'),
+        sf_backend=params_in['simulation'].get('sf_backend', 'numpy'),
+        mct_update=params_in['simulation'].get('tomo_update', 'direct'),
+        pyramid_file=params_in['output']['output_file'],
+        pyramid_levels=params_in['output'].get('pyramid_levels', 0),
+        output_format=params_in['output'].get('format', 'mrc'),
+        output_metadata=params_in,
+        sparse_threshold=params_in['output'].get('sparse_threshold', Sparse.DEFAULT_THRESHOLD),
+        sparse_top_k=params_in['output'].get('sparse_top_k', 0),
     )
 
     return (my_sample, my_beam, my_screen, my_image)
@@ -93,6 +146,9 @@ def new_config():
     """
     Create new configuration file
     """
+    from . import params as Params
+    from . import magicgui as MagicGUI
+
     args = MagicGUI.get_args_xray.show(run=True)
 
     # Check cell vector format
@@ -113,6 +169,8 @@ def validate_config():
     """
     Validate given configuration file
     """
+    from . import params as Params
+
     assert (len(sys.argv)==2),\
         "Error: config file must be provided for task = 'validate'."
     config_name = sys.argv[1]
@@ -125,34 +183,120 @@ def validate_config():
 def simulate():
     """
     Simulate system specified in configuration file
+
+    With --resume, frames completed by an interrupted checkpointed run are skipped.
+    Stage timings are written to output.report_file (JSON) and output.trace_file
+    (Chrome trace), or the files named by PYRALLEX2_REPORT / PYRALLEX2_TRACE.
     """
-    assert (len(sys.argv)==2),\
+    from . import params as Params
+    from . import checkpoint as Checkpoint
+    from . import instrument as Instrument
+    from . import simulation as Simulation
+
+    resume = '--resume' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--resume']
+    assert (len(args)==1),\
         "Error: config file must be provided for task = 'simulate'."
-    config_name = sys.argv[1]
+    config_name = args[0]
     assert (os.path.isfile(config_name)),\
         "Error: Config file not found."
 
     params = Params.read_config(config_name)
-    sample, beam, screen, image = get_simulation_objs(params)
 
-    # Centre sample
-    sample.centre()
+    Instrument.enable(report_file=params['output'].get('report_file', ''),
+                      trace_file=params['output'].get('trace_file', ''),
+                      metadata={'config_file': config_name, 'config': params},
+    )
+    try:
+        checkpoint = None
+        if resume or params['output'].get('checkpoint', False):
+            checkpoint = Checkpoint.create_checkpoint(params, resume=resume)
+
+        sample, beam, screen, image = get_simulation_objs(params, checkpoint=checkpoint)
+
+        # Centre sample
+        sample.centre()
+
+        # Let there be light (...x-ray)
+        image.full_scan()
+
+        # Export file
+        mrc_name = params['output']['output_file']
+        spectra_name = params['output']['spectra_file']
+        Simulation.export_stack(mrc_name, image)
+        if len(spectra_name) > 0:
+            Simulation.export_spectra(spectra_name, image,
+                                      weighting=params['output'].get('spectra_weighting', 'sum'),
+                                      num_bins=params['output'].get('spectra_bins', 0) or None)
+        if len(params['output'].get('reflections_file', '')) > 0 and image.sf_engine == 'bragg':
+            Simulation.export_reflections(params['output']['reflections_file'], image)
+    finally:
+        Instrument.finish()
+
+
+def sweep():
+    """
+    Simulate a parameter sweep over the system specified in a configuration file
+
+    USAGE: pyrallex2.sweep config.yaml grid.yaml, where grid.yaml lists the
+    values of each swept parameter, e.g.
+        grid:
+            beam.wavelength: [0.5, 1.0]
+            sample.supercell_dims: [[2, 2, 2], [3, 3, 3]]
+        num_workers: 2
+    """
+    from . import params as Params
+    from . import instrument as Instrument
+    from . import sweep as Sweep
 
-    # Let there be light (...x-ray)
-    image.full_scan()
+    assert (len(sys.argv)==3),\
+        "Error: config file and grid file must be provided for task = 'sweep'."
+    config_name, grid_name = sys.argv[1:]
+    assert (os.path.isfile(config_name) and os.path.isfile(grid_name)),\
+        "Error: Config or grid file not found."
 
-    # Export file
-    mrc_name = params['output']['output_file']
-    spectra_name = params['output']['spectra_file']
-    Simulation.export_mrc(mrc_name, image)
-    if len(spectra_name) > 0:
-        Simulation.export_spectra(spectra_name, image)
+    params = Params.read_config(config_name)
+    grid_params = Params.read_config(grid_name)
+    assert (isinstance(grid_params.get('num_workers', 1), int) and \
+            grid_params.get('num_workers', 1) > 0), \
+            "Error in main.sweep: num_workers must be an int > 0."
+
+    # Stages of points simulated in worker processes are not recorded
+    Instrument.enable(report_file=params['output'].get('report_file', ''),
+                      trace_file=params['output'].get('trace_file', ''),
+                      metadata={'config_file': config_name, 'grid': grid_params},
+    )
+    try:
+        Sweep.run_sweep(params, grid_params['grid'], num_workers=grid_params.get('num_workers', 1))
+    finally:
+        Instrument.finish()
+
+
+def bench():
+    """
+    Benchmark the simulation stages on synthetic samples
+
+    USAGE: pyrallex2.bench [scaling|compare|screen|precision|imports] [args]
+        scaling [bench.yaml]: scaling curves over the settings in bench.yaml (see bench.DEFAULT_SCALING)
+        compare baseline.json current.json: stage timings of two scaling runs
+    """
+    from . import bench as Bench
+
+    args = sys.argv[1:]
+    task = args[0].lower() if len(args) > 0 else 'scaling'
+    assert (task in ['scaling', 'compare', 'screen', 'precision', 'imports']), \
+        "Error in main.bench: task must be one of 'scaling', 'compare', 'screen', 'precision' or 'imports'."
+
+    Bench.run(task, args[1:])
 
 
 def viewslice():
     """
     View simulated system according to configuration file
     """
+    from . import params as Params
+    from . import visualise as Visualise
+
     assert (len(sys.argv)==2),\
         "Error: config file must be provided for task = 'visualise'."
     config_name = sys.argv[1]
@@ -171,6 +315,7 @@ def viewslice():
         spec_in=spec_file,
         figsize=params['display']['figsize'],
         cmap=params['display']['cmap'],
+        max_pix=params['display'].get('max_display_pix', Visualise.DEFAULT_DISPLAY_PIX),
     )
 
 
@@ -186,3 +331,29 @@ def clear():
         pass
     else:
         raise ValueError('Error in main.clear: Invalid input.')
+
+
+def cache():
+    """
+    Inspect or clear the geometry cache, evicting least recently used
+    entries beyond max_size_mb (cache.max_size_mb of the config) if given
+
+    USAGE: pyrallex2.cache [info|clear] [cache_dir] [max_size_mb]
+    """
+    from . import cache as Cache
+
+    args = sys.argv[1:]
+    action = args[0].lower() if len(args) > 0 else 'info'
+    assert (action in ['info', 'clear']), \
+        "Error in main.cache: action must be either 'info' or 'clear'."
+    cache_dir = args[1] if len(args) > 1 else os.environ.get('PYRALLEX2_CACHE_DIR', Cache.DEFAULT_CACHE_DIR)
+    max_size_mb = float(args[2]) if len(args) > 2 else None
+    assert (max_size_mb is None or max_size_mb > 0), \
+        "Error in main.cache: max_size_mb must be > 0."
+
+    geometry_cache = Cache.GeometryCache(cache_dir, max_size_mb=max_size_mb or Cache.DEFAULT_MAX_SIZE_MB)
+    if action == 'clear':
+        geometry_cache.clear()
+    elif max_size_mb is not None:
+        geometry_cache.evict()
+    geometry_cache.info(default_limit=max_size_mb is None)
@@ -0,0 +1,524 @@
+"""
+pyrallex2.output.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import json
+
+import mrcfile
+import numpy as np
+
+from . import sparse as Sparse
+
+
+# Container formats of the output stack:
+#   mrc: uncompressed float32 MRC volume
+#   hdf5: float32 dataset in chunks of one frame, compressed (requires h5py)
+#   sparse: list of the brightest pixels of each frame (see sparse.SparseFrames)
+FORMATS = ['mrc', 'hdf5', 'sparse']
+
+# Name of the stack dataset (images x pixels x pixels) in HDF5 files, and of
+# the flags of the frames written to it
+HDF5_DATASET = 'intensities'
+HDF5_WRITTEN = 'written'
+
+# Leading bytes of HDF5 files
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+class MRCStream:
+    """
+    Class encapsulating an MRC stack written frame by frame as it is computed
+    """
+
+    def __init__(
+            self,
+            filename=None,
+            npix=None,
+            num_images=None,
+            append=False,
+    ):
+        """
+        Create a memory-mapped float32 MRC file for the whole stack
+
+        ARGS:
+            filename (str): name of the MRC file
+            npix (int): number of pixels along each screen axis
+            num_images (int): number of images in the stack
+            append (bool): reopen an existing (partially written) stack instead
+        """
+
+        self.filename = filename
+        if append:
+            self._mrc = mrcfile.mmap(filename, mode='r+')
+            assert (self._mrc.data.shape == (num_images, npix, npix)), \
+                "Error in MRCStream: existing stack has shape {}.".format(self._mrc.data.shape)
+        else:
+            self._mrc = mrcfile.new_mmap(filename,
+                                         shape=(num_images, npix, npix),
+                                         mrc_mode=2,
+                                         overwrite=True,
+            )
+
+    @property
+    def stack(self):
+        """
+        Stack in simulation layout (pixels x pixels x images), backed by the file
+        """
+        return np.moveaxis(self._mrc.data, 0, 2)
+
+    def flush(self):
+        """
+        Method to write completed frames to disk
+        """
+        self._mrc.flush()
+
+    def finalise(self):
+        """
+        Method to update the header and close the file for writing
+
+        RETURNS:
+        ndarray: read-only stack in simulation layout, backed by the file
+        """
+        self._mrc.update_header_stats()
+        self._mrc.close()
+
+        self._mrc = mrcfile.mmap(self.filename, mode='r')
+
+        return self.stack
+
+
+def _import_h5py():
+    """
+    Import h5py, which is only required for HDF5 output
+
+    RETURNS:
+    module
+    """
+
+    try:
+        import h5py
+    except ImportError:
+        raise ValueError("Error in output: format 'hdf5' requires h5py to be installed.")
+
+    return h5py
+
+
+def stack_format(filename):
+    """
+    Format of an output stack (from the leading bytes of the file)
+
+    ARGS:
+    filename (str): name of the file
+
+    RETURNS:
+    str (see FORMATS)
+    """
+
+    with open(filename, 'rb') as f:
+        signature = f.read(max(len(HDF5_SIGNATURE), len(Sparse.SPARSE_SIGNATURE)))
+
+    if signature.startswith(HDF5_SIGNATURE):
+        return 'hdf5'
+    if signature.startswith(Sparse.SPARSE_SIGNATURE):
+        return 'sparse'
+
+    return 'mrc'
+
+
+class FrameStack:
+    """
+    Class encapsulating a stack written one frame at a time (HDF5 dataset or
+    sparse.SparseFrames) in simulation layout (pixels x pixels x images),
+    indexed as an array
+
+    Frames not yet written are held in memory, so that they can be filled in
+    place, until flush writes them to the file (as one HDF5 chunk or one
+    sparse record each).
+    """
+
+    def __init__(
+            self,
+            dataset=None,
+            written=None,
+            on_flush=None,
+    ):
+        """
+        Initialise a FrameStack object
+
+        ARGS:
+            dataset (array-like): stack (images x pixels x pixels), written and read one frame at a time
+            written (array-like): flags of the frames written to the dataset
+            on_flush (function): called once frames have been written
+        """
+
+        self._dataset = dataset
+        self._written = written
+        self._on_flush = on_flush
+        self._pending = {}
+
+        num_images, npix, _ = dataset.shape
+        self.shape = (npix, npix, num_images)
+        self.dtype = dataset.dtype
+
+    def _frame(self, index_in, write=False):
+        """
+        Method to get a frame, held in memory until flushed if it is to be written
+        """
+
+        if index_in in self._pending:
+            return self._pending[index_in]
+
+        written = self._written[index_in]
+        if written and not write:
+            return self._dataset[index_in]
+
+        frame = self._dataset[index_in] if written else np.zeros(self.shape[:2], dtype=self.dtype)
+        self._pending[index_in] = frame
+
+        return frame
+
+    def __getitem__(self, key):
+        rows, cols, images = key
+        if isinstance(images, (int, np.integer)):
+            return self._frame(int(images), write=not self._written[images])[rows, cols]
+
+        self.flush()
+        return np.moveaxis(self._dataset[images], 0, 2)[rows, cols]
+
+    def __setitem__(self, key, value):
+        rows, cols, images = key
+        assert (isinstance(images, (int, np.integer))), \
+            "Error in FrameStack: frames must be written one at a time."
+        self._frame(int(images), write=True)[rows, cols] = value
+
+    def flush(self):
+        """
+        Method to write the frames held in memory to the file
+        """
+
+        for index, frame in sorted(self._pending.items()):
+            self._dataset[index] = frame
+            self._written[index] = True
+        self._pending = {}
+        if self._on_flush is not None:
+            self._on_flush()
+
+
+class HDF5Stream:
+    """
+    Class encapsulating an HDF5 stack written frame by frame as it is computed
+    """
+
+    def __init__(
+            self,
+            filename=None,
+            npix=None,
+            num_images=None,
+            metadata=None,
+            append=False,
+            compression=4,
+    ):
+        """
+        Create an HDF5 file with a chunked, compressed float32 dataset for the whole stack
+
+        ARGS:
+            filename (str): name of the HDF5 file
+            npix (int): number of pixels along each screen axis
+            num_images (int): number of images in the stack
+            metadata (dict): parameters of the run, stored (as JSON) with the stack
+            append (bool): reopen an existing (partially written) stack instead
+            compression (int): gzip level of the chunks
+        """
+
+        h5py = _import_h5py()
+
+        self.filename = filename
+        if append:
+            self._file = h5py.File(filename, 'r+')
+            assert (self._file[HDF5_DATASET].shape == (num_images, npix, npix)), \
+                "Error in HDF5Stream: existing stack has shape {}.".format(self._file[HDF5_DATASET].shape)
+        else:
+            self._file = h5py.File(filename, 'w')
+            self._file.create_dataset(HDF5_DATASET,
+                                      shape=(num_images, npix, npix),
+                                      dtype=np.float32,
+                                      chunks=(1, npix, npix),
+                                      compression='gzip',
+                                      compression_opts=compression,
+                                      shuffle=True,
+            )
+            self._file.create_dataset(HDF5_WRITTEN, shape=(num_images,), dtype=bool)
+            self._file.attrs['config'] = json.dumps(metadata or {}, default=str)
+
+        self._stack = FrameStack(self._file[HDF5_DATASET], self._file[HDF5_WRITTEN], on_flush=self._file.flush)
+
+    @property
+    def stack(self):
+        """
+        Stack in simulation layout (pixels x pixels x images), backed by the file
+        """
+        return self._stack
+
+    def flush(self):
+        """
+        Method to write completed frames to disk
+        """
+        self._stack.flush()
+
+    def finalise(self):
+        """
+        Method to close the file for writing
+
+        RETURNS:
+        FrameStack: read-only stack in simulation layout, backed by the file
+        """
+
+        self._stack.flush()
+        self._file.close()
+
+        self._file = _import_h5py().File(self.filename, 'r')
+        self._stack = FrameStack(self._file[HDF5_DATASET], self._file[HDF5_WRITTEN], on_flush=self._file.flush)
+
+        return self.stack
+
+    def close(self):
+        """
+        Method to write completed frames and close the file
+        """
+
+        if self._file.mode != 'r':
+            self._stack.flush()
+        self._file.close()
+
+
+class SparseStream:
+    """
+    Class encapsulating a sparse stack (see sparse.SparseFrames) written frame
+    by frame as it is computed
+    """
+
+    def __init__(
+            self,
+            filename=None,
+            npix=None,
+            num_images=None,
+            metadata=None,
+            append=False,
+            threshold=Sparse.DEFAULT_THRESHOLD,
+            top_k=0,
+    ):
+        """
+        Create a sparse stack file
+
+        ARGS:
+            filename (str): name of the sparse stack file
+            npix (int): number of pixels along each screen axis
+            num_images (int): number of images in the stack
+            metadata (dict): parameters of the run, stored (as JSON) with the stack
+            append (bool): reopen an existing (partially written) stack instead
+            threshold (float): smallest kept intensity, relative to the brightest pixel of each frame
+            top_k (int): largest number of pixels kept in each frame (0 for no limit)
+        """
+
+        self.filename = filename
+        if append:
+            self.frames = Sparse.SparseFrames(filename, mode='r+')
+            assert (self.frames.shape == (num_images, npix, npix)), \
+                "Error in SparseStream: existing stack has shape {}.".format(self.frames.shape)
+        else:
+            self.frames = Sparse.SparseFrames(filename, mode='w',
+                                              npix=npix,
+                                              num_images=num_images,
+                                              threshold=threshold,
+                                              top_k=top_k,
+                                              metadata=metadata,
+            )
+
+        self._stack = FrameStack(self.frames, self.frames.written, on_flush=self.frames.flush)
+
+    @property
+    def stack(self):
+        """
+        Stack in simulation layout (pixels x pixels x images), backed by the file
+        """
+        return self._stack
+
+    def flush(self):
+        """
+        Method to write completed frames to disk
+        """
+        self._stack.flush()
+
+    def finalise(self):
+        """
+        Method to close the file for writing
+
+        RETURNS:
+        FrameStack: read-only stack in simulation layout, backed by the file
+        """
+
+        self._stack.flush()
+        self.frames.close()
+
+        self.frames = Sparse.SparseFrames(self.filename, mode='r')
+        self._stack = FrameStack(self.frames, self.frames.written)
+
+        return self.stack
+
+    def close(self):
+        """
+        Method to write completed frames and close the file
+        """
+
+        if self.frames.mode != 'r':
+            self._stack.flush()
+        self.frames.close()
+
+
+def create_stream(output_format, filename, npix, num_images, metadata=None, append=False,
+                  sparse_threshold=Sparse.DEFAULT_THRESHOLD, sparse_top_k=0):
+    """
+    Create a stack written frame by frame in an output format
+
+    ARGS:
+    output_format (str): container format (see FORMATS)
+    filename (str): name of the output file
+    npix (int): number of pixels along each screen axis
+    num_images (int): number of images in the stack
+    metadata (dict): parameters of the run, stored with the stack (where the format allows)
+    append (bool): reopen an existing (partially written) stack instead
+    sparse_threshold (float): smallest kept intensity relative to the brightest pixel (sparse format)
+    sparse_top_k (int): largest number of pixels kept in each frame, 0 for no limit (sparse format)
+
+    RETURNS:
+    MRCStream, HDF5Stream or SparseStream object
+    """
+
+    assert (output_format in FORMATS), \
+        "Error in output.create_stream: format must be one of {}.".format(FORMATS)
+
+    if output_format == 'hdf5':
+        return HDF5Stream(filename, npix, num_images, metadata=metadata, append=append)
+    if output_format == 'sparse':
+        return SparseStream(filename, npix, num_images, metadata=metadata, append=append,
+                            threshold=sparse_threshold, top_k=sparse_top_k)
+
+    return MRCStream(filename, npix, num_images, append=append)
+
+
+def write_stack(filename, stack, output_format='mrc', metadata=None,
+                sparse_threshold=Sparse.DEFAULT_THRESHOLD, sparse_top_k=0):
+    """
+    Write out a stack held in memory
+
+    ARGS:
+    filename (str): name of the output file
+    stack (ndarray): intensities (pixels x pixels x images)
+    output_format (str): container format (see FORMATS)
+    metadata (dict): parameters of the run, stored with the stack (where the format allows)
+    sparse_threshold (float): smallest kept intensity relative to the brightest pixel (sparse format)
+    sparse_top_k (int): largest number of pixels kept in each frame, 0 for no limit (sparse format)
+    """
+
+    assert (output_format in FORMATS), \
+        "Error in output.write_stack: format must be one of {}.".format(FORMATS)
+
+    if output_format == 'mrc':
+        # Swap axes to conform with mrc standard
+        with mrcfile.new(filename, overwrite=True) as mrc:
+            mrc.set_data(np.moveaxis(stack.astype(np.float32, copy=False), 2, 0))
+        return
+
+    # Frames are compressed (or thinned out) one at a time
+    stream = create_stream(output_format, filename, stack.shape[0], stack.shape[2], metadata=metadata,
+                           sparse_threshold=sparse_threshold, sparse_top_k=sparse_top_k)
+    for index in range(stack.shape[2]):
+        stream.stack[:, :, index] = stack[:, :, index]
+        stream.flush()
+    stream.close()
+
+
+class StackReader:
+    """
+    Class encapsulating random access to the frames of an output stack of
+    any format, without reading the whole stack
+    """
+
+    def __init__(
+            self,
+            filename=None,
+    ):
+        """
+        Open an output stack (format detected from the file)
+
+        ARGS:
+            filename (str): name of the output file
+        """
+
+        self.filename = filename
+        self.format = stack_format(filename)
+        if self.format == 'hdf5':
+            self._file = _import_h5py().File(filename, 'r')
+            self.data = self._file[HDF5_DATASET]
+            self.config = json.loads(self._file.attrs.get('config', 'null'))
+        elif self.format == 'sparse':
+            # Frames are rebuilt as they are read
+            self._file = Sparse.SparseFrames(filename, mode='r')
+            self.data = self._file
+            self.config = self._file.config
+        else:
+            self._file = mrcfile.mmap(filename, mode='r')
+            self.data = self._file.data
+            self.config = None
+
+    @property
+    def num_images(self):
+        """
+        Number of images in the stack
+        """
+        return self.data.shape[0]
+
+    def frame(self, index_in):
+        """
+        Method to read a single frame
+
+        ARGS:
+        index_in (int): index of image in stack
+
+        RETURNS:
+        ndarray (pixels x pixels)
+        """
+
+        assert (0 <= index_in < self.num_images), \
+            "Error in StackReader.frame: image index exceeds stack size ({}).".format(self.num_images)
+
+        return np.array(self.data[index_in])
+
+    def close(self):
+        """
+        Method to close the file
+        """
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_stack(filename):
+    """
+    Open an output stack for random access to its frames
+
+    ARGS:
+    filename (str): name of the output file
+
+    RETURNS:
+    StackReader object
+    """
+    return StackReader(filename)
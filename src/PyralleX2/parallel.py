@@ -0,0 +1,183 @@
+"""
+pyrallex2.parallel.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from . import kernels as Kernels
+from . import sample as Sample
+from . import structure_factor as SF
+
+
+# Arrays of the worker process, attached in _init_worker
+_worker_arrays = {}
+_worker_state = {}
+
+
+class SharedArray:
+    """
+    Class encapsulating a numpy array placed in shared memory
+    """
+
+    def __init__(self, array_in):
+        """
+        Copy an array into a new shared memory block
+
+        ARGS:
+        array_in (ndarray): array to be shared
+        """
+
+        array_in = np.ascontiguousarray(array_in)
+        self.shape = array_in.shape
+        self.dtype = array_in.dtype.str
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array_in.nbytes, 1))
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)[...] = array_in
+
+    @property
+    def spec(self):
+        """
+        Picklable description of the shared array
+        """
+        return (self._shm.name, self.shape, self.dtype)
+
+    def release(self):
+        """
+        Method to free the shared memory block
+        """
+        self._shm.close()
+        self._shm.unlink()
+
+
+def attach(spec):
+    """
+    Attach to an array in shared memory
+
+    ARGS:
+    spec (tuple): (name, shape, dtype) from SharedArray.spec
+
+    RETURNS:
+    tuple (SharedMemory, ndarray)
+    """
+
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(array_specs, state):
+    """
+    Initialise a worker process with the shared screen arrays
+
+    ARGS:
+    array_specs (dict): specs of the shared arrays
+    state (dict): small, per-run parameters of the scan
+    """
+
+    for key, spec in array_specs.items():
+        _worker_arrays[key] = attach(spec)
+    _worker_state.update(state)
+
+
+def _scan_frame(index_in):
+    """
+    Compute a single frame of the tomogram in a worker process
+
+    The orientation of the sample is obtained directly from the frame index by
+    rotating the initial cell vectors through index_in * angle_step.
+
+    ARGS:
+    index_in (int): index of image in tomogram
+
+    RETURNS:
+    tuple (index, intensities)
+    """
+
+    arrays = {key: array for key, (_, array) in _worker_arrays.items()}
+    state = _worker_state
+
+    cell_vec = state['cell_vec']
+    if state['rot_axis'] is not None and index_in > 0:
+        cell_vec = cell_vec @ Sample.Sample.rotation_matrix(state['rot_axis'], index_in*state['angle_step']).T
+
+    npix = arrays['screen_s'].shape[0]
+    intensities = np.empty((npix, npix), dtype=arrays['screen_s'].dtype)
+    rows = None
+    if state['max_memory_mb']:
+        rows = SF.tile_rows(npix, state['atom_chunk'], state['max_memory_mb'],
+                            itemsize=arrays['screen_s'].dtype.itemsize)
+
+    SF.scan_tiles(intensities,
+                  arrays['screen_s'],
+                  arrays['two_theta'],
+                  arrays['fs0_planes'],
+                  state['groups'],
+                  cell_vec,
+                  state['supercell_dims'],
+                  state['bs_coverage'],
+                  rows=rows,
+                  atom_chunk=state['atom_chunk'],
+                  lattice_mode=state['lattice_mode'],
+                  peak_fringes=state['peak_fringes'],
+                  backend=state['sf_backend'],
+    )
+
+    return index_in, intensities
+
+
+def parallel_scan(simObj, num_workers):
+    """
+    Perform a full tomographic scan with frames distributed over a process pool
+
+    ARGS:
+    simObj (Simulation): the simulation object, with the screen arrays prepared
+    num_workers (int): number of worker processes
+    """
+
+    shared = {
+        'screen_s': SharedArray(simObj._screen_s),
+        'two_theta': SharedArray(simObj.screen.two_theta),
+        'fs0_planes': SharedArray(simObj._element_fs0_array),
+    }
+    state = {
+        'cell_vec': np.array(simObj.sample.cell_vec, dtype=np.float64),
+        'rot_axis': simObj.rot_axis,
+        'angle_step': simObj.angle_step,
+        'supercell_dims': simObj.sample.supercell_dims,
+        'bs_coverage': simObj.bs_coverage,
+        'groups': simObj._groups,
+        'atom_chunk': simObj.atom_chunk,
+        'max_memory_mb': simObj.max_memory_mb,
+        'lattice_mode': simObj.lattice_mode,
+        'peak_fringes': simObj.peak_fringes,
+        'sf_backend': simObj.sf_backend,
+    }
+
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=Kernels.pool_context(simObj.sf_backend),
+                                 initializer=_init_worker,
+                                 initargs=({key: array.spec for key, array in shared.items()}, state),
+        ) as pool:
+            futures = [pool.submit(_scan_frame, index) for index in simObj.pending_frames]
+            for future in tqdm(as_completed(futures),
+                               total=len(futures),
+                               desc='Processing stack (overall progress)... ',
+                               leave=True,
+                               position=0,
+                               bar_format='{l_bar}{bar:50}{r_bar}',
+            ):
+                index, intensities = future.result()
+                simObj.all_intensities[:, :, index] = intensities
+                simObj._frame_done(index)
+    finally:
+        for array in shared.values():
+            array.release()
@@ -43,13 +43,37 @@ def create_config(args_in):
             'rotational_axis': args_in.rot_axis.value,
             'angle_step': args_in.angle_step.value,
             'max_angle': args_in.max_angle.value,
+            'sf_engine': 'grouped',
+            'atom_chunk': 256,
+            'max_memory_mb': 0,
+            'num_workers': 1,
+            'lattice_mode': 'full',
+            'peak_fringes': 4,
+            'precision': 'double',
+            'sf_backend': 'numpy',
+            'tomo_update': 'direct',
         },
 
         'output': {
             'backstop_coverage': args_in.bs_coverage.value,
             'format': 'mrc',
+            'sparse_threshold': 1.e-4,
+            'sparse_top_k': 0,
+            'stream': False,
+            'checkpoint': False,
             'output_file': str(args_in.output_file.value),
             'spectra_file': '',
+            'spectra_weighting': 'sum',
+            'spectra_bins': 0,
+            'pyramid_levels': 0,
+            'reflections_file': '',
+            'report_file': '',
+            'trace_file': '',
+        },
+
+        'cache': {
+            'geometry_dir': '',
+            'max_size_mb': 4096,
         },
 
         'display': {
@@ -57,6 +81,7 @@ def create_config(args_in):
             'spec_source': '',
             'figsize': 9.,
             'cmap': 'gist_yarg',
+            'max_display_pix': 1024,
         }
     }
 
@@ -134,12 +159,86 @@ def validate_config(filename_in):
             params['simulation']['max_angle'] >= params['simulation']['angle_step'] and \
             params['simulation']['max_angle'] % params['simulation']['angle_step'] == 0), \
             "Error in params.validate: max_angle must be an integral multiple of angle_step."
+    assert (params['simulation'].get('sf_engine', 'grouped') in ['grouped', 'reference', 'bragg']),\
+        "Error in params.validate: sf_engine must be one of 'grouped', 'reference' or 'bragg'."
+    assert (isinstance(params['simulation'].get('atom_chunk', 256), int) and \
+            params['simulation'].get('atom_chunk', 256) > 0), \
+            "Error in params.validate: atom_chunk must be an int > 0."
+    assert (isinstance(params['simulation'].get('max_memory_mb', 0), (int, float)) and \
+            params['simulation'].get('max_memory_mb', 0) >= 0), \
+            "Error in params.validate: max_memory_mb must be a number >= 0 (0 disables tiling)."
+    assert (not params['simulation'].get('max_memory_mb', 0) or \
+            params['simulation'].get('sf_engine', 'grouped') == 'grouped'), \
+            "Error in params.validate: tiled scans (max_memory_mb > 0) require sf_engine = 'grouped'."
+    assert (isinstance(params['simulation'].get('num_workers', 1), int) and \
+            params['simulation'].get('num_workers', 1) > 0), \
+            "Error in params.validate: num_workers must be an int > 0."
+    assert (params['simulation'].get('num_workers', 1) == 1 or \
+            params['simulation'].get('sf_engine', 'grouped') == 'grouped'), \
+            "Error in params.validate: parallel scans (num_workers > 1) require sf_engine = 'grouped'."
+    assert (params['simulation'].get('lattice_mode', 'full') in ['full', 'narrow']),\
+        "Error in params.validate: lattice_mode must be either 'full' or 'narrow'."
+    assert (isinstance(params['simulation'].get('peak_fringes', 4), int) and \
+            params['simulation'].get('peak_fringes', 4) > 0), \
+            "Error in params.validate: peak_fringes must be an int > 0."
+    assert (params['simulation'].get('precision', 'double') in ['single', 'double']),\
+        "Error in params.validate: precision must be either 'single' or 'double'."
+    assert (params['simulation'].get('sf_backend', 'numpy') in ['numpy', 'numba']),\
+        "Error in params.validate: sf_backend must be either 'numpy' or 'numba' (falls back to 'numpy' if numba is not installed)."
+    assert (params['simulation'].get('tomo_update', 'direct') in ['direct', 'incremental']),\
+        "Error in params.validate: tomo_update must be either 'direct' or 'incremental'."
+    assert (params['simulation'].get('tomo_update', 'direct') == 'direct' or \
+            (params['simulation'].get('num_workers', 1) == 1 and \
+             params['simulation'].get('sf_engine', 'grouped') != 'bragg')), \
+            "Error in params.validate: tomo_update = 'incremental' requires num_workers = 1 and sf_engine = 'grouped' or 'reference' " \
+            "(with max_memory_mb, only frames half a turn after a computed frame are affected)."
 
     # Check output group params
     assert (isinstance(params['output']['backstop_coverage'], float) and \
             params['output']['backstop_coverage'] > 0),\
             "Error in params.validate: backstop_coverage must be a float > 0."
+    assert (params['output'].get('format', 'mrc') in ['mrc', 'hdf5', 'sparse']),\
+        "Error in params.validate: format must be one of 'mrc', 'hdf5' (requires h5py) or 'sparse'."
+    assert (isinstance(params['output'].get('sparse_threshold', 1.e-4), float) and \
+            0 <= params['output'].get('sparse_threshold', 1.e-4) < 1),\
+            "Error in params.validate: sparse_threshold must be a float in [0, 1)."
+    assert (isinstance(params['output'].get('sparse_top_k', 0), int) and \
+            params['output'].get('sparse_top_k', 0) >= 0),\
+            "Error in params.validate: sparse_top_k must be an int >= 0 (0 for no limit)."
+    assert (isinstance(params['output'].get('stream', False), bool)),\
+        "Error in params.validate: stream must be either 'true' or 'false'."
+    assert (isinstance(params['output'].get('checkpoint', False), bool)),\
+        "Error in params.validate: checkpoint must be either 'true' or 'false'."
     assert (len(params['output']['output_file']) > 0),\
         "Error in params.validate: output_file must be valid file name for the output."
     assert (len(params['output']['spectra_file']) > 0),\
         "Error in params.validate: spectra_file must be valid file name for the output."
+
+    # Check cache group params
+    if 'cache' in params:
+        assert (isinstance(params['cache'].get('geometry_dir', ''), str)),\
+            "Error in params.validate: geometry_dir must be a folder name (empty to disable the cache)."
+        assert (isinstance(params['cache'].get('max_size_mb', 4096), (int, float)) and \
+                params['cache'].get('max_size_mb', 4096) > 0),\
+                "Error in params.validate: max_size_mb must be a number > 0."
+    assert (isinstance(params['output'].get('reflections_file', ''), str)),\
+        "Error in params.validate: reflections_file must be a file name (empty to disable)."
+    assert (params['output'].get('spectra_weighting', 'sum') in ['sum', 'mean', 'solid_angle']),\
+        "Error in params.validate: spectra_weighting must be one of 'sum', 'mean' or 'solid_angle'."
+    assert (isinstance(params['output'].get('report_file', ''), str)),\
+        "Error in params.validate: report_file must be a file name (empty to disable the run report)."
+    assert (isinstance(params['output'].get('trace_file', ''), str)),\
+        "Error in params.validate: trace_file must be a file name (empty to disable the Chrome trace)."
+    assert (isinstance(params['output'].get('spectra_bins', 0), int) and \
+            params['output'].get('spectra_bins', 0) >= 0),\
+            "Error in params.validate: spectra_bins must be an int >= 0 (0 for half the screen pixels)."
+    assert (isinstance(params['output'].get('pyramid_levels', 0), int) and \
+            0 <= params['output'].get('pyramid_levels', 0) and \
+            2**params['output'].get('pyramid_levels', 0) < params['screen']['pixels']),\
+            "Error in params.validate: pyramid_levels must be an int >= 0 with 2**pyramid_levels < screen pixels."
+
+    # Check display group params
+    if 'display' in params:
+        assert (isinstance(params['display'].get('max_display_pix', 1024), int) and \
+                params['display'].get('max_display_pix', 1024) > 0),\
+                "Error in params.validate: max_display_pix must be an int > 0."
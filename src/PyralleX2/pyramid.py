@@ -0,0 +1,226 @@
+"""
+pyrallex2.pyramid.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+
+import mrcfile
+import numpy as np
+
+from . import output as Output
+
+
+def level_filename(filename, factor):
+    """
+    Name of the (MRC) file of a level of the pyramid of a stack
+
+    ARGS:
+    filename (str): name of the full-resolution stack (of any output format)
+    factor (int): binning factor of the level
+
+    RETURNS:
+    str
+    """
+
+    stem, _ = os.path.splitext(filename)
+    return '{}_bin{}.mrc'.format(stem, factor)
+
+
+def level_factors(num_levels):
+    """
+    Binning factors of the levels of a pyramid (2, 4, 8, ...)
+
+    ARGS:
+    num_levels (int): number of binned levels
+
+    RETURNS:
+    list
+    """
+    return [2**level for level in range(1, num_levels+1)]
+
+
+def bin_sum(image, factor=2):
+    """
+    Sum of an image over blocks of factor x factor pixels, padding the last
+    blocks of each axis with zeros
+
+    ARGS:
+    image (ndarray): image (pixels x pixels [x ...])
+    factor (int): binning factor
+
+    RETURNS:
+    ndarray
+    """
+
+    padded = np.pad(image, [(0, -size % factor) for size in image.shape[:2]] + [(0, 0)]*(image.ndim-2))
+
+    return padded.reshape(padded.shape[0]//factor, factor,
+                          padded.shape[1]//factor, factor, *padded.shape[2:]).sum(axis=(1, 3))
+
+
+def find_levels(filename):
+    """
+    Binned levels written next to a full-resolution stack, with the shape
+    expected from it (stale files of other stacks are ignored)
+
+    ARGS:
+    filename (str): name of the full-resolution stack (of any output format)
+
+    RETURNS:
+    dict (name of the file of each level, by binning factor)
+    """
+
+    with Output.open_stack(filename) as stack:
+        num_images, npix = stack.data.shape[:2]
+
+    levels = {}
+    factor = 2
+    while factor < npix and os.path.isfile(level_filename(filename, factor)):
+        with mrcfile.mmap(level_filename(filename, factor), mode='r') as mrc:
+            if mrc.data.shape != (num_images, -(-npix//factor), -(-npix//factor)):
+                break
+        levels[factor] = level_filename(filename, factor)
+        factor *= 2
+
+    return levels
+
+
+def coarsest_factor(npix, factors, min_pix):
+    """
+    Coarsest binning factor keeping at least min_pix pixels along each axis
+
+    ARGS:
+    npix (int): number of pixels along each axis at full resolution
+    factors (list): binning factors of the available levels
+    min_pix (int): smallest number of pixels along each axis
+
+    RETURNS:
+    int (1 for the full-resolution stack)
+    """
+    return max([factor for factor in factors if -(-npix//factor) >= min_pix], default=1)
+
+
+class PyramidStream:
+    """
+    Class encapsulating the binned levels (2x, 4x, 8x, ...) of a stack, each
+    written frame by frame to its own MRC file as the frames are computed
+
+    Pixels of each level hold the mean intensity of the full-resolution
+    pixels they cover, so intensities summed over a level are 1/f^2 of those
+    of the full-resolution stack for a binning factor f. Weighted by the
+    pixels they cover (BinnedScreen.pixel_counts, as in spectra.RadialBins),
+    spectra of a level preserve the total intensity and approximate the
+    full-resolution spectra, up to the coarser radial binning of the
+    pixels. Each level is binned from the previous one.
+    """
+
+    def __init__(
+            self,
+            filename=None,
+            npix=None,
+            num_images=None,
+            num_levels=None,
+            append=False,
+    ):
+        """
+        Create (or reopen) a memory-mapped float32 MRC file for each level
+
+        ARGS:
+            filename (str): name of the full-resolution stack (see level_filename)
+            npix (int): number of pixels along each screen axis at full resolution
+            num_images (int): number of images in the stack
+            num_levels (int): number of binned levels
+            append (bool): reopen existing (partially written) levels instead
+        """
+
+        assert (isinstance(num_levels, int) and num_levels > 0), \
+            "Error in PyramidStream: num_levels must be an int > 0."
+        assert (2**num_levels < npix), \
+            "Error in PyramidStream: the coarsest level must span more than one pixel."
+
+        self.filename = filename
+        self.factors = level_factors(num_levels)
+
+        # Full-resolution pixels covered by each pixel of each level
+        self._counts = []
+        counts = np.ones((npix, npix))
+        for factor in self.factors:
+            counts = bin_sum(counts)
+            self._counts.append(counts)
+
+        self._mrcs = []
+        for factor, counts in zip(self.factors, self._counts):
+            if append:
+                mrc = mrcfile.mmap(level_filename(filename, factor), mode='r+')
+                assert (mrc.data.shape == (num_images, *counts.shape)), \
+                    "Error in PyramidStream: existing level has shape {}.".format(mrc.data.shape)
+            else:
+                mrc = mrcfile.new_mmap(level_filename(filename, factor),
+                                       shape=(num_images, *counts.shape),
+                                       mrc_mode=2,
+                                       overwrite=True,
+                )
+            self._mrcs.append(mrc)
+
+    def add_frame(self, index_in, frame):
+        """
+        Method to bin a frame into every level
+
+        ARGS:
+        index_in (int): index of image in stack
+        frame (ndarray): full-resolution intensities (pixels x pixels, simulation layout)
+        """
+
+        sums = np.asarray(frame, dtype=np.float64)
+        for mrc, counts in zip(self._mrcs, self._counts):
+            sums = bin_sum(sums)
+            mrc.data[index_in] = sums / counts
+            mrc.flush()
+
+    def finalise(self):
+        """
+        Method to update the headers and close the files of all levels
+
+        RETURNS:
+        list (names of the files of the levels)
+        """
+
+        for mrc in self._mrcs:
+            mrc.update_header_stats()
+            mrc.close()
+        self._mrcs = []
+
+        return [level_filename(self.filename, factor) for factor in self.factors]
+
+
+class BinnedScreen:
+    """
+    Class encapsulating the pixel geometry of a screen binned to a level of
+    a pyramid, as used by spectra.RadialBins
+    """
+
+    def __init__(
+            self,
+            screenObj=None,
+            factor=None,
+    ):
+        """
+        Bin the pixel geometry of a screen
+
+        ARGS:
+            screenObj (Screen): the full-resolution detector screen
+            factor (int): binning factor of the level
+        """
+
+        counts = bin_sum(np.ones((screenObj.npix, screenObj.npix)), factor)
+
+        self.npix = counts.shape[0]
+        self.max_twotheta = screenObj.max_twotheta
+        self.two_theta = bin_sum(screenObj.two_theta, factor) / counts
+        self.solid_angle = bin_sum(screenObj.solid_angle, factor)
+        self.pixel_counts = counts
+        self.factor = factor
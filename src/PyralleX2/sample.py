@@ -7,11 +7,9 @@ Date: 4-Feb-2021
 """
 
 import numpy as np
-from sklearn.preprocessing import normalize
-
-from icecream import ic
 
 from . import cell_parse as Cell_parse
+from . import instrument as Instrument
 from . import io as IO
 from .Data import atom_param as Atom_param
 
@@ -60,34 +58,182 @@ class Atom:
         def _atom_k(self, var):
             self._atom_k = np.log(2.) / var**2
 
+class AtomView:
+    """
+    Class encapsulating a lightweight view of a single atom of a Sample,
+    with the attributes of an Atom object
+    """
+
+    def __init__(
+            self,
+            sampleObj=None,
+            index=None,
+    ):
+        """
+        Initialise an AtomView object
+
+        ARGS:
+            sampleObj (Sample): the sample holding the atom
+            index (int): index of the atom in the sample
+        """
+
+        self._sample = sampleObj
+        self._index = index
+
+    @property
+    def element(self):
+        """
+        Element name
+        """
+        return self._sample.elements[self._sample.element_index[self._index]]
+
+    @property
+    def charge(self):
+        """
+        Charge (atomic number) of atom
+        """
+        return self._sample.charges[self._sample.element_index[self._index]]
+
+    @property
+    def width(self):
+        """
+        Width (FWHM) of atom
+        """
+        return self._sample.widths[self._sample.element_index[self._index]]
+
+    @property
+    def atom_k(self):
+        """
+        Gaussian factor of atom
+        """
+        return self._sample.atom_ks[self._sample.element_index[self._index]]
+
+    @property
+    def pos(self):
+        """
+        Position of atom
+        """
+        return self._sample.positions[self._index]
+
+    @pos.setter
+    def pos(self, val):
+        self._sample.positions[self._index] = val
+
+    @property
+    def frac_pos(self):
+        """
+        Fractional coordinates of atom
+        """
+        return self._sample.frac_positions[self._index]
+
+
 class Sample:
     """
     Class to define a sample
+
+    Atoms are stored as contiguous arrays (positions, fractional positions and
+    an element index into per-element charge/width tables).
     """
 
     def __init__(
             self,
-            atom_list=list(),
+            atom_list=None,
             cell_vec=None,
             supercell_dims=(1, 1, 1),
+            elements=None,
+            charges=None,
+            widths=None,
+            element_index=None,
+            positions=None,
+            frac_positions=None,
     ):
 
         """
         Initialise a Sample object
 
         ARGS:
-            atom_list (list): list of Atom objects
+            atom_list (list): list of Atom objects (alternative to the arrays below)
             cell_vec (ndarray): cell vectors
+            supercell_dims (list): dimensions of the supercell
+            elements (ndarray): names of the distinct elements
+            charges (ndarray): charge of each distinct element
+            widths (ndarray): width of each distinct element
+            element_index (ndarray): index into elements for each atom (N,)
+            positions (ndarray): positions of atoms (N x 3)
+            frac_positions (ndarray): fractional coordinates of atoms (N x 3)
         """
-        self.atom_list = atom_list
         self.cell_vec = cell_vec
         self.supercell_dims = supercell_dims
 
+        self.elements = np.array([] if elements is None else elements, dtype=str)
+        self.charges = np.array([] if charges is None else charges, dtype=np.float64)
+        self.widths = np.array([] if widths is None else widths, dtype=np.float64)
+        self.element_index = np.array([] if element_index is None else element_index, dtype=np.int16).ravel()
+        self.positions = np.array(np.zeros((0, 3)) if positions is None else positions,
+                                  dtype=np.float32).reshape(-1, 3)
+        self.frac_positions = np.array(np.zeros((0, 3)) if frac_positions is None else frac_positions,
+                                       dtype=np.float64).reshape(-1, 3)
+
+        for atom in (atom_list or []):
+            self.add_atom(atom)
+
+    @property
+    def num_atoms(self):
+        """
+        Number of atoms in the sample
+        """
+        return len(self.element_index)
+
+    @property
+    def atom_ks(self):
+        """
+        Gaussian factor of each distinct element (as Atom.atom_k, the width)
+        """
+        return self.widths
+
+    @property
+    def atom_list(self):
+        """
+        Atoms of the sample as AtomView objects (for compatibility; prefer the arrays)
+        """
+        return [AtomView(self, index) for index in range(self.num_atoms)]
+
     def add_atom(self, atomObj):
         """
         Method to add an atom to the sample
         """
-        self.atom_list.append(atomObj)
+        matches = np.flatnonzero(self.elements == atomObj.element)
+        if len(matches) > 0:
+            elem = matches[0]
+        else:
+            elem = len(self.elements)
+            self.elements = np.append(self.elements, atomObj.element)
+            self.charges = np.append(self.charges, atomObj.charge)
+            self.widths = np.append(self.widths, atomObj.width)
+
+        self.element_index = np.append(self.element_index, np.int16(elem))
+        self.positions = np.vstack([self.positions, np.array(atomObj.pos, dtype=np.float32).reshape(1, 3)])
+        self.frac_positions = np.vstack([self.frac_positions, np.array(atomObj.frac_pos, dtype=np.float64).reshape(1, 3)])
+
+    def copy(self, supercell_dims=None):
+        """
+        Method to copy the sample, e.g. to simulate it under different conditions
+
+        ARGS:
+        supercell_dims (list): dimensions of the supercell of the copy (None to keep the current)
+
+        RETURNS:
+        Sample object
+        """
+        return Sample(cell_vec=np.array(self.cell_vec, dtype=np.float64),
+                      supercell_dims=self.supercell_dims if supercell_dims is None else supercell_dims,
+                      elements=self.elements,
+                      charges=self.charges,
+                      widths=self.widths,
+                      element_index=self.element_index,
+                      positions=self.positions,
+                      frac_positions=self.frac_positions,
+        )
 
     def translation(self, trans_vec):
         """
@@ -96,18 +242,14 @@ class Sample:
         Args:
         trans_vec (nparray): the translation vector
         """
-        for count, atom in enumerate(self.atom_list):
-            atom.pos += np.array(trans_vec, dtype=np.float32)
+        self.positions += np.array(trans_vec, dtype=np.float32)
 
     def centre(self):
         """
         Method to centre cell
         """
         # Calculate the current geometrical centroid
-        centroid = np.zeros(3)
-        for count, atom in enumerate(self.atom_list):
-            centroid += atom.pos
-        centroid /= len(self.atom_list)
+        centroid = np.mean(self.positions, axis=0, dtype=np.float64)
 
         # Translate whole cell by original offset of centroid
         self.translation(-centroid)
@@ -137,16 +279,53 @@ class Sample:
 
         return rotated
 
+    @staticmethod
+    def rotation_matrix(rot_axis, angle):
+        """
+        Rodrigues' rotation formula as a rotation matrix
+
+        ARGS:
+        rot_axis (nparray): rotational axis
+        angle (float): angle of rotation (in degrees)
+
+        RETURNS:
+        ndarray (3 x 3)
+        """
+        rot_axis = np.array(rot_axis, dtype=np.float64)
+        rot_axis /= np.linalg.norm(rot_axis)
+        angle = np.deg2rad(angle)
+
+        cross_matrix = np.array([[0., -rot_axis[2], rot_axis[1]],
+                                 [rot_axis[2], 0., -rot_axis[0]],
+                                 [-rot_axis[1], rot_axis[0], 0.]])
+
+        return np.cos(angle) * np.eye(3) + \
+            np.sin(angle) * cross_matrix + \
+            (1.-np.cos(angle)) * np.outer(rot_axis, rot_axis)
+
+    def rotated_cell_vec(self, rot_axis, angle):
+        """
+        Method to get the cell vectors after a rotation, without rotating the cell
+
+        ARGS:
+        rot_axis (nparray): rotational axis
+        angle (float): angle of rotation (in degrees)
+
+        RETURNS:
+        ndarray
+        """
+        return np.array(self.cell_vec, dtype=np.float64) @ self.rotation_matrix(rot_axis, angle).T
+
     def rotate(self, rot_axis, angle):
         """
         Method to rotate whole cell
         """
-        for vec in range(3):
-            self.cell_vec[vec] = self._rodrigues(self.cell_vec[vec], rot_axis, angle)
-        for count, atom in enumerate(self.atom_list):
-            atom.pos = self._rodrigues(atom.pos, rot_axis, angle)
+        rot_matrix = self.rotation_matrix(rot_axis, angle)
+        self.cell_vec = np.array(self.cell_vec, dtype=np.float64) @ rot_matrix.T
+        self.positions = (self.positions @ rot_matrix.T).astype(np.float32)
 
 
+@Instrument.timed('create_sample')
 def create_sample(coords_file, cell_type, cell_vec, supercell_dims):
     """
     Create sample using given cell file
@@ -158,27 +337,15 @@ def create_sample(coords_file, cell_type, cell_vec, supercell_dims):
         Sample object
     """
 
-    # Read cell file and create empty sample
-    if coords_file.endswith(".xyz"):
-        atom_list = IO.read_xyz(coords_file)
-    if coords_file.endswith(".pdb"):
-        atom_list = IO.read_pdb(coords_file)
-    if coords_file.endswith(".cif"):
-        atom_list = IO.read_cif(coords_file)
-
-    atomtypes_array = np.array(atom_list, dtype=object)[:, 0].astype(str)
-    position_array = np.concatenate(np.array(atom_list, dtype=object)[:, 1]).ravel().reshape((len(atomtypes_array), 3))
+    # Read coordinates file (as columns) and create empty sample
+    element_symbols, element_codes, position_array = IO.read_columns(coords_file)
     position_array -= position_array[np.argmin(position_array, axis=1)]
 
     if cell_type == "Full":
-        cell_vec = np.array(cell_vec).reshape((3,3))
+        cell_vec = np.array(cell_vec, dtype=np.float64).reshape((3,3))
     else:
         cell_vec = Cell_parse.Cell.niggly_to_cartesian(np.array(cell_vec).reshape((2,3)))
 
-    my_sample = Sample(cell_vec=cell_vec,
-                       supercell_dims=supercell_dims
-    )
-
     # Calculate fractional position of atoms
     fractional_array = position_array @ np.linalg.inv(cell_vec.T)
 
@@ -186,16 +353,19 @@ def create_sample(coords_file, cell_type, cell_vec, supercell_dims):
     assert (np.max(fractional_array) < 1), \
         "AssertionError: at least 1 atom is outside of the bounding box. Unit cell needs to be larger."
 
-    # Load preset atom parameters
-    atom_params = Atom_param.atom_params
+    # Load preset atom parameters (once per distinct element)
+    element_symbols, symbol_index, charges, widths = Atom_param.lookup(element_symbols)
+    element_codes = symbol_index[element_codes]
 
-    for index, atom in enumerate(atomtypes_array):
-        curr_atom = Atom(element=atom,
-                         charge=atom_params[atom_params['Name']==atom].Charge.values[0],
-                         width=atom_params[atom_params['Name']==atom].Width.values[0],
-                         pos=position_array[index],
-                         frac_pos=fractional_array[index])
-        my_sample.add_atom(curr_atom)
+    my_sample = Sample(cell_vec=cell_vec,
+                       supercell_dims=supercell_dims,
+                       elements=element_symbols,
+                       charges=charges,
+                       widths=widths,
+                       element_index=element_codes,
+                       positions=position_array,
+                       frac_positions=fractional_array,
+    )
     my_sample.centre()
 
     return my_sample
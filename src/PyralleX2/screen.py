@@ -7,9 +7,8 @@ Date: 4-Feb-2021
 """
 
 import numpy as np
-from sklearn.preprocessing import normalize
 
-from icecream import ic
+from . import instrument as Instrument
 
 
 class Screen:
@@ -24,6 +23,7 @@ class Screen:
             screen_shape=None,
             max_twotheta=None,
             beam_axis=None,
+            arrays=None,
     ):
 
         """
@@ -35,6 +35,7 @@ class Screen:
             max_twotheta (float): maximum two-theta angle on horizontal/vertical axis
             screen_shape (str): shape of detector screen (spherical / flat)
             beam_axis (list): axis of xray beam
+            arrays (dict): precomputed coords, two_theta and solid_angle (e.g. from the geometry cache)
         """
 
         self.npix = npix
@@ -43,6 +44,12 @@ class Screen:
         self.screen_shape = screen_shape
         self.beam_axis = beam_axis
 
+        if arrays is not None:
+            self._coords = arrays['coords']
+            self._two_theta = arrays['two_theta']
+            self._solid_angle = arrays['solid_angle']
+            return
+
         self.coords = (screen_shape, dims, npix, max_twotheta)
         self._rotate_screen(beam_axis)
 
@@ -57,17 +64,17 @@ class Screen:
 
     @coords.setter
     def coords(self, vals):
-        self._coords = np.zeros((self.npix, self.npix, 3), dtype=np.float32)
-
         if self.screen_shape == 'Flat':
             screen_dist = 0.5*self.dims / np.tan(np.radians(0.5*self.max_twotheta))
             dy = self.dims / self.npix
             dz = self.dims / self.npix
             ymin = -0.5*self.dims
             zmin = -0.5*self.dims
-            for i in range(self.npix):
-                for j in range(self.npix):
-                    self._coords[i, j, :] = [screen_dist, ymin+i*dy, zmin+j*dz]
+            y_grid, z_grid = np.meshgrid(ymin + np.arange(self.npix)*dy,
+                                         zmin + np.arange(self.npix)*dz,
+                                         indexing='ij')
+            x_grid = np.full_like(y_grid, screen_dist)
+            pixel_area = dy * dz
 
         elif self.screen_shape == 'Cylindrical':
             screen_dist = self.dims / np.radians(self.max_twotheta)         # s = r*theta (in radians)
@@ -75,19 +82,33 @@ class Screen:
             dtheta = -2*theta_min / self.npix
             zmin = -0.5*self.dims
             dz = self.dims / self.npix
-            for z_count in range(self.npix):
-                ztemp   = zmin + z_count*dz
-                for theta_count in range(self.npix):
-                    azimuth = theta_min + theta_count*dtheta
-                    xtemp   = screen_dist * np.cos(azimuth)
-                    ytemp   = screen_dist * np.sin(azimuth)
-                    self._coords[theta_count,z_count,:] = [xtemp, ytemp, ztemp]
+            azimuth, z_grid = np.meshgrid(theta_min + np.arange(self.npix)*dtheta,
+                                          zmin + np.arange(self.npix)*dz,
+                                          indexing='ij')
+            x_grid = screen_dist * np.cos(azimuth)
+            y_grid = screen_dist * np.sin(azimuth)
+            pixel_area = screen_dist*dtheta * dz
+
+        else:
+            x_grid = y_grid = z_grid = np.zeros((self.npix, self.npix))
+            screen_dist = pixel_area = 0.
+
+        self._coords = np.stack([x_grid, y_grid, z_grid], axis=-1).astype(np.float32)
+
+        # Solid angle of each pixel: the distance to the screen axis is
+        # constant for both shapes, so dOmega = dA * dist / r^3
+        pixel_dist = np.sqrt(x_grid**2 + y_grid**2 + z_grid**2)
+        self._solid_angle = (pixel_area * screen_dist / pixel_dist**3).astype(np.float32)
 
         # Normalise coordinates of each pixel
-        coords_norm = np.linalg.norm(self._coords, axis=2)
-        for icount in range(self.npix):
-            for jcount in range(self.npix):
-                self._coords[icount, jcount] /= coords_norm[icount, jcount]
+        self._coords /= np.linalg.norm(self._coords, axis=2, keepdims=True)
+
+    @property
+    def solid_angle(self):
+        """
+        Solid angle (in sr) subtended by each pixel at the sample
+        """
+        return self._solid_angle
 
     @property
     def two_theta(self):
@@ -118,23 +139,28 @@ class Screen:
         if abs(rot_angle) < 1.0e-4:
             pass
         else:
-            for icount in range(self.npix):
-                for jcount in range(self.npix):
-                    self._coords[icount, jcount] = \
-                        self._coords[icount, jcount] * np.cos(rot_angle) + \
-                        np.cross(rot_axis, self._coords[icount, jcount]) * np.sin(rot_angle) + \
-                        rot_axis * np.dot(rot_axis, self._coords[icount, jcount]) * (1 - np.cos(rot_angle))
+            # Rodrigues' formula as a single matrix applied to all pixels
+            cross_matrix = np.array([[0., -rot_axis[2], rot_axis[1]],
+                                     [rot_axis[2], 0., -rot_axis[0]],
+                                     [-rot_axis[1], rot_axis[0], 0.]])
+            rot_matrix = np.cos(rot_angle) * np.eye(3) + \
+                np.sin(rot_angle) * cross_matrix + \
+                (1 - np.cos(rot_angle)) * np.outer(rot_axis, rot_axis)
+
+            self._coords = (self._coords @ rot_matrix.T).astype(np.float32)
 
+@Instrument.timed('create_screen')
 def create_screen(
         npix=None,
         dims=None,
         screen_shape=None,
         max_twotheta=None,
         beam_axis=None,
+        arrays=None,
 ):
 
     """
     Create a new Screen object
     """
 
-    return Screen(npix, dims, screen_shape, max_twotheta, beam_axis)
+    return Screen(npix, dims, screen_shape, max_twotheta, beam_axis, arrays)
@@ -9,11 +9,27 @@ Date: 4-Feb-2021
 import os
 import time
 import gc
-import memory_profiler as mp
-from tqdm import trange
+import warnings
+from tqdm import tqdm, trange
 import mrcfile
 import numpy as np
-from sklearn.preprocessing import normalize
+
+from . import instrument as Instrument
+from . import kernels as Kernels
+from . import lattice as Lattice
+from . import output as Output
+from . import pyramid as Pyramid
+from . import sparse as Sparse
+from . import spectra as Spectra
+from . import structure_factor as SF
+from . import tomography as Tomography
+
+
+# Real type of each precision; complex arrays follow (complex64 / complex128)
+PRECISIONS = {
+    'single': np.float32,
+    'double': np.float64,
+}
 
 
 class Simulation:
@@ -31,6 +47,25 @@ class Simulation:
             mct_angle_step=None,
             mct_max_angle=None,
             bs_coverage=None,
+            sf_engine='grouped',
+            atom_chunk=SF.DEFAULT_ATOM_CHUNK,
+            max_memory_mb=None,
+            num_workers=1,
+            stream_file=None,
+            checkpoint=None,
+            geometry=None,
+            fs0_store=None,
+            lattice_mode='full',
+            peak_fringes=Lattice.DEFAULT_PEAK_FRINGES,
+            precision='double',
+            sf_backend='numpy',
+            mct_update='direct',
+            pyramid_file=None,
+            pyramid_levels=0,
+            output_format='mrc',
+            output_metadata=None,
+            sparse_threshold=Sparse.DEFAULT_THRESHOLD,
+            sparse_top_k=0,
     ):
         """
         Initialise a simulation.
@@ -44,8 +79,46 @@ class Simulation:
             mct_angle_step (float): step size of rotation angles for mCT simulation
             mct_max_angle (float): max rotation angles for mCT simulation
             bs_coverage (float): angular coverage of the lead backstop (to prevent central burnout)
+            sf_engine (str): structure-factor engine ('grouped', per-atom 'reference' or sparse Bragg peak list 'bragg')
+            atom_chunk (int): number of atoms per batched phase product (grouped engine)
+            max_memory_mb (float): memory budget of screen tiles (grouped engine); None for untiled scans
+            num_workers (int): number of processes computing frames in parallel (grouped engine)
+            stream_file (str): MRC file to which frames are written as they are computed (None to keep the stack in memory)
+            checkpoint (Checkpoint): record of completed frames of a streamed stack, which are skipped
+            geometry (dict): precomputed screen_s, s_squared and ssq2_const (see screen_geometry)
+            fs0_store (CacheEntry): persistent store of per-element form factor planes for this geometry
+            lattice_mode (str): supercell interference evaluated at all pixels ('full') or only near reciprocal lattice points ('narrow')
+            peak_fringes (int): half-width of the evaluated windows in narrow-peak mode, in fringes (the screen must sample them, see lattice.undersampled_axes)
+            precision (str): floating point precision of the scan ('single' / 'double'), kept from the scattering vectors to the output stack
+            sf_backend (str): backend of the grouped engine ('numpy', or fused compiled 'numba' when installed)
+            mct_update (str): frames of the mCT series computed independently ('direct') or from invariants of the rotation ('incremental'; only mirror frames in tiled scans)
+            pyramid_file (str): MRC file next to which binned levels of the stack are written as frames are computed (see pyramid.level_filename)
+            pyramid_levels (int): number of binned levels (2x, 4x, 8x, ...) written next to pyramid_file (0 for none)
+            output_format (str): container format of the output stack (see output.FORMATS)
+            output_metadata (dict): parameters of the run, stored with the output stack (where the format allows)
+            sparse_threshold (float): smallest stored intensity relative to the brightest pixel of each frame (sparse output format)
+            sparse_top_k (int): largest number of pixels stored for each frame, 0 for no limit (sparse output format)
         """
 
+        assert (sf_engine in ['grouped', 'reference', 'bragg']), \
+            "Error in Simulation: sf_engine must be one of 'grouped', 'reference' or 'bragg'."
+        assert (not max_memory_mb or sf_engine == 'grouped'), \
+            "Error in Simulation: tiled scans (max_memory_mb) require the grouped engine."
+        assert (num_workers == 1 or sf_engine == 'grouped'), \
+            "Error in Simulation: parallel scans (num_workers > 1) require the grouped engine."
+        assert (lattice_mode in Lattice.LATTICE_MODES), \
+            "Error in Simulation: lattice_mode must be either 'full' or 'narrow'."
+        assert (precision in PRECISIONS), \
+            "Error in Simulation: precision must be either 'single' or 'double'."
+        assert (mct_update in Tomography.UPDATE_MODES), \
+            "Error in Simulation: mct_update must be either 'direct' or 'incremental'."
+        assert (mct_update == 'direct' or (num_workers == 1 and sf_engine != 'bragg')), \
+            "Error in Simulation: incremental mCT updates require a serial scan with the grouped or reference engine."
+        assert (not pyramid_levels or pyramid_file), \
+            "Error in Simulation: pyramid levels require the name of the full-resolution stack."
+        assert (output_format in Output.FORMATS), \
+            "Error in Simulation: output_format must be one of {}.".format(Output.FORMATS)
+
         self.sample = sampleObj
         self.screen = screenObj
         self.beam = beamObj
@@ -54,37 +127,118 @@ class Simulation:
         self.angle_step = mct_angle_step
         self.max_angle = mct_max_angle
         self.bs_coverage = bs_coverage
+        self.sf_engine = sf_engine
+        self.atom_chunk = atom_chunk
+        self.max_memory_mb = max_memory_mb
+        self.num_workers = num_workers
+        self.lattice_mode = lattice_mode
+        self.peak_fringes = peak_fringes
+        self.precision = precision
+        self.dtype = PRECISIONS[precision]
+        self.sf_backend = Kernels.resolve_backend(sf_backend)
+        self.mct_update = mct_update
+        self.output_format = output_format
+        self.output_metadata = output_metadata
+        self.sparse_threshold = sparse_threshold
+        self.sparse_top_k = sparse_top_k
 
         if not mct:
             self.num_images = 1
         else:
             self.num_images = int((self.max_angle//self.angle_step) + 1)
 
-        self.all_intensities = np.empty((self.screen.npix, self.screen.npix, self.num_images), dtype=np.float64)
+        self.geometry = geometry
+        self.fs0_store = fs0_store
+        self.reflections = []
+        self._rotation_series = None
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            assert (stream_file), \
+                "Error in Simulation: checkpoints require the stack to be streamed to file."
+            if checkpoint.num_images is None:
+                checkpoint.num_images = self.num_images
+            assert (checkpoint.num_images == self.num_images), \
+                "Error in Simulation: checkpoint does not match the number of images."
+            self.completed_frames = set(checkpoint.completed)
+            # Reflections of frames completed in an earlier run (Bragg engine)
+            if sf_engine == 'bragg' and self.completed_frames:
+                from . import bragg as Bragg
+                self.reflections.append(checkpoint.load_reflections(len(Bragg.REFLECTION_COLUMNS)))
+        else:
+            self.completed_frames = set()
+
+        # Streamed stacks live in the output file rather than in memory
+        if stream_file:
+            self.output_stream = Output.create_stream(output_format, stream_file, self.screen.npix, self.num_images,
+                                                      metadata=output_metadata,
+                                                      append=len(self.completed_frames) > 0,
+                                                      sparse_threshold=sparse_threshold,
+                                                      sparse_top_k=sparse_top_k)
+            self.all_intensities = self.output_stream.stack
+        else:
+            self.output_stream = None
+            self.all_intensities = np.empty((self.screen.npix, self.screen.npix, self.num_images), dtype=self.dtype)
 
-    def _single_scan(self, index_in):
+        # Binned levels are written alongside, one frame at a time
+        if pyramid_levels:
+            self.pyramid = Pyramid.PyramidStream(pyramid_file, self.screen.npix, self.num_images, pyramid_levels,
+                                                 append=len(self.completed_frames) > 0)
+        else:
+            self.pyramid = None
+
+    def _frame_cell_vec(self, index_in):
         """
-        Method for performing a scan at a single angle
+        Method to get the cell vectors of the sample at a given frame, composed
+        from the frame index rather than accumulated frame by frame
+
+        ARGS:
+        index_in (int): index of image in tomogram
 
         RETURNS:
-        Form factor & intensities array
+        ndarray
         """
 
-        # Form factor for single scan
-        screen_hkl = np.matmul(self._screen_s, self.sample.cell_vec.T)
-        frac_pos_array = np.array([atom.frac_pos for atom in self.sample.atom_list]).T * 2j * np.pi
+        if self.rot_axis is None or index_in == 0:
+            return np.array(self.sample.cell_vec, dtype=np.float64)
+
+        return self.sample.rotated_cell_vec(self.rot_axis, index_in*self.angle_step)
 
-        supercell_dims = np.array(self.sample.supercell_dims)
-        crystal_thetas = 2 * np.pi * screen_hkl
-        crystal_kernals = 1 + np.sin(supercell_dims*crystal_thetas) / np.sin(0.5*crystal_thetas+1e-10)
-        crystal_term = np.prod(crystal_kernals, axis=-1)
+    @Instrument.timed('screen_hkl')
+    def _frame_hkl(self, index_in):
+        """
+        Method to get the Miller indices of the screen at a given frame
+
+        ARGS:
+        index_in (int): index of image in tomogram
+
+        RETURNS:
+        ndarray
+        """
+
+        if self._rotation_series is not None:
+            return self._rotation_series.screen_hkl(index_in)
+
+        return np.matmul(self._screen_s, self._frame_cell_vec(index_in).T.astype(self.dtype))
+
+    def _reference_form_factor(self, index_in):
+        """
+        Method for computing the form factor of a single scan atom by atom
+        (reference engine)
+
+        RETURNS:
+        Form factor array
+        """
+
+        # Form factor for single scan
+        screen_hkl = self._frame_hkl(index_in)
+        frac_pos_array = (self.sample.frac_positions.T * 2j * np.pi).astype(np.result_type(self.dtype, np.complex64))
 
         def get_form_factor_atoms():
             if index_in < self.num_images-1:
                 iter_leave = False
             else:
                 iter_leave = True
-            ff_iterator = trange(len(self.sample.atom_list),
+            ff_iterator = trange(self.sample.num_atoms,
                                  desc='Scanning through atoms...              ',
                                  ncols=150,
                                  position=1,
@@ -92,43 +246,314 @@ class Simulation:
                                  bar_format='{l_bar}{bar:50}{r_bar}{bar:-10b}',
             )
             for i in ff_iterator:
-                ff_out = self._atom_fs0_array[:, :, i] * np.exp(screen_hkl @ frac_pos_array[:, i]) * crystal_term
+                ff_out = self._element_fs0_array[:, :, self._groups.element_index[i]] * np.exp(screen_hkl @ frac_pos_array[:, i])
                 yield ff_out
 
+        # NB: builtin sum, as np.sum no longer accepts generators
         form_factor_atoms = get_form_factor_atoms()
-        ss_form_factor = np.sum(form_factor_atoms, axis=2)
+        ss_form_factor = sum(form_factor_atoms)
         del form_factor_atoms
         gc.collect()
 
-        # Blot out centre
-        ss_form_factor[self.screen.two_theta < self.bs_coverage] = 0
-        ss_form_factor /= np.max(np.abs(ss_form_factor))
+        # Supercell interference applies equally to every atom, so it is
+        # multiplied in once after the sum
+        if self.lattice_mode == 'narrow':
+            ss_form_factor *= Lattice.narrow_lattice_term(screen_hkl, self.sample.supercell_dims,
+                                                          peak_fringes=self.peak_fringes)[0]
+        else:
+            ss_form_factor *= Lattice.lattice_term(screen_hkl, self.sample.supercell_dims)
+
+        return ss_form_factor
+
+    def _grouped_form_factor(self, index_in):
+        """
+        Method for computing the form factor of a single scan with atoms
+        grouped by element (see structure_factor.lattice_form_factor)
+
+        RETURNS:
+        Form factor array
+        """
+
+        screen_hkl = self._frame_hkl(index_in)
+
+        progress = SF.atom_progress(self.sample.num_atoms,
+                                    leave=(index_in >= self.num_images-1))
+        ss_form_factor = SF.lattice_form_factor(screen_hkl,
+                                                self._element_fs0_array,
+                                                self._groups,
+                                                self.sample.supercell_dims,
+                                                lattice_mode=self.lattice_mode,
+                                                peak_fringes=self.peak_fringes,
+                                                atom_chunk=self.atom_chunk,
+                                                progress=progress,
+                                                backend=self.sf_backend,
+        )
+        progress.close()
+
+        return ss_form_factor
+
+    @Instrument.timed('single_scan')
+    def _single_scan(self, index_in):
+        """
+        Method for performing a scan at a single angle
+
+        RETURNS:
+        Form factor & intensities array
+        """
+
+        if self.sf_engine == 'reference':
+            ss_form_factor = self._reference_form_factor(index_in)
+        else:
+            ss_form_factor = self._grouped_form_factor(index_in)
 
-        ss_intensities = np.abs(ss_form_factor)**2
+        with Instrument.stage('normalise'):
+            # Blot out centre
+            ss_form_factor[self.screen.two_theta < self.bs_coverage] = 0
+            max_form_factor = np.max(np.abs(ss_form_factor))
+            if max_form_factor > 0:
+                ss_form_factor /= max_form_factor
+            self._frame_scales[index_in] = max_form_factor**2
+
+            ss_intensities = np.abs(ss_form_factor)**2
 
         return ss_intensities
 
+    @Instrument.timed('write_frame')
+    def _frame_done(self, index_in):
+        """
+        Method called once the intensities of a frame are in all_intensities
+
+        ARGS:
+        index_in (int): index of image in tomogram
+        """
+
+        if self.pyramid is not None:
+            self.pyramid.add_frame(index_in, self.all_intensities[:, :, index_in])
+        if self.output_stream is not None:
+            self.output_stream.flush()
+        if self.checkpoint is not None:
+            if self.sf_engine == 'bragg':
+                self.checkpoint.save_reflections(self.reflections[-1])
+            self.checkpoint.mark_done(index_in)
+
+    @property
+    def pending_frames(self):
+        """
+        Indices of the frames still to be computed
+        """
+        return [index for index in range(self.num_images) if index not in self.completed_frames]
+
+    @Instrument.timed('tiled_scan')
+    def _tiled_scan(self, index_in):
+        """
+        Method for performing a scan at a single angle in blocks of screen rows,
+        writing the intensities of each tile straight into all_intensities
+
+        ARGS:
+        index_in (int): index of image in tomogram
+        """
+
+        rows = SF.tile_rows(self.screen.npix, self.atom_chunk, self.max_memory_mb,
+                            itemsize=np.dtype(self.dtype).itemsize)
+        num_tiles = -(-self.screen.npix // rows)
+
+        progress = SF.atom_progress(self.sample.num_atoms * num_tiles,
+                                    leave=(index_in >= self.num_images-1))
+        max_intensity = SF.scan_tiles(self.all_intensities[:, :, index_in],
+                                      self._screen_s,
+                                      self.screen.two_theta,
+                                      self._element_fs0_array,
+                                      self._groups,
+                                      self._frame_cell_vec(index_in),
+                                      self.sample.supercell_dims,
+                                      self.bs_coverage,
+                                      rows=rows,
+                                      atom_chunk=self.atom_chunk,
+                                      progress=progress,
+                                      lattice_mode=self.lattice_mode,
+                                      peak_fringes=self.peak_fringes,
+                                      backend=self.sf_backend,
+        )
+        progress.close()
+        self._frame_scales[index_in] = max_intensity
+
+    @Instrument.timed('mirror_scan')
+    def _mirror_scan(self, index_in, source_in, mirror_source):
+        """
+        Method for performing a scan half a turn after a computed frame, as
+        the mirror image of that frame (see tomography.mirror_pixels); only
+        pixels whose mirror falls off the screen are computed directly
+
+        ARGS:
+        index_in (int): index of image in tomogram
+        source_in (int): index of the frame half a turn earlier
+        mirror_source (ndarray): flat index of the mirror of each pixel
+        """
+
+        num_pixels = self.screen.npix**2
+        on_screen = mirror_source < num_pixels
+
+        source_intensities = self.all_intensities[:, :, source_in].reshape(-1) * self._frame_scales[source_in]
+        intensities = np.zeros(num_pixels, dtype=self.all_intensities.dtype)
+        intensities[on_screen] = source_intensities[mirror_source[on_screen]]
+
+        # Edge pixels are computed in blocks of up to a tile of screen rows
+        # (all at once for untiled scans), with only their Miller indices
+        edge = np.flatnonzero(~on_screen)
+        if self.max_memory_mb:
+            block = self.screen.npix * SF.tile_rows(self.screen.npix, self.atom_chunk, self.max_memory_mb,
+                                                    itemsize=np.dtype(self.dtype).itemsize)
+        else:
+            block = max(len(edge), 1)
+        cell_vec = self._frame_cell_vec(index_in).T.astype(self.dtype)
+        for start in range(0, len(edge), block):
+            pixels = edge[start:start+block]
+            edge_form_factor = SF.lattice_form_factor(self._screen_s.reshape(-1, 3)[pixels] @ cell_vec,
+                                                      self._element_fs0_array.reshape(num_pixels, -1)[pixels],
+                                                      self._groups,
+                                                      self.sample.supercell_dims,
+                                                      lattice_mode=self.lattice_mode,
+                                                      peak_fringes=self.peak_fringes,
+                                                      atom_chunk=self.atom_chunk,
+                                                      backend=self.sf_backend,
+            )
+            edge_form_factor[self.screen.two_theta.reshape(-1)[pixels] < self.bs_coverage] = 0
+            intensities[pixels] = np.abs(edge_form_factor)**2
+
+        max_intensity = np.max(intensities)
+        if max_intensity > 0:
+            intensities /= max_intensity
+        self._frame_scales[index_in] = max_intensity
+
+        self.all_intensities[:, :, index_in] = intensities.reshape(self.screen.npix, self.screen.npix)
+
+    @Instrument.timed('bragg_scan')
+    def _bragg_scan(self, index_in):
+        """
+        Method for performing a scan at a single angle from the list of Bragg
+        reflections on the screen (see bragg.bragg_scan), writing the
+        intensities into all_intensities and the reflections into self.reflections
+
+        ARGS:
+        index_in (int): index of image in tomogram
+        """
+
+        from . import bragg as Bragg
+
+        reflections = Bragg.bragg_scan(self.all_intensities[:, :, index_in],
+                                       self._bragg_screen,
+                                       self.screen.two_theta,
+                                       self._groups,
+                                       self._frame_cell_vec(index_in),
+                                       self.sample.supercell_dims,
+                                       self.beam.beam_vec,
+                                       self.beam.wavelength,
+                                       self.bs_coverage,
+                                       peak_fringes=self.peak_fringes,
+        )
+        self.reflections.append(np.column_stack([np.full(len(reflections), index_in), reflections]))
+
+    @Instrument.timed('full_scan')
     def full_scan(self):
         """
         Method for performing full tomographic scan
         """
 
-        self._screen_s = (self.screen.coords-self.beam.beam_vec) / self.beam.wavelength
-        self._s_squared = np.linalg.norm(self._screen_s, axis=2)**2
-        self._ssq2_const = -np.pi**2 * self._s_squared
-        self._atom_fs0_array = np.array([atom.charge * np.exp(self._ssq2_const / atom.atom_k) \
-                                   for atom in self.sample.atom_list]).T
-
-        full_scan_iterator = trange(1, self.num_images+1,
-                                    desc='Processing stack (overall progress)... ',
-                                    leave=True,
-                                    position=0,
-                                    bar_format='{l_bar}{bar:50}{r_bar}',
+        with Instrument.stage('scan_setup'):
+            geometry = self.geometry
+            if geometry is None:
+                geometry = screen_geometry(self.screen, self.beam)
+            # The scan keeps the precision of the scattering vectors and form factors
+            self._screen_s = geometry['screen_s'].astype(self.dtype, copy=False)
+            self._s_squared = geometry['s_squared']
+            self._ssq2_const = geometry['ssq2_const']
+
+            # Narrow-peak windows narrower than the pixel spacing in hkl fall
+            # between pixels, leaving frames (nearly) empty
+            if self.lattice_mode == 'narrow' and self.sf_engine != 'bragg':
+                axes, min_fringes = Lattice.undersampled_axes(geometry['screen_s'],
+                                                              self.sample.cell_vec,
+                                                              self.sample.supercell_dims,
+                                                              self.peak_fringes,
+                )
+                if len(axes):
+                    warnings.warn("Screen pixels undersample the narrow-peak windows along axes {} "
+                                  "(peak_fringes = {}), so Bragg peaks may be missed; use lattice_mode 'full' "
+                                  "or peak_fringes >= {}.".format(axes.tolist(), self.peak_fringes, min_fringes))
+
+            # Form factors are stored once per element; atoms refer to them
+            # through self._groups.element_index
+            self._groups = SF.group_atoms(self.sample)
+            if self.sf_engine == 'bragg':
+                from . import bragg as Bragg
+                self._bragg_screen = Bragg.BraggScreen(self.screen.coords, self._screen_s)
+            else:
+                self._fs0_table = SF.FormFactorTable(self._ssq2_const, store=self.fs0_store)
+                self._element_fs0_array = self._fs0_table.planes(self._groups).astype(self.dtype, copy=False)
+
+        if self.num_workers > 1:
+            self._parallel_scan()
+            return
+
+        # Incremental series: screen Miller indices from their rotation
+        # invariants, and frames half a turn after a computed frame (grouped
+        # engine) from its mirror image. Tiled scans compute Miller indices
+        # per tile, so only the mirror frames are affected there.
+        self._frame_scales = {}
+        half_turn = mirror_source = None
+        if self.mct_update == 'incremental' and self.rot_axis is not None:
+            if not self.max_memory_mb:
+                self._rotation_series = Tomography.RotationSeries(self._screen_s,
+                                                                  self._frame_cell_vec(0),
+                                                                  self.rot_axis,
+                                                                  self.angle_step,
+                )
+            half_turn = Tomography.half_turn_frames(self.angle_step)
+            if half_turn is not None and self.sf_engine == 'grouped':
+                mirror_source = Tomography.mirror_pixels(self.screen.coords, self.beam.beam_vec, self.rot_axis)
+
+        # The orientation of each frame is composed from its index, so frames
+        # completed in an earlier (interrupted) run can simply be skipped
+        full_scan_iterator = tqdm(self.pending_frames,
+                                  desc='Processing stack (overall progress)... ',
+                                  leave=True,
+                                  position=0,
+                                  bar_format='{l_bar}{bar:50}{r_bar}',
         )
         for image_index in full_scan_iterator:
-            ss_i = self._single_scan(image_index-1)
-            self.all_intensities[:, :, image_index-1] = ss_i
-            self.sample.rotate(self.rot_axis, self.angle_step)
+            # Frames completed in an earlier run have no scale, so their
+            # partners are computed directly
+            if mirror_source is not None and image_index-half_turn in self._frame_scales:
+                self._mirror_scan(image_index, image_index-half_turn, mirror_source)
+            elif self.sf_engine == 'bragg':
+                self._bragg_scan(image_index)
+            elif self.max_memory_mb:
+                self._tiled_scan(image_index)
+            else:
+                ss_i = self._single_scan(image_index)
+                self.all_intensities[:, :, image_index] = ss_i
+            self._frame_done(image_index)
+
+        # Leave the sample in its orientation after the last frame
+        if self.rot_axis is not None:
+            self.sample.rotate(self.rot_axis, self.num_images*self.angle_step)
+
+        print("")
+
+    def _parallel_scan(self):
+        """
+        Method for performing full tomographic scan with frames computed in
+        parallel (see parallel.parallel_scan)
+
+        """
+
+        from . import parallel as Parallel
+
+        Parallel.parallel_scan(self, self.num_workers)
+
+        # Leave the sample in the same orientation as a sequential scan
+        if self.rot_axis is not None:
+            self.sample.rotate(self.rot_axis, self.num_images*self.angle_step)
 
         print("")
 
@@ -148,6 +573,25 @@ class Simulation:
         return max_log_intensity
 
 
+def screen_geometry(screenObj, beamObj):
+    """
+    Scattering vectors of the screen pixels, which depend only on the screen and beam
+
+    ARGS:
+    screenObj (Screen): the detector screen
+    beamObj (Beam): the X-ray beam
+
+    RETURNS:
+    dict
+    """
+
+    screen_s = (screenObj.coords-beamObj.beam_vec) / beamObj.wavelength
+    s_squared = np.linalg.norm(screen_s, axis=2)**2
+    ssq2_const = -np.pi**2 * s_squared
+
+    return {'screen_s': screen_s, 's_squared': s_squared, 'ssq2_const': ssq2_const}
+
+
 def create_simulation(
         sampleObj=None,
         screenObj=None,
@@ -157,6 +601,25 @@ def create_simulation(
         mct_angle_step=None,
         mct_max_angle=None,
         bs_coverage=None,
+        sf_engine='grouped',
+        atom_chunk=SF.DEFAULT_ATOM_CHUNK,
+        max_memory_mb=None,
+        num_workers=1,
+        stream_file=None,
+        checkpoint=None,
+        geometry=None,
+        fs0_store=None,
+        lattice_mode='full',
+        peak_fringes=Lattice.DEFAULT_PEAK_FRINGES,
+        precision='double',
+        sf_backend='numpy',
+        mct_update='direct',
+        pyramid_file=None,
+        pyramid_levels=0,
+        output_format='mrc',
+        output_metadata=None,
+        sparse_threshold=Sparse.DEFAULT_THRESHOLD,
+        sparse_top_k=0,
 ):
     """
     Create a new Simulation object
@@ -170,6 +633,25 @@ def create_simulation(
         mct_angle_step (float): step size of rotation angles for mCT simulation
         mct_max_angle (float): max rotation angles for mCT simulation
         bs_coverage (float): angular coverage of the lead backstop (to prevent central burnout)
+        sf_engine (str): structure-factor engine ('grouped', per-atom 'reference' or sparse Bragg peak list 'bragg')
+        atom_chunk (int): number of atoms per batched phase product (grouped engine)
+        max_memory_mb (float): memory budget of screen tiles (grouped engine); None for untiled scans
+        num_workers (int): number of processes computing frames in parallel (grouped engine)
+        stream_file (str): MRC file to which frames are written as they are computed (None to keep the stack in memory)
+        checkpoint (Checkpoint): record of completed frames of a streamed stack, which are skipped
+        geometry (dict): precomputed screen_s, s_squared and ssq2_const (see screen_geometry)
+        fs0_store (CacheEntry): persistent store of per-element form factor planes for this geometry
+        lattice_mode (str): supercell interference evaluated at all pixels ('full') or only near reciprocal lattice points ('narrow')
+        peak_fringes (int): half-width of the evaluated windows in narrow-peak mode, in fringes (the screen must sample them, see lattice.undersampled_axes)
+        precision (str): floating point precision of the scan ('single' / 'double'), kept from the scattering vectors to the output stack
+        sf_backend (str): backend of the grouped engine ('numpy', or fused compiled 'numba' when installed)
+        mct_update (str): frames of the mCT series computed independently ('direct') or from invariants of the rotation ('incremental'; only mirror frames in tiled scans)
+        pyramid_file (str): MRC file next to which binned levels of the stack are written as frames are computed (see pyramid.level_filename)
+        pyramid_levels (int): number of binned levels (2x, 4x, 8x, ...) written next to pyramid_file (0 for none)
+        output_format (str): container format of the output stack (see output.FORMATS)
+        output_metadata (dict): parameters of the run, stored with the output stack (where the format allows)
+        sparse_threshold (float): smallest stored intensity relative to the brightest pixel of each frame (sparse output format)
+        sparse_top_k (int): largest number of pixels stored for each frame, 0 for no limit (sparse output format)
 
     RETURNS:
         Simulation object
@@ -184,46 +666,130 @@ def create_simulation(
         mct_angle_step,
         mct_max_angle,
         bs_coverage,
+        sf_engine,
+        atom_chunk,
+        max_memory_mb,
+        num_workers,
+        stream_file,
+        checkpoint,
+        geometry,
+        fs0_store,
+        lattice_mode,
+        peak_fringes,
+        precision,
+        sf_backend,
+        mct_update,
+        pyramid_file,
+        pyramid_levels,
+        output_format,
+        output_metadata,
+        sparse_threshold,
+        sparse_top_k,
     )
 
 
+@Instrument.timed('export_stack')
+def export_stack(filename, simObj):
+    """
+    Write out stack intensities in the output format of the simulation
+
+    Args:
+    filename (str): name of the output file
+    simObj (Simulation): the simulation object from simulations
+    """
+
+    # Binned levels were written with the frames and only need their headers finalised
+    if simObj.pyramid is not None:
+        simObj.pyramid.finalise()
+
+    # Streamed stacks are already on disk and only need to be finalised
+    if simObj.output_stream is not None and simObj.output_stream.filename == filename:
+        simObj.all_intensities = simObj.output_stream.finalise()
+        if simObj.checkpoint is not None:
+            simObj.checkpoint.remove()
+        return
+
+    Output.write_stack(filename, simObj.all_intensities,
+                       output_format=simObj.output_format,
+                       metadata=simObj.output_metadata,
+                       sparse_threshold=simObj.sparse_threshold,
+                       sparse_top_k=simObj.sparse_top_k,
+    )
+
+
+@Instrument.timed('export_mrc')
 def export_mrc(filename, simObj):
     """
-    Write out stack intensities to MRC file
+    Write out stack intensities to MRC file, whatever the output format of the simulation
 
     Args:
     filename (str): name of the MRC file
     simObj (Simulation): the simulation object from simulations
     """
 
-    # Swap axes to conform with mrc standard
-    stack = np.moveaxis(simObj.all_intensities.astype(np.float32), 2, 0)
+    if simObj.output_format == 'mrc':
+        export_stack(filename, simObj)
+        return
 
-    with mrcfile.new(filename, overwrite=True) as mrc:
-        mrc.set_data(stack)
+    Output.write_stack(filename, np.asarray(simObj.all_intensities[:, :, :]), output_format='mrc')
 
 
-def export_spectra(filename, simObj):
+@Instrument.timed('export_spectra')
+def export_spectra(filename, simObj, weighting='sum', num_bins=None):
     """
     Write out spectral data from simulations
 
+    With a number of bins given, spectra are reduced from the coarsest level
+    of the pyramid (if any) keeping at least two pixels per bin along the screen.
+    Streamed sparse stacks are reduced from their stored pixels.
+
     Args:
     filename (str): name of the MRC file containing the binned intensities
     simObj (Simulation): the simulation object from simulations
+    weighting (str): weighting of the binned intensities (see spectra.WEIGHTINGS)
+    num_bins (int): number of 2theta bins (default: npix//2)
     """
 
-    max_twotheta = simObj.screen.max_twotheta
-    bins = np.linspace(0, max_twotheta, simObj.screen.npix//2)
-    twotheta_bins = np.digitize(simObj.screen.two_theta, bins)
-
-    binned_intensities = np.zeros((simObj.num_images+1, len(bins)))
-    binned_intensities[0] = bins
-    for i in range(simObj.screen.npix):
-        for j in range(simObj.screen.npix):
-            if simObj.screen.two_theta[i, j] > max_twotheta:
-                continue
-            else:
-                binned_intensities[1:, twotheta_bins[i, j]-1] += simObj.all_intensities[i, j]
+    factor = 1
+    if num_bins is not None and simObj.pyramid is not None:
+        factor = Pyramid.coarsest_factor(simObj.screen.npix, simObj.pyramid.factors, 2*num_bins)
+
+    if factor == 1 and simObj.output_format == 'sparse' and simObj.output_stream is not None:
+        radial_bins = Spectra.get_radial_bins(simObj.screen, num_bins)
+        simObj.output_stream.flush()
+        spectra = radial_bins.reduce_sparse(simObj.output_stream.frames.records(), simObj.num_images, weighting=weighting)
+    elif factor == 1:
+        radial_bins = Spectra.get_radial_bins(simObj.screen, num_bins)
+        spectra = radial_bins.reduce(simObj.all_intensities, weighting=weighting)
+    else:
+        radial_bins = Spectra.RadialBins(Pyramid.BinnedScreen(simObj.screen, factor), num_bins)
+        with Output.open_stack(Pyramid.level_filename(simObj.pyramid.filename, factor)) as level:
+            spectra = radial_bins.reduce(np.moveaxis(level.data, 0, 2), weighting=weighting)
+
+    binned_intensities = np.zeros((simObj.num_images+1, radial_bins.num_bins))
+    binned_intensities[0] = radial_bins.bins
+    binned_intensities[1:] = spectra
 
     with mrcfile.new(filename, overwrite=True) as mrc:
         mrc.set_data(binned_intensities.astype(np.float32))
+
+
+@Instrument.timed('export_reflections')
+def export_reflections(filename, simObj):
+    """
+    Write out the reflection table of a Bragg simulation (sf_engine = 'bragg')
+
+    Args:
+    filename (str): name of the text file
+    simObj (Simulation): the simulation object from simulations
+    """
+
+    from . import bragg as Bragg
+
+    reflections = np.concatenate(simObj.reflections) if simObj.reflections \
+        else np.zeros((0, len(Bragg.REFLECTION_COLUMNS)))
+
+    np.savetxt(filename, reflections,
+               fmt=['%d']*6 + ['%.4f', '%.6e', '%.6e'],
+               header=' '.join(Bragg.REFLECTION_COLUMNS),
+    )
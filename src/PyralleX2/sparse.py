@@ -0,0 +1,236 @@
+"""
+pyrallex2.sparse.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+import json
+import struct
+
+import numpy as np
+
+
+# Leading bytes of sparse stack files
+SPARSE_SIGNATURE = b'PYX2SPRS'
+
+# File header: signature, npix, number of images, relative threshold,
+# top-K limit and length of the JSON metadata which follows it
+HEADER = struct.Struct('<8sIIfII')
+
+# Record header of a frame: image index and number of stored pixels, followed
+# by the flat pixel indices (uint32) and intensities (float32)
+RECORD = struct.Struct('<II')
+
+# Default relative threshold of the stored pixels (intensities are normalised to a peak of 1)
+DEFAULT_THRESHOLD = 1.e-4
+
+
+def select_pixels(frame, threshold=DEFAULT_THRESHOLD, top_k=0):
+    """
+    Pixels of a frame kept in a sparse stack: those above a threshold relative
+    to the brightest pixel, limited to the top_k brightest if top_k > 0
+
+    ARGS:
+    frame (ndarray): intensities (pixels x pixels)
+    threshold (float): smallest kept intensity, relative to the brightest pixel
+    top_k (int): largest number of kept pixels (0 for no limit)
+
+    RETURNS:
+    tuple (flat pixel indices (uint32), intensities (float32)), in order of pixel index
+    """
+
+    flat = np.asarray(frame, dtype=np.float32).ravel()
+    max_intensity = flat.max(initial=0)
+    pixels = np.flatnonzero((flat > 0) & (flat >= threshold*max_intensity))
+
+    if top_k and len(pixels) > top_k:
+        pixels = np.sort(pixels[np.argpartition(flat[pixels], -top_k)[-top_k:]])
+
+    return pixels.astype(np.uint32), flat[pixels]
+
+
+class SparseFrames:
+    """
+    Class encapsulating a stack stored as the list of its brightest pixels in
+    each frame (see select_pixels), with frames rebuilt on demand
+
+    Frames are appended as records in the order they are written, and a
+    frame written more than once is given by its last record. Reads use
+    positional I/O, so frames may be read from several threads.
+    """
+
+    def __init__(
+            self,
+            filename=None,
+            mode='r',
+            npix=None,
+            num_images=None,
+            threshold=DEFAULT_THRESHOLD,
+            top_k=0,
+            metadata=None,
+    ):
+        """
+        Open (or create) a sparse stack file
+
+        ARGS:
+            filename (str): name of the file
+            mode (str): 'r' to read, 'r+' to append frames to an existing stack, 'w' to create a new stack
+            npix (int): number of pixels along each screen axis (new stacks)
+            num_images (int): number of images in the stack (new stacks)
+            threshold (float): smallest kept intensity, relative to the brightest pixel of each frame (new stacks)
+            top_k (int): largest number of pixels kept in each frame, 0 for no limit (new stacks)
+            metadata (dict): parameters of the run, stored (as JSON) with the stack (new stacks)
+        """
+
+        assert (mode in ['r', 'r+', 'w']), \
+            "Error in SparseFrames: mode must be one of 'r', 'r+' or 'w'."
+
+        self.filename = filename
+        self.mode = mode
+        self._file = open(filename, {'r': 'rb', 'r+': 'r+b', 'w': 'w+b'}[mode])
+
+        if mode == 'w':
+            config = json.dumps(metadata or {}, default=str).encode()
+            self._file.write(HEADER.pack(SPARSE_SIGNATURE, npix, num_images, threshold, top_k, len(config)))
+            self._file.write(config)
+            self._file.flush()
+            self.npix, self.num_images = npix, num_images
+            self.threshold, self.top_k = threshold, top_k
+            self.config = metadata or {}
+            self._records = {}
+            self._end = HEADER.size + len(config)
+        else:
+            self._read_index()
+            # Drop a record cut short by an interrupted run
+            if mode == 'r+':
+                self._file.truncate(self._end)
+
+        self.written = np.zeros(self.num_images, dtype=bool)
+        self.written[list(self._records)] = True
+
+    def _read_index(self):
+        """
+        Method to read the header and locate the record of each frame
+        """
+
+        header = os.pread(self._file.fileno(), HEADER.size, 0)
+        assert (len(header) == HEADER.size and header[:len(SPARSE_SIGNATURE)] == SPARSE_SIGNATURE), \
+            "Error in SparseFrames: {} is not a sparse stack.".format(self.filename)
+        _, self.npix, self.num_images, self.threshold, self.top_k, config_len = HEADER.unpack(header)
+        self.config = json.loads(os.pread(self._file.fileno(), config_len, HEADER.size))
+
+        size = os.fstat(self._file.fileno()).st_size
+        self._records = {}
+        offset = HEADER.size + config_len
+        while offset + RECORD.size <= size:
+            index, count = RECORD.unpack(os.pread(self._file.fileno(), RECORD.size, offset))
+            end = offset + RECORD.size + 8*count
+            if end > size:
+                break
+            self._records[index] = (offset + RECORD.size, count)
+            offset = end
+        self._end = offset
+
+    @property
+    def shape(self):
+        """
+        Shape of the stack (images x pixels x pixels)
+        """
+        return (self.num_images, self.npix, self.npix)
+
+    @property
+    def dtype(self):
+        """
+        Type of the stored intensities
+        """
+        return np.dtype(np.float32)
+
+    @property
+    def nbytes(self):
+        """
+        Size of the stored records (bytes)
+        """
+        return sum(RECORD.size + 8*count for _, count in self._records.values())
+
+    def pixels(self, index_in):
+        """
+        Method to read the stored pixels of a frame
+
+        ARGS:
+        index_in (int): index of image in stack
+
+        RETURNS:
+        tuple (flat pixel indices, intensities), empty if the frame has not been written
+        """
+
+        if index_in not in self._records:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float32)
+
+        offset, count = self._records[index_in]
+        data = os.pread(self._file.fileno(), 8*count, offset)
+
+        return np.frombuffer(data, dtype='<u4', count=count), np.frombuffer(data, dtype='<f4', offset=4*count)
+
+    def records(self):
+        """
+        Method to iterate over the stored pixels of the written frames
+
+        RETURNS:
+        generator of tuples (image index, flat pixel indices, intensities)
+        """
+        for index in sorted(self._records):
+            yield (index, *self.pixels(index))
+
+    def frame(self, index_in):
+        """
+        Method to rebuild a dense frame
+
+        ARGS:
+        index_in (int): index of image in stack
+
+        RETURNS:
+        ndarray (pixels x pixels)
+        """
+
+        frame = np.zeros(self.npix**2, dtype=np.float32)
+        pixels, values = self.pixels(index_in)
+        frame[pixels] = values
+
+        return frame.reshape(self.npix, self.npix)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.frame(int(key))
+
+        return np.stack([self.frame(index) for index in range(self.num_images)[key]]).reshape(-1, self.npix, self.npix)
+
+    def __setitem__(self, index_in, frame):
+        assert (self.mode != 'r'), \
+            "Error in SparseFrames: stack is open for reading only."
+
+        pixels, values = select_pixels(frame, self.threshold, self.top_k)
+        self._file.seek(self._end)
+        self._file.write(RECORD.pack(int(index_in), len(pixels)))
+        self._file.write(pixels.astype('<u4').tobytes())
+        self._file.write(values.astype('<f4').tobytes())
+        self._file.flush()
+
+        self._records[int(index_in)] = (self._end + RECORD.size, len(pixels))
+        self._end += RECORD.size + 8*len(pixels)
+        self.written[int(index_in)] = True
+
+    def flush(self):
+        """
+        Method to write appended frames to disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Method to close the file
+        """
+        self._file.close()
@@ -0,0 +1,175 @@
+"""
+pyrallex2.spectra.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import numpy as np
+
+
+# Weighting options of the binned spectra:
+#   sum: raw sum of intensities in each 2theta bin
+#   mean: mean intensity of the pixels in each bin
+#   solid_angle: intensity per unit solid angle (sum of intensities / sum of pixel solid angles)
+WEIGHTINGS = ['sum', 'mean', 'solid_angle']
+
+# Upper bound on the gathered intensities held at once when reducing a stack
+MAX_BLOCK_BYTES = 256 * 1024**2
+
+
+class RadialBins:
+    """
+    Class encapsulating the 2theta binning of a Screen
+    """
+
+    def __init__(
+            self,
+            screenObj=None,
+            num_bins=None,
+    ):
+        """
+        Initialise the bin index map of a screen
+
+        Screens binned to a level of a pyramid (see pyramid.BinnedScreen) hold
+        the mean intensity of the full-resolution pixels covered by each pixel,
+        which are weighted by their number so that the bins match those of the
+        full-resolution screen.
+
+        ARGS:
+            screenObj (Screen): the detector screen (or pyramid.BinnedScreen)
+            num_bins (int): number of 2theta bins (default: npix//2)
+        """
+
+        if num_bins is None:
+            num_bins = screenObj.npix // 2
+
+        self.npix = screenObj.npix
+        self.bins = np.linspace(0, screenObj.max_twotheta, num_bins)
+
+        two_theta = screenObj.two_theta.ravel()
+        bin_index = np.mod(np.digitize(two_theta, self.bins) - 1, num_bins)
+        valid = ~(two_theta > screenObj.max_twotheta)
+
+        # Pixels sorted by bin, so that each bin is a contiguous segment
+        order = np.argsort(bin_index[valid], kind='stable')
+        self.pixel_index = np.flatnonzero(valid)[order]
+        sorted_bins = bin_index[valid][order]
+
+        pixel_counts = getattr(screenObj, 'pixel_counts', None)
+        self.pixel_weights = None if pixel_counts is None else pixel_counts.ravel()[self.pixel_index]
+
+        num_pixels = np.bincount(sorted_bins, minlength=num_bins)
+        self.counts = num_pixels if self.pixel_weights is None \
+            else np.bincount(sorted_bins, weights=self.pixel_weights, minlength=num_bins)
+        self.solid_angle = np.bincount(sorted_bins,
+                                       weights=screenObj.solid_angle.ravel()[self.pixel_index],
+                                       minlength=num_bins,
+        )
+        self._filled_bins = np.flatnonzero(num_pixels)
+        self._segment_starts = np.concatenate([[0], np.cumsum(num_pixels)[:-1]])[self._filled_bins]
+
+        # Bin of each pixel (-1 outside max_twotheta), for stacks stored as pixel lists
+        self._bin_map = np.full(self.npix**2, -1)
+        self._bin_map[self.pixel_index] = sorted_bins
+        self._pixel_counts = None if pixel_counts is None else pixel_counts.ravel()
+
+    @property
+    def num_bins(self):
+        """
+        Number of 2theta bins
+        """
+        return len(self.bins)
+
+    def reduce(self, stack, weighting='sum'):
+        """
+        Method to bin a stack of images by 2theta
+
+        ARGS:
+        stack (ndarray): intensities (pixels x pixels x images)
+        weighting (str): one of WEIGHTINGS
+
+        RETURNS:
+        ndarray (images x bins)
+        """
+
+        assert (weighting in WEIGHTINGS), \
+            "Error in RadialBins.reduce: weighting must be one of {}.".format(WEIGHTINGS)
+
+        num_images = stack.shape[2]
+
+        binned = np.zeros((num_images, self.num_bins))
+        if len(self._filled_bins) > 0:
+            # Blocks of frames are gathered in turn, so memory-mapped stacks
+            # are never read into memory as a whole
+            frames_per_block = max(1, MAX_BLOCK_BYTES // (8 * self.npix**2))
+            for start in range(0, num_images, frames_per_block):
+                block = slice(start, start+frames_per_block)
+                flat_block = np.asarray(stack[:, :, block], dtype=np.float64).reshape(self.npix**2, -1)
+                gathered = flat_block[self.pixel_index]
+                if self.pixel_weights is not None:
+                    gathered *= self.pixel_weights[:, np.newaxis]
+                binned[block, self._filled_bins] = np.add.reduceat(gathered, self._segment_starts, axis=0).T
+
+        return self._weight(binned, weighting)
+
+    def reduce_sparse(self, frames, num_images, weighting='sum'):
+        """
+        Method to bin a stack stored as the lists of its brightest pixels
+        (see sparse.SparseFrames.records) by 2theta, without rebuilding its frames
+
+        ARGS:
+        frames (iterable): (image index, flat pixel indices, intensities) of each stored frame
+        num_images (int): number of images in the stack
+        weighting (str): one of WEIGHTINGS
+
+        RETURNS:
+        ndarray (images x bins)
+        """
+
+        assert (weighting in WEIGHTINGS), \
+            "Error in RadialBins.reduce_sparse: weighting must be one of {}.".format(WEIGHTINGS)
+
+        binned = np.zeros((num_images, self.num_bins))
+        for index, pixels, values in frames:
+            pixel_bins = self._bin_map[pixels]
+            on_screen = pixel_bins >= 0
+            weights = values[on_screen].astype(np.float64)
+            if self._pixel_counts is not None:
+                weights *= self._pixel_counts[pixels[on_screen]]
+            binned[index] = np.bincount(pixel_bins[on_screen], weights=weights, minlength=self.num_bins)
+
+        return self._weight(binned, weighting)
+
+    def _weight(self, binned, weighting):
+        """
+        Method to apply the weighting to binned intensities (images x bins), in place
+        """
+
+        if weighting == 'mean':
+            binned[:, self._filled_bins] /= self.counts[self._filled_bins]
+        elif weighting == 'solid_angle':
+            binned[:, self._filled_bins] /= self.solid_angle[self._filled_bins]
+
+        return binned
+
+
+def get_radial_bins(screenObj, num_bins=None):
+    """
+    Get the 2theta bin index map of a screen, computed once per screen
+
+    ARGS:
+    screenObj (Screen): the detector screen
+    num_bins (int): number of 2theta bins (default: npix//2)
+
+    RETURNS:
+    RadialBins object
+    """
+
+    if not hasattr(screenObj, '_radial_bins'):
+        screenObj._radial_bins = {}
+    if num_bins not in screenObj._radial_bins:
+        screenObj._radial_bins[num_bins] = RadialBins(screenObj, num_bins)
+
+    return screenObj._radial_bins[num_bins]
@@ -0,0 +1,450 @@
+"""
+pyrallex2.structure_factor.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import hashlib
+
+import numpy as np
+from tqdm import tqdm
+
+from . import instrument as Instrument
+from . import kernels as Kernels
+from . import lattice as Lattice
+
+
+# Number of atoms evaluated per batched phase product. Each chunk allocates
+# a (pixels x chunk) complex array, so this trades speed against memory.
+DEFAULT_ATOM_CHUNK = 256
+
+# Maximum absolute deviation of the normalised intensities (peak = 1) of the
+# grouped engine from the per-atom reference engine at each precision, as
+# checked by the bench precision task. The two engines perform the same sums
+# in a different order, so only rounding differs, growing with the number of
+# atoms (measured up to 2.5e-15 in double and 2.8e-6 in single precision).
+REFERENCE_TOLERANCE = {
+    'double': 1.e-13,
+    'single': 1.e-5,
+}
+
+# Approximate number of bytes of per-pixel temporaries in grouped_form_factor
+# and lattice.lattice_term, excluding the (pixels x atom_chunk) phase block
+PIXEL_OVERHEAD_BYTES = 256
+
+
+class ElementGroups:
+    """
+    Class encapsulating the atoms of a sample grouped by element
+    """
+
+    def __init__(
+            self,
+            elements=None,
+            charges=None,
+            atom_ks=None,
+            element_index=None,
+            frac_positions=None,
+    ):
+        """
+        Initialise an ElementGroups object
+
+        ARGS:
+            elements (ndarray): names of the distinct elements in the sample
+            charges (ndarray): charge of each distinct element
+            atom_ks (ndarray): Gaussian factor of each distinct element
+            element_index (ndarray): index into elements for each atom
+            frac_positions (ndarray): fractional coordinates of atoms (N x 3)
+        """
+
+        self.elements = elements
+        self.charges = charges
+        self.atom_ks = atom_ks
+        self.element_index = element_index
+        self.frac_positions = frac_positions
+
+    @property
+    def num_elements(self):
+        """
+        Number of distinct elements in the sample
+        """
+        return len(self.elements)
+
+    def positions_of(self, elem):
+        """
+        Method to get the fractional positions of all atoms of an element
+
+        ARGS:
+        elem (int): index of the element
+
+        RETURNS:
+        ndarray
+        """
+        return self.frac_positions[self.element_index == elem]
+
+
+class PlaneStore:
+    """
+    Class encapsulating an in-memory store of form factor planes, with the
+    interface of cache.CacheEntry (e.g. to share planes across the points of a sweep)
+    """
+
+    def __init__(
+            self,
+            planes=None,
+    ):
+        """
+        Initialise a PlaneStore object
+
+        ARGS:
+            planes (dict): stored planes by name
+        """
+
+        self.planes = {} if planes is None else planes
+
+    def load_array(self, name):
+        """
+        Method to get a stored plane (None if not stored)
+        """
+        return self.planes.get(name)
+
+    def store_array(self, name, array):
+        """
+        Method to store a plane
+        """
+        self.planes[name] = array
+
+
+class FormFactorTable:
+    """
+    Class encapsulating the Gaussian form factor planes of elements on a screen
+
+    One plane is stored per distinct element (rather than per atom), and planes
+    are shared across runs through an optional store (e.g. a geometry cache entry).
+    """
+
+    def __init__(
+            self,
+            ssq2_const=None,
+            store=None,
+    ):
+        """
+        Initialise a FormFactorTable object
+
+        ARGS:
+            ssq2_const (ndarray): -pi^2 * |s|^2 at each pixel
+            store (CacheEntry): persistent store of planes for this screen geometry
+        """
+
+        self.ssq2_const = ssq2_const
+        self.store = store
+        self._planes = {}
+
+    @staticmethod
+    def plane_name(element, charge, atom_k):
+        """
+        Name of the plane of an element in the store
+
+        RETURNS:
+        str
+        """
+        digest = hashlib.sha256('{}:{!r}:{!r}'.format(element, float(charge), float(atom_k)).encode())
+        return 'fs0_{}_{}'.format(element, digest.hexdigest()[:12])
+
+    def plane(self, element, charge, atom_k):
+        """
+        Method to get the form factor plane of an element
+
+        ARGS:
+        element (str): name of the element
+        charge (float): charge of the element
+        atom_k (float): Gaussian factor of the element
+
+        RETURNS:
+        ndarray (pixels x pixels)
+        """
+
+        name = self.plane_name(element, charge, atom_k)
+        if name not in self._planes:
+            plane = None
+            if self.store is not None:
+                plane = self.store.load_array(name)
+            if plane is None:
+                plane = charge * np.exp(self.ssq2_const / atom_k)
+                if self.store is not None:
+                    self.store.store_array(name, plane)
+            self._planes[name] = plane
+
+        return self._planes[name]
+
+    def planes(self, groups):
+        """
+        Method to get the form factor planes of all elements of a sample
+
+        ARGS:
+        groups (ElementGroups): atoms of the sample grouped by element
+
+        RETURNS:
+        ndarray (pixels x pixels x elements)
+        """
+        return np.stack([self.plane(element, charge, atom_k)
+                         for element, charge, atom_k in zip(groups.elements, groups.charges, groups.atom_ks)],
+                        axis=-1)
+
+
+def group_atoms(sampleObj):
+    """
+    Group the atoms of a sample by element
+
+    ARGS:
+    sampleObj (Sample): the sample to be grouped
+
+    RETURNS:
+    ElementGroups object
+    """
+
+    return ElementGroups(elements=sampleObj.elements,
+                         charges=sampleObj.charges,
+                         atom_ks=sampleObj.atom_ks,
+                         element_index=sampleObj.element_index,
+                         frac_positions=sampleObj.frac_positions,
+    )
+
+
+@Instrument.timed('atom_sum')
+def grouped_form_factor(
+        screen_hkl,
+        fs0_planes,
+        groups,
+        atom_chunk=DEFAULT_ATOM_CHUNK,
+        progress=None,
+        backend='numpy',
+):
+    """
+    Structure factor summed over all atoms, grouped by element
+
+    The phase sum of each element is evaluated as a batched matrix product of
+    the pixel Miller indices with blocks of atomic fractional positions, and
+    multiplied by the form factor of the element only once. The computation
+    keeps the precision of screen_hkl (float32 -> complex64, float64 -> complex128).
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel (... x 3)
+    fs0_planes (ndarray): form factor of each element at each pixel (... x elements)
+    groups (ElementGroups): atoms of the sample grouped by element
+    atom_chunk (int): number of atoms per batched product
+    progress (tqdm): progress bar updated with the number of atoms processed
+    backend (str): 'numpy', or 'numba' for the fused compiled kernel (see kernels.fused_form_factor)
+
+    RETURNS:
+    ndarray (complex, same shape as the pixel axes of screen_hkl)
+    """
+
+    if backend == 'numba':
+        return Kernels.fused_form_factor(screen_hkl, fs0_planes, groups, progress=progress)
+
+    pix_shape = screen_hkl.shape[:-1]
+    hkl_flat = screen_hkl.reshape(-1, 3)
+    fs0_flat = fs0_planes.reshape(-1, groups.num_elements)
+
+    complex_dtype = np.result_type(hkl_flat.dtype, np.complex64)
+
+    form_factor = np.zeros(hkl_flat.shape[0], dtype=complex_dtype)
+    for elem in range(groups.num_elements):
+        positions = groups.positions_of(elem)
+        # Real and imaginary parts are summed separately: real cos/sin are
+        # vectorised by numpy (notably in single precision), complex exp is not
+        cos_sum = np.zeros(hkl_flat.shape[0], dtype=hkl_flat.dtype)
+        sin_sum = np.zeros(hkl_flat.shape[0], dtype=hkl_flat.dtype)
+        for start in range(0, len(positions), atom_chunk):
+            block = (2 * np.pi * positions[start:start+atom_chunk].T).astype(hkl_flat.dtype)
+            phases = hkl_flat @ block
+            cos_sum += np.cos(phases).sum(axis=1)
+            sin_sum += np.sin(phases).sum(axis=1)
+            del phases
+            if progress is not None:
+                progress.update(block.shape[1])
+        form_factor += fs0_flat[:, elem] * (cos_sum + 1j*sin_sum).astype(complex_dtype)
+
+    return form_factor.reshape(pix_shape)
+
+
+def lattice_form_factor(
+        screen_hkl,
+        fs0_planes,
+        groups,
+        supercell_dims,
+        lattice_mode='full',
+        peak_fringes=Lattice.DEFAULT_PEAK_FRINGES,
+        atom_chunk=DEFAULT_ATOM_CHUNK,
+        progress=None,
+        backend='numpy',
+):
+    """
+    Structure factor of the supercell, i.e. the grouped structure factor of
+    the unit cell multiplied once by the interference term of the supercell
+
+    In narrow-peak mode, the structure factor is only evaluated at pixels near
+    reciprocal lattice points (see lattice.narrow_lattice_term).
+
+    ARGS:
+    screen_hkl (ndarray): Miller indices at each pixel (... x 3)
+    fs0_planes (ndarray): form factor of each element at each pixel (... x elements)
+    groups (ElementGroups): atoms of the sample grouped by element
+    supercell_dims (list): dimensions of the supercell
+    lattice_mode (str): 'full' or 'narrow' (see lattice.LATTICE_MODES)
+    peak_fringes (int): half-width of the evaluated windows in narrow-peak mode, in fringes
+    atom_chunk (int): number of atoms per batched product
+    progress (tqdm): progress bar updated with the number of atoms processed
+    backend (str): structure-factor backend (see kernels.BACKENDS)
+
+    RETURNS:
+    ndarray (complex, same shape as the pixel axes of screen_hkl)
+    """
+
+    if lattice_mode == 'narrow':
+        term, peaks = Lattice.narrow_lattice_term(screen_hkl, supercell_dims,
+                                                  peak_fringes=peak_fringes, dtype=screen_hkl.dtype)
+        form_factor = np.zeros(term.shape, dtype=np.result_type(screen_hkl.dtype, np.complex64))
+        form_factor[peaks] = grouped_form_factor(screen_hkl[peaks],
+                                                 fs0_planes[peaks],
+                                                 groups,
+                                                 atom_chunk=atom_chunk,
+                                                 progress=progress,
+                                                 backend=backend,
+        )
+    else:
+        form_factor = grouped_form_factor(screen_hkl,
+                                          fs0_planes,
+                                          groups,
+                                          atom_chunk=atom_chunk,
+                                          progress=progress,
+                                          backend=backend,
+        )
+        term = Lattice.lattice_term(screen_hkl, supercell_dims, dtype=screen_hkl.dtype)
+
+    form_factor *= term
+
+    return form_factor
+
+
+def scan_tiles(
+        out,
+        screen_s,
+        two_theta,
+        fs0_planes,
+        groups,
+        cell_vec,
+        supercell_dims,
+        bs_coverage,
+        rows=None,
+        atom_chunk=DEFAULT_ATOM_CHUNK,
+        progress=None,
+        lattice_mode='full',
+        peak_fringes=Lattice.DEFAULT_PEAK_FRINGES,
+        backend='numpy',
+):
+    """
+    Normalised intensities of a single scan, computed in blocks of screen rows
+    and written into the output image tile by tile
+
+    ARGS:
+    out (ndarray): output image (pixels x pixels), overwritten
+    screen_s (ndarray): scattering vectors at each pixel
+    two_theta (ndarray): 2theta at each pixel
+    fs0_planes (ndarray): form factor of each element at each pixel
+    groups (ElementGroups): atoms of the sample grouped by element
+    cell_vec (ndarray): cell vectors at the orientation of the scan
+    supercell_dims (list): dimensions of the supercell
+    bs_coverage (float): angular coverage of the backstop
+    rows (int): number of screen rows per tile (None for a single tile)
+    atom_chunk (int): number of atoms per batched product
+    progress (tqdm): progress bar updated with the number of atoms processed
+    lattice_mode (str): 'full' or 'narrow' (see lattice.LATTICE_MODES)
+    peak_fringes (int): half-width of the evaluated windows in narrow-peak mode, in fringes
+    backend (str): structure-factor backend (see kernels.BACKENDS)
+
+    RETURNS:
+    float (largest intensity of the image before normalisation)
+    """
+
+    npix = screen_s.shape[0]
+    if rows is None:
+        rows = npix
+
+    max_intensity = 0.
+    for row_start in range(0, npix, rows):
+        tile = slice(row_start, row_start+rows)
+        screen_hkl = np.matmul(screen_s[tile], cell_vec.T.astype(screen_s.dtype))
+
+        tile_form_factor = lattice_form_factor(screen_hkl,
+                                               fs0_planes[tile],
+                                               groups,
+                                               supercell_dims,
+                                               lattice_mode=lattice_mode,
+                                               peak_fringes=peak_fringes,
+                                               atom_chunk=atom_chunk,
+                                               progress=progress,
+                                               backend=backend,
+        )
+        del screen_hkl
+
+        # Blot out centre
+        tile_form_factor[two_theta[tile] < bs_coverage] = 0
+
+        tile_intensities = np.abs(tile_form_factor)**2
+        max_intensity = max(max_intensity, np.max(tile_intensities))
+        out[tile] = tile_intensities
+        del tile_form_factor, tile_intensities
+
+    # Normalise the whole image once all tiles are in place (frames may be
+    # empty in narrow-peak mode if no pixel is near a reciprocal lattice point)
+    if max_intensity > 0:
+        out /= max_intensity
+
+    return max_intensity
+
+
+def tile_rows(npix, atom_chunk, max_memory_mb, itemsize=8):
+    """
+    Number of screen rows per tile so that the temporaries of a tile fit in
+    the given memory budget
+
+    ARGS:
+    npix (int): number of pixels along each screen axis
+    atom_chunk (int): number of atoms per batched phase product
+    max_memory_mb (float): memory budget of a tile (in MB)
+    itemsize (int): size of a real number of the scan (4 single / 8 double precision)
+
+    RETURNS:
+    int
+    """
+
+    # Real phase product and its cosine and sine per atom in the chunk
+    bytes_per_pixel = 3*itemsize * atom_chunk + PIXEL_OVERHEAD_BYTES
+    rows = int(max_memory_mb * 1024**2) // (npix * bytes_per_pixel)
+
+    return int(np.clip(rows, 1, npix))
+
+
+def atom_progress(num_atoms, leave):
+    """
+    Create the progress bar used when scanning through atoms
+
+    ARGS:
+    num_atoms (int): total number of atoms
+    leave (bool): whether the bar is kept after completion
+
+    RETURNS:
+    tqdm object
+    """
+
+    return tqdm(total=num_atoms,
+                desc='Scanning through atoms...              ',
+                ncols=150,
+                position=1,
+                leave=leave,
+                bar_format='{l_bar}{bar:50}{r_bar}{bar:-10b}',
+    )
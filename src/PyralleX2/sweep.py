@@ -0,0 +1,421 @@
+"""
+pyrallex2.sweep.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import os
+import copy
+import json
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import kernels as Kernels
+from . import sample as Sample
+from . import beam as Beam
+from . import screen as Screen
+from . import simulation as Simulation
+from . import structure_factor as SF
+from . import lattice as Lattice
+from . import sparse as Sparse
+
+
+# Parameters (as "group.name") on which each shared setup object depends.
+# Points of a sweep which agree on them share the object.
+SAMPLE_PARAMS = ['sample.sample_file', 'sample.cell_type', 'sample.cell_vec']
+SCREEN_PARAMS = ['screen.pixels', 'screen.dimensions', 'screen.shape', 'screen.max_2_theta', 'beam.vector']
+GEOMETRY_PARAMS = SCREEN_PARAMS + ['beam.wavelength']
+
+# Plan of the worker process, restored in _init_worker
+_worker_plan = {}
+
+
+def get_param(params, name):
+    """
+    Get a parameter of a config
+
+    ARGS:
+    params (dict): parameters of the config
+    name (str): name of the parameter, as "group.name"
+
+    RETURNS:
+    value of the parameter
+    """
+
+    group, key = name.split('.', 1)
+    assert (group in params and key in params[group]), \
+        "Error in sweep.get_param: parameter {} not found in config.".format(name)
+
+    return params[group][key]
+
+
+def expand_grid(grid):
+    """
+    Expand a parameter grid into the list of its points
+
+    ARGS:
+    grid (dict): list of values of each swept parameter (as "group.name")
+
+    RETURNS:
+    list of dict
+    """
+
+    assert (len(grid) > 0), \
+        "Error in sweep.expand_grid: grid must contain at least one parameter."
+    for name, values in grid.items():
+        assert (isinstance(values, list) and len(values) > 0), \
+            "Error in sweep.expand_grid: values of {} must be a non-empty list.".format(name)
+
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def point_params(base_params, point):
+    """
+    Parameters of a point of a sweep
+
+    ARGS:
+    base_params (dict): parameters of the base config
+    point (dict): values of the swept parameters
+
+    RETURNS:
+    dict
+    """
+
+    params = copy.deepcopy(base_params)
+    for name, value in point.items():
+        get_param(params, name)
+        group, key = name.split('.', 1)
+        params[group][key] = value
+
+    return params
+
+
+def point_hash(point):
+    """
+    Short content address of a point of a sweep, used to name its outputs
+
+    ARGS:
+    point (dict): values of the swept parameters
+
+    RETURNS:
+    str
+    """
+    return hashlib.sha256(json.dumps(point, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def point_filename(filename, hash_in):
+    """
+    Name of an output file of a point of a sweep
+
+    ARGS:
+    filename (str): name of the output file in the base config
+    hash_in (str): hash of the point
+
+    RETURNS:
+    str
+    """
+
+    stem, ext = os.path.splitext(filename)
+    return '{}_{}{}'.format(stem, hash_in, ext)
+
+
+def setup_key(params, names):
+    """
+    Key of a shared setup object of a point of a sweep
+
+    ARGS:
+    params (dict): parameters of the point
+    names (list): parameters on which the object depends
+
+    RETURNS:
+    str
+    """
+    return json.dumps([get_param(params, name) for name in names])
+
+
+class SweepPlan:
+    """
+    Class encapsulating the plan of a parameter sweep
+
+    Setup objects which only depend on parameters that agree across points
+    (sample arrays, screen geometry, per-element form factor planes) are built
+    once and reused by all such points.
+    """
+
+    def __init__(
+            self,
+            base_params=None,
+            grid=None,
+    ):
+        """
+        Initialise a SweepPlan object
+
+        ARGS:
+            base_params (dict): parameters of the base config
+            grid (dict): list of values of each swept parameter (as "group.name")
+        """
+
+        self.base_params = base_params
+        self.points = expand_grid(grid)
+        self.params = [point_params(base_params, point) for point in self.points]
+        self.hashes = [point_hash(point) for point in self.points]
+
+        # Shared setup objects by setup key
+        self.samples = {}
+        self.arrays = {}
+        self._screens = {}
+
+    @property
+    def num_points(self):
+        """
+        Number of points of the sweep
+        """
+        return len(self.points)
+
+    def build(self):
+        """
+        Method to build the shared setup objects of all points
+        """
+
+        for params in self.params:
+            sample_key = setup_key(params, SAMPLE_PARAMS)
+            if sample_key not in self.samples:
+                self.samples[sample_key] = Sample.create_sample(coords_file=params['sample']['sample_file'],
+                                                                cell_type=params['sample']['cell_type'],
+                                                                cell_vec=params['sample']['cell_vec'],
+                                                                supercell_dims=params['sample']['supercell_dims'],
+                )
+
+            screen = self.screen(params)
+
+            geometry_key = setup_key(params, GEOMETRY_PARAMS)
+            if ('geometry', geometry_key) not in self.arrays:
+                beam = Beam.create_beam(wavelength=params['beam']['wavelength'],
+                                        beam_vec=params['beam']['vector'],
+                )
+                self.arrays[('geometry', geometry_key)] = Simulation.screen_geometry(screen, beam)
+                self.arrays[('fs0', geometry_key)] = {}
+
+            # Planes are named per element, so samples sharing elements share them
+            SF.FormFactorTable(self.arrays[('geometry', geometry_key)]['ssq2_const'],
+                               store=SF.PlaneStore(self.arrays[('fs0', geometry_key)]),
+            ).planes(SF.group_atoms(self.samples[sample_key]))
+
+    def screen(self, params):
+        """
+        Method to get the (shared) screen of a point
+
+        ARGS:
+        params (dict): parameters of the point
+
+        RETURNS:
+        Screen object
+        """
+
+        screen_key = setup_key(params, SCREEN_PARAMS)
+        if screen_key not in self._screens:
+            arrays = self.arrays.get(('screen', screen_key))
+            self._screens[screen_key] = Screen.create_screen(npix=params['screen']['pixels'],
+                                                             dims=params['screen']['dimensions'],
+                                                             screen_shape=params['screen']['shape'],
+                                                             max_twotheta=params['screen']['max_2_theta'],
+                                                             beam_axis=params['beam']['vector'],
+                                                             arrays=arrays,
+            )
+            if arrays is None:
+                self.arrays[('screen', screen_key)] = {
+                    'coords': self._screens[screen_key].coords,
+                    'two_theta': self._screens[screen_key].two_theta,
+                    'solid_angle': self._screens[screen_key].solid_angle,
+                }
+
+        return self._screens[screen_key]
+
+    def worker_plan(self):
+        """
+        Method to get a copy of the plan without its (large) arrays, to be
+        sent to worker processes
+
+        RETURNS:
+        SweepPlan object
+        """
+
+        plan = copy.copy(self)
+        plan.arrays = {}
+        plan._screens = {}
+
+        return plan
+
+    def run_point(self, index_in, num_workers=1):
+        """
+        Method to simulate a point of the sweep and export its outputs
+
+        ARGS:
+        index_in (int): index of the point
+        num_workers (int): number of processes computing the frames of the point
+
+        RETURNS:
+        dict (record of the point)
+        """
+
+        params = self.params[index_in]
+        hash_in = self.hashes[index_in]
+
+        sample = self.samples[setup_key(params, SAMPLE_PARAMS)].copy(
+            supercell_dims=params['sample']['supercell_dims'])
+        sample.centre()
+        beam = Beam.create_beam(wavelength=params['beam']['wavelength'],
+                                beam_vec=params['beam']['vector'],
+        )
+        screen = self.screen(params)
+
+        geometry_key = setup_key(params, GEOMETRY_PARAMS)
+        mrc_name = point_filename(params['output']['output_file'], hash_in)
+        spectra_name = ''
+        if len(params['output']['spectra_file']) > 0:
+            spectra_name = point_filename(params['output']['spectra_file'], hash_in)
+
+        image = Simulation.create_simulation(
+            sample,
+            screen,
+            beam,
+            mct=params['simulation']['run_tomo'],
+            mct_rot_axis=params['simulation']['rotational_axis'],
+            mct_angle_step=params['simulation']['angle_step'],
+            mct_max_angle=params['simulation']['max_angle'],
+            bs_coverage=params['output']['backstop_coverage'],
+            sf_engine=params['simulation'].get('sf_engine', 'grouped'),
+            atom_chunk=params['simulation'].get('atom_chunk', SF.DEFAULT_ATOM_CHUNK),
+            max_memory_mb=params['simulation'].get('max_memory_mb', 0),
+            num_workers=num_workers,
+            stream_file=mrc_name if params['output'].get('stream', False) else None,
+            geometry=self.arrays[('geometry', geometry_key)],
+            fs0_store=SF.PlaneStore(self.arrays[('fs0', geometry_key)]),
+            lattice_mode=params['simulation'].get('lattice_mode', 'full'),
+            peak_fringes=params['simulation'].get('peak_fringes', Lattice.DEFAULT_PEAK_FRINGES),
+            precision=params['simulation'].get('precision', 'double'),
+            sf_backend=params['simulation'].get('sf_backend', 'numpy'),
+            mct_update=params['simulation'].get('tomo_update', 'direct'),
+            pyramid_file=mrc_name,
+            pyramid_levels=params['output'].get('pyramid_levels', 0),
+            output_format=params['output'].get('format', 'mrc'),
+            output_metadata=params,
+            sparse_threshold=params['output'].get('sparse_threshold', Sparse.DEFAULT_THRESHOLD),
+            sparse_top_k=params['output'].get('sparse_top_k', 0),
+        )
+        image.full_scan()
+
+        Simulation.export_stack(mrc_name, image)
+        if len(spectra_name) > 0:
+            Simulation.export_spectra(spectra_name, image,
+                                      weighting=params['output'].get('spectra_weighting', 'sum'),
+                                      num_bins=params['output'].get('spectra_bins', 0) or None)
+        reflections_name = ''
+        if len(params['output'].get('reflections_file', '')) > 0 and image.sf_engine == 'bragg':
+            reflections_name = point_filename(params['output']['reflections_file'], hash_in)
+            Simulation.export_reflections(reflections_name, image)
+
+        return {
+            'hash': hash_in,
+            'point': self.points[index_in],
+            'output_file': mrc_name,
+            'spectra_file': spectra_name,
+            'reflections_file': reflections_name,
+        }
+
+
+def _init_worker(plan, array_specs):
+    """
+    Initialise a worker process with the plan and its shared arrays
+
+    ARGS:
+    plan (SweepPlan): plan without its arrays (see SweepPlan.worker_plan)
+    array_specs (dict): specs of the shared arrays, by (group, key, name)
+    """
+
+    from . import parallel as Parallel
+
+    handles = []
+    for (group, key, name), spec in array_specs.items():
+        shm, array = Parallel.attach(spec)
+        handles.append(shm)
+        plan.arrays.setdefault((group, key), {})[name] = array
+
+    _worker_plan['plan'] = plan
+    _worker_plan['handles'] = handles
+
+
+def _run_point(index_in):
+    """
+    Simulate a point of the sweep in a worker process
+
+    ARGS:
+    index_in (int): index of the point
+
+    RETURNS:
+    dict (record of the point)
+    """
+    return _worker_plan['plan'].run_point(index_in)
+
+
+def run_sweep(base_params, grid, num_workers=1):
+    """
+    Simulate all points of a parameter sweep
+
+    Outputs of each point are named after the base config's output files with
+    the hash of the point appended, and a manifest of all points is written
+    next to them. Checkpointing is not supported in sweeps.
+
+    ARGS:
+    base_params (dict): parameters of the base config
+    grid (dict): list of values of each swept parameter (as "group.name")
+    num_workers (int): number of points simulated in parallel
+
+    RETURNS:
+    list of dict (records of the points)
+    """
+
+    plan = SweepPlan(base_params, grid)
+    plan.build()
+    print("Sweep of {} points ({} samples, {} screen geometries)".format(
+        plan.num_points, len(plan.samples), sum(group == 'geometry' for group, _ in plan.arrays)))
+
+    if num_workers == 1:
+        records = [plan.run_point(index, num_workers=base_params['simulation'].get('num_workers', 1))
+                   for index in range(plan.num_points)]
+    else:
+        from . import parallel as Parallel
+
+        # Points share the setup arrays of the parent through shared memory
+        shared = {(group, key, name): Parallel.SharedArray(array)
+                  for (group, key), arrays in plan.arrays.items()
+                  for name, array in arrays.items()}
+        records = [None] * plan.num_points
+
+        # Workers are spawned rather than forked if any point runs the compiled kernel
+        backends = [params['simulation'].get('sf_backend', 'numpy') for params in plan.params]
+        backend = 'numba' if 'numba' in backends else 'numpy'
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     mp_context=Kernels.pool_context(backend),
+                                     initializer=_init_worker,
+                                     initargs=(plan.worker_plan(), {name: array.spec for name, array in shared.items()}),
+            ) as pool:
+                futures = {pool.submit(_run_point, index): index for index in range(plan.num_points)}
+                for future in as_completed(futures):
+                    records[futures[future]] = future.result()
+                    print("Sweep point {} done: {}".format(records[futures[future]]['hash'],
+                                                           records[futures[future]]['point']))
+        finally:
+            for array in shared.values():
+                array.release()
+
+    manifest_name = os.path.splitext(base_params['output']['output_file'])[0] + '_sweep.json'
+    with open(manifest_name, 'w') as f:
+        json.dump({'grid': grid, 'points': records}, f, indent=4)
+
+    return records
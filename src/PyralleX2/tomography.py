@@ -0,0 +1,137 @@
+"""
+pyrallex2.tomography.py
+Version: 0.1
+
+AUTHOR: Neville Yee
+Date: 18-Oct-2026
+"""
+
+import numpy as np
+
+
+# Frames of a rotation series computed independently ('direct'), or from
+# quantities cached over the series ('incremental')
+UPDATE_MODES = ['direct', 'incremental']
+
+
+class RotationSeries:
+    """
+    Class encapsulating the screen Miller indices over a rotation series,
+    split into parts which are invariant under the rotation
+    """
+
+    def __init__(
+            self,
+            screen_s=None,
+            cell_vec=None,
+            rot_axis=None,
+            angle_step=None,
+    ):
+        """
+        Initialise a RotationSeries object
+
+        With R_n the rotation of frame n about the unit axis u, the Miller
+        indices s R_n C^T split into the projection of s onto the axis, which
+        is fixed, and the components normal to it, which turn by the rotation
+        angle. Keeping the latter as a complex array z, each frame is
+            hkl_n = axial + Re(z exp(i n step))
+
+        ARGS:
+            screen_s (ndarray): scattering vectors at each pixel
+            cell_vec (ndarray): cell vectors of the sample at the first frame (rows)
+            rot_axis (list): rotation axis of the series
+            angle_step (float): angle between frames (in degrees)
+        """
+
+        dtype = screen_s.dtype
+        rot_axis = np.array(rot_axis, dtype=np.float64)
+        rot_axis /= np.linalg.norm(rot_axis)
+        cell_vec = np.array(cell_vec, dtype=np.float64)
+
+        axial_proj = np.outer(rot_axis, rot_axis)
+        cross_matrix = np.array([[0., -rot_axis[2], rot_axis[1]],
+                                 [rot_axis[2], 0., -rot_axis[0]],
+                                 [-rot_axis[1], rot_axis[0], 0.]])
+
+        # s R_n = s (u u^T) + cos(n step) s (I - u u^T) + sin(n step) s [u]x
+        self.axial = (screen_s @ (axial_proj @ cell_vec.T)).astype(dtype, copy=False)
+        radial_cos = screen_s @ ((np.eye(3) - axial_proj) @ cell_vec.T)
+        radial_sin = screen_s @ (cross_matrix @ cell_vec.T)
+        self.radial = (radial_cos - 1j*radial_sin).astype(np.result_type(dtype, np.complex64), copy=False)
+
+        self.dtype = dtype
+        self.angle_step = angle_step
+
+    def screen_hkl(self, index_in):
+        """
+        Method to get the Miller indices of the screen at a given frame
+
+        The phase of the radial part is taken from the frame index rather than
+        accumulated frame by frame, so frames carry no rounding error from
+        earlier ones and may be requested in any order.
+
+        ARGS:
+        index_in (int): index of image in tomogram
+
+        RETURNS:
+        ndarray
+        """
+
+        turn = np.exp(1j * np.deg2rad(index_in*self.angle_step)).astype(self.radial.dtype)
+
+        return self.axial + (self.radial * turn).real
+
+
+def half_turn_frames(angle_step):
+    """
+    Number of frames spanning half a turn of a rotation series
+
+    ARGS:
+    angle_step (float): angle between frames (in degrees)
+
+    RETURNS:
+    int, or None if half a turn is not a whole number of frames
+    """
+
+    num_frames = 180. / angle_step
+    if not np.isclose(num_frames, np.rint(num_frames)):
+        return None
+
+    return int(np.rint(num_frames))
+
+
+def mirror_pixels(coords, beam_vec, rot_axis, tolerance=1.e-5):
+    """
+    Pixels of the screen mapped onto each other by the mirror through the
+    plane normal to the rotation axis
+
+    With the beam normal to the rotation axis the mirror maps the Ewald sphere
+    onto itself, and as atomic form factors are real (Friedel's law), the frame
+    half a turn after another is its mirror image on the screen.
+
+    ARGS:
+    coords (ndarray): normalised coordinates of pixels on screen
+    beam_vec (ndarray): beam vector
+    rot_axis (list): rotation axis of the series
+    tolerance (float): largest mismatch of mirrored pixel coordinates
+
+    RETURNS:
+    ndarray (flat index of the mirror of each pixel, or the number of pixels
+    where it falls off the screen), or None if the beam is not normal to the axis
+    """
+
+    from scipy.spatial import cKDTree
+
+    rot_axis = np.array(rot_axis, dtype=np.float64)
+    rot_axis /= np.linalg.norm(rot_axis)
+    beam_vec = np.array(beam_vec, dtype=np.float64)
+    beam_vec /= np.linalg.norm(beam_vec)
+
+    if abs(beam_vec @ rot_axis) > tolerance:
+        return None
+
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    mirrored = coords - 2 * (coords @ rot_axis)[:, np.newaxis] * rot_axis
+    _, source = cKDTree(coords).query(mirrored, distance_upper_bound=tolerance)
+
+    return source
@@ -4,22 +4,42 @@ PyralleX2.visualise.py
 Author: Neville B.-y. Yee
 Date: 20-Feb-2021
 
-Version: 0.1
+Version: 0.2
 """
 
 import os
+import queue
+import threading
+from collections import OrderedDict
+
 import mrcfile
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider
 
+from . import output as Output
+
+
+# Largest number of pixels along each axis of a displayed frame
+DEFAULT_DISPLAY_PIX = 1024
+
+# Number of display frames kept by the viewer
+DEFAULT_CACHE_FRAMES = 32
+
+# Number of frames on either side of the displayed one loaded in the background
+DEFAULT_PREFETCH = 2
+
+# Delay (in ms) after the last slider move before the figure is redrawn
+DEFAULT_DEBOUNCE_MS = 30
+
+
 def extract_image(mrc_in, image_no):
     """
     Extracts image from stack
 
     Args:
-    mrc_in (str): Name of mrc file including images
+    mrc_in (str): Name of file including images (MRC or HDF5, see output.open_stack)
     image_no (int): Index of image in stack
 
     Returns:
@@ -30,12 +50,153 @@ def extract_image(mrc_in, image_no):
     assert (os.path.isfile(mrc_in)), \
         "Error in visualise.extract_image: File not found."
 
-    with mrcfile.open(mrc_in) as mrc:
-        data = mrc.data
-        assert (image_no < data.shape[0]), \
-            "Error in visualise.extract_image: input image index exceeds stack size ({}).".format(data.shape[0])
+    # Only the requested image is read from the file
+    with Output.open_stack(mrc_in) as stack:
+        assert (image_no < stack.num_images), \
+            "Error in visualise.extract_image: input image index exceeds stack size ({}).".format(stack.num_images)
+        image = stack.frame(image_no)
+
+    return image
+
+
+def downsample(image, max_pix=DEFAULT_DISPLAY_PIX):
+    """
+    Reduce an image to at most max_pix pixels along each axis, keeping the
+    largest intensity of each block so that sharp peaks remain visible
+
+    Args:
+    image (nparray): image (pixels x pixels)
+    max_pix (int): largest number of pixels along each axis
+
+    Returns:
+    nparray
+    """
+
+    factor = -(-max(image.shape) // max_pix)
+    if factor <= 1:
+        return np.array(image)
 
-    return data[image_no, :, :]
+    padded = np.pad(image, [(0, -size % factor) for size in image.shape])
+
+    return padded.reshape(padded.shape[0]//factor, factor, padded.shape[1]//factor, factor).max(axis=(1, 3))
+
+
+class FrameCache:
+    """
+    Class encapsulating the gamma-corrected, downsampled frames of a stack
+    shown by the viewer, loaded on demand (or ahead of time by a background
+    thread) and kept for the most recently used frames only
+    """
+
+    def __init__(
+            self,
+            stack=None,
+            max_pix=DEFAULT_DISPLAY_PIX,
+            max_frames=DEFAULT_CACHE_FRAMES,
+    ):
+        """
+        Initialise a FrameCache object
+
+        Args:
+            stack (nparray): stack of images (images x pixels x pixels), e.g. memory-mapped
+            max_pix (int): largest number of pixels along each axis of a displayed frame
+            max_frames (int): number of frames kept
+        """
+
+        self.stack = stack
+        self.max_pix = max_pix
+        self.max_frames = max_frames
+
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._worker = None
+
+    def _load(self, index, gamma):
+        """
+        Method to read, downsample and gamma-correct a frame of the stack
+        """
+        return downsample(self.stack[index], self.max_pix)**gamma
+
+    def _store(self, key, frame):
+        """
+        Method to add a frame, dropping the least recently used frames beyond max_frames
+        """
+        with self._lock:
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+    def get(self, index, gamma):
+        """
+        Method to get a display frame
+
+        Args:
+        index (int): index of image in stack
+        gamma (float): gamma correction of the intensities
+
+        Returns:
+        nparray
+        """
+
+        key = (index, gamma)
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+
+        frame = self._load(index, gamma)
+        self._store(key, frame)
+
+        return frame
+
+    def prefetch(self, indices, gamma):
+        """
+        Method to queue frames to be loaded in the background, replacing any
+        frames still queued by earlier calls
+
+        Args:
+        indices (list): indices of images in stack (those outside the stack are ignored)
+        gamma (float): gamma correction of the intensities
+        """
+
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._prefetch_frames, daemon=True)
+            self._worker.start()
+
+        while True:
+            try:
+                self._requests.get_nowait()
+            except queue.Empty:
+                break
+
+        for index in indices:
+            if 0 <= index < self.stack.shape[0]:
+                self._requests.put((index, gamma))
+
+    def _prefetch_frames(self):
+        """
+        Method run by the background thread, loading queued frames until close
+        """
+        while True:
+            key = self._requests.get()
+            if key is None:
+                return
+            with self._lock:
+                cached = key in self._frames
+            if not cached:
+                self._store(key, self._load(*key))
+
+    def close(self):
+        """
+        Method to stop the background thread, which must not read the stack once it is closed
+        """
+        if self._worker is not None:
+            self.prefetch([], None)
+            self._requests.put(None)
+            self._worker.join()
+            self._worker = None
 
 
 def display_image(
@@ -43,23 +204,38 @@ def display_image(
         spec_in,
         figsize,
         cmap,
+        max_pix=DEFAULT_DISPLAY_PIX,
+        cache_frames=DEFAULT_CACHE_FRAMES,
+        prefetch=DEFAULT_PREFETCH,
+        debounce_ms=DEFAULT_DEBOUNCE_MS,
 ):
     """
     Plot image using matplotlib
 
+    The stack is memory-mapped and frames are read as they are displayed
+    (see FrameCache), so the viewer opens in constant time for any stack size.
+    Frames are always read at full resolution: the levels of a pyramid hold
+    block means, which would flatten sharp peaks that downsample keeps.
+
     Args:
-    mrc_in (str): file containing intensities
+    mrc_in (str): file containing intensities (MRC or HDF5, see output.open_stack)
     spec_in (str): file containing spectral data
     figsize (float): size (in inches) of displayed figure
     cmap (str): colour map code in matplotlib
+    max_pix (int): largest number of pixels along each axis of a displayed frame
+    cache_frames (int): number of display frames kept
+    prefetch (int): number of frames on either side of the displayed one loaded in the background
+    debounce_ms (float): delay (in ms) after the last slider move before the figure is redrawn
     """
 
     # Check if input file is valid
     assert (os.path.isfile(mrc_in)), \
         "Error in visualise.display_image: MRC file not found."
 
-    with mrcfile.open(mrc_in) as mrc:
-        data = mrc.data
+    stack = Output.open_stack(mrc_in)
+    data = stack.data
+    npix = data.shape[1]
+    frames = FrameCache(data, max_pix=max_pix, max_frames=cache_frames)
 
     assert (os.path.isfile(spec_in)), \
         "Error in visualise.display_image: Spec file not found."
@@ -70,9 +246,9 @@ def display_image(
     fig, ax = plt.subplots(1, 2, figsize=(figsize*2+1, figsize))
     fig.subplots_adjust(left=0.05, bottom=0.18, right=0.95, top=0.95)
 
-    # set default to slice 0 with gamma=0.5
-    image = data[0]**0.5
-    show_obj = ax[0].imshow(image.T, cmap=cmap)
+    # set default to slice 0 with gamma=0.5; downsampled frames span the
+    # full-resolution pixel range of the axes
+    show_obj = ax[0].imshow(frames.get(0, 0.5).T, cmap=cmap, extent=(-0.5, npix-0.5, npix-0.5, -0.5))
 
     spec_x = spectra[0]
     spec_y = spectra[1]
@@ -86,18 +262,47 @@ def display_image(
     ax = fig.add_axes([0.15, 0.1, 0.75, 0.03])
     slider = Slider(ax, 'Image index:', 0, data.shape[0]-1, valinit=0, valfmt='%i')
 
-    def update(val):
+    def neighbours(index):
         """
-        Method to update image according to slider value
+        Indices of the frames prefetched around a displayed frame
+        """
+        return [index + sign*step for step in range(1, prefetch+1) for sign in [1, -1]]
+
+    def redraw():
+        """
+        Method to draw the frame selected by the sliders
         """
         index = int(slider.val)
-        gamma = float(gamma_slider.val)
-        image = data[index]**gamma
-        show_obj.set_data(image.T)
+        # Rounded, so that gamma slider moves do not fill the cache with near-identical frames
+        gamma = round(float(gamma_slider.val), 2)
+        show_obj.set_data(frames.get(index, gamma).T)
         spec_plot.set_ydata(spectra[index+1])
-        fig.canvas.draw()
+        fig.canvas.draw_idle()
+        frames.prefetch(neighbours(index), gamma)
+
+    # Slider moves (re)start a single-shot timer, so only the last of a burst is drawn
+    redraw_timer = fig.canvas.new_timer(interval=debounce_ms)
+    redraw_timer.single_shot = True
+    redraw_timer.add_callback(redraw)
+
+    def update(val):
+        """
+        Method to update image according to slider value
+        """
+        redraw_timer.stop()
+        redraw_timer.start()
 
     slider.on_changed(update)
     gamma_slider.on_changed(update)
 
+    def close(event):
+        """
+        Method to release the stack once the figure is closed
+        """
+        frames.close()
+        stack.close()
+
+    fig.canvas.mpl_connect('close_event', close)
+    frames.prefetch(neighbours(0), 0.5)
+
     plt.show()